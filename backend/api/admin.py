@@ -1,13 +1,38 @@
+from django import forms
 from django.contrib import admin
-from .models import Email, Label, EmailLabel, UserPreference, EmailAccount, UserSubscription
+from .models import Email, Label, EmailLabel, UserPreference, EmailAccount, UserSubscription, PriorityRule
+from .mailbox_service import apply_bulk_operation, record_email_changes
+from .mailbox_stats import STATE_FIELDS, email_state, record_created, record_state_change
+from .thread_service import assign_threads
+from .priority_rules import apply_priority_rules
+
+
+class EmailAdminForm(forms.ModelForm):
+    """Edits the body, which lives in EmailContent rather than on the Email row"""
+    body = forms.CharField(widget=forms.Textarea)
+    
+    class Meta:
+        model = Email
+        fields = '__all__'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['body'].initial = self.instance.body
+    
+    def save(self, commit=True):
+        self.instance.body = self.cleaned_data['body']
+        return super().save(commit)
 
 
 @admin.register(Email)
 class EmailAdmin(admin.ModelAdmin):
     list_display = ['subject', 'sender', 'recipient', 'priority', 'is_read', 'is_starred', 'is_archived', 'is_trashed', 'created_at']
     list_filter = ['is_read', 'is_starred', 'is_archived', 'is_trashed', 'priority', 'created_at']
-    search_fields = ['subject', 'sender', 'recipient', 'body']
+    search_fields = ['subject', 'sender', 'recipient', 'snippet']  # Bodies are stored compressed
     date_hierarchy = 'created_at'
+    form = EmailAdminForm
+    readonly_fields = ['email_account', 'thread', 'snippet']
     actions = ['mark_as_read', 'archive_emails', 'trash_emails']
     
     def get_queryset(self, request):
@@ -40,24 +65,43 @@ class EmailAdmin(admin.ModelAdmin):
         """Auto-assign current user when creating email"""
         if not change:
             obj.user = request.user
+            apply_priority_rules(obj.user_id, [obj])
+            assign_threads(obj.user_id, [(obj, '')])
+        else:
+            # The form has already written its values onto obj
+            before = Email.objects.filter(pk=obj.pk).values_list(*STATE_FIELDS).first()
         super().save_model(request, obj, form, change)
+        if change:
+            record_state_change(obj.user_id, [before] if before else [], [email_state(obj)])
+        else:
+            record_created(obj.user_id, [obj])
+        record_email_changes(obj.user_id, [obj.id], event='email.updated' if change else 'email.created')
+    
+    def delete_model(self, request, obj):
+        email_id, thread_id, before = obj.id, obj.thread_id, email_state(obj)
+        super().delete_model(request, obj)
+        record_state_change(obj.user_id, [before])
+        record_email_changes(obj.user_id, [email_id], deleted=True, thread_ids=[thread_id])
+    
+    def delete_queryset(self, request, queryset):
+        apply_bulk_operation(request.user.id, queryset.filter(user=request.user), 'permanent_delete')
     
     def mark_as_read(self, request, queryset):
         # Only affect user's own emails
         queryset = queryset.filter(user=request.user)
-        queryset.update(is_read=True)
+        apply_bulk_operation(request.user.id, queryset, 'mark_read')
         self.message_user(request, f"{queryset.count()} emails marked as read")
     mark_as_read.short_description = "Mark selected emails as read"
     
     def archive_emails(self, request, queryset):
         queryset = queryset.filter(user=request.user)
-        queryset.update(is_archived=True, is_trashed=False)
+        apply_bulk_operation(request.user.id, queryset, 'archive')
         self.message_user(request, f"{queryset.count()} emails archived")
     archive_emails.short_description = "Archive selected emails"
     
     def trash_emails(self, request, queryset):
         queryset = queryset.filter(user=request.user)
-        queryset.update(is_trashed=True, is_archived=False)
+        apply_bulk_operation(request.user.id, queryset, 'trash')
         self.message_user(request, f"{queryset.count()} emails moved to trash")
     trash_emails.short_description = "Move selected emails to trash"
 
@@ -96,6 +140,23 @@ class LabelAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+@admin.register(PriorityRule)
+class PriorityRuleAdmin(admin.ModelAdmin):
+    list_display = ['pattern', 'kind', 'priority', 'user', 'updated_at']
+    list_filter = ['kind', 'priority']
+    search_fields = ['pattern']
+    
+    def get_queryset(self, request):
+        """PRIVACY: Users can only see their OWN rules"""
+        return super().get_queryset(request).filter(user=request.user)
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.user = request.user
+        obj.pattern = ' '.join(obj.pattern.split()).lower()
+        super().save_model(request, obj, form, change)
+
+
 @admin.register(EmailLabel)
 class EmailLabelAdmin(admin.ModelAdmin):
     list_display = ['email', 'label', 'created_at']
@@ -0,0 +1,217 @@
+"""
+Content-hash cache for Gemini results
+Results are keyed by a hash of (operation, model, prompt), kept in a small
+in-process LRU in front of the AIResultCache table shared by all workers
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+
+STATS_PREFIX = 'ai:cache:stats'
+
+OPERATIONS = ('priority', 'summary', 'reply')
+
+# Outcomes counted per operation: served from memory, from the table, or computed
+OUTCOMES = ('memory_hits', 'db_hits', 'misses')
+
+# Table writes between size checks in each process
+PRUNE_INTERVAL = 200
+
+_memory = OrderedDict()  # key -> (expires_at timestamp, result)
+_memory_lock = threading.Lock()
+_writes_since_prune = 0
+
+
+def _ttl() -> int:
+    return getattr(settings, 'AI_CACHE_TTL', 30 * 24 * 3600)
+
+
+def cache_key(operation: str, model: str, prompt: str) -> str:
+    """
+    Hash of everything that determines a result
+
+    Keying on the rendered prompt rather than the raw fields means a change
+    to a prompt template never serves results produced by the old one.
+    """
+    payload = json.dumps([operation, model, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_result(operation: str, model: str, prompt: str, compute: Callable):
+    """
+    Cached result for a prompt, computing and storing it on a miss
+
+    Args:
+        operation: One of OPERATIONS
+        model: Model name, so switching models starts a fresh cache
+        prompt: The exact prompt sent to the model
+        compute: Called on a miss; exceptions propagate and nothing is stored
+
+    Returns:
+        A copy of the result, so callers may modify it freely
+    """
+    if _ttl() <= 0:
+        return compute()
+    result = get_cached(operation, model, prompt)
+    if result is None:
+        result = compute()
+        store_result(operation, model, prompt, result)
+    return result
+
+
+def get_cached(operation: str, model: str, prompt: str):
+    """A copy of the cached result for a prompt, or None; counts the outcome"""
+    if _ttl() <= 0:
+        return None
+
+    key = cache_key(operation, model, prompt)
+    result = _memory_get(key)
+    if result is not None:
+        _increment(operation, 'memory_hits')
+        return copy.deepcopy(result)
+
+    from .models import AIResultCache
+    entry = AIResultCache.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+    if entry is not None:
+        AIResultCache.objects.filter(key=key).update(hits=F('hits') + 1, last_used_at=timezone.now())
+        _memory_set(key, entry.result, entry.expires_at.timestamp())
+        _increment(operation, 'db_hits')
+        return copy.deepcopy(entry.result)
+
+    _increment(operation, 'misses')
+    return None
+
+
+def store_result(operation: str, model: str, prompt: str, result) -> None:
+    """Store a freshly computed result in both tiers"""
+    global _writes_since_prune
+    if _ttl() <= 0:
+        return
+    from .models import AIResultCache
+    key = cache_key(operation, model, prompt)
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=_ttl())
+    AIResultCache.objects.update_or_create(key=key, defaults={
+        'operation': operation,
+        'model': model,
+        'result': result,
+        'created_at': now,
+        'expires_at': expires_at,
+        'last_used_at': now,
+        'hits': 0,
+    })
+    _memory_set(key, copy.deepcopy(result), expires_at.timestamp())
+
+    _writes_since_prune += 1
+    if _writes_since_prune >= PRUNE_INTERVAL:
+        _writes_since_prune = 0
+        prune()
+
+
+def _memory_get(key: str):
+    with _memory_lock:
+        item = _memory.get(key)
+        if item is None:
+            return None
+        expires_at, result = item
+        if expires_at <= time.time():
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return result
+
+
+def _memory_set(key: str, result, expires_at: float) -> None:
+    max_entries = getattr(settings, 'AI_CACHE_MEMORY_ENTRIES', 512)
+    if max_entries <= 0:
+        return
+    with _memory_lock:
+        _memory[key] = (expires_at, result)
+        _memory.move_to_end(key)
+        while len(_memory) > max_entries:
+            _memory.popitem(last=False)
+
+
+def clear_memory() -> None:
+    """Empty this process's LRU tier; the table is left as is"""
+    with _memory_lock:
+        _memory.clear()
+
+
+def prune(max_entries: int = None) -> int:
+    """
+    Delete expired results, then the least recently used beyond the size cap
+
+    Args:
+        max_entries: Rows to keep (defaults to AI_CACHE_MAX_ENTRIES)
+
+    Returns:
+        Number of rows deleted
+    """
+    from .models import AIResultCache
+    if max_entries is None:
+        max_entries = getattr(settings, 'AI_CACHE_MAX_ENTRIES', 50000)
+    deleted, _ = AIResultCache.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    # The newest row past the cap marks where eviction starts
+    cutoff = (
+        AIResultCache.objects.order_by('-last_used_at', '-key')
+        .values_list('last_used_at', flat=True)[max_entries:max_entries + 1]
+    )
+    cutoff = list(cutoff)
+    if cutoff:
+        evicted, _ = AIResultCache.objects.filter(last_used_at__lte=cutoff[0]).delete()
+        deleted += evicted
+    return deleted
+
+
+def _stats_cache():
+    return caches[getattr(settings, 'EMAIL_LIST_CACHE_ALIAS', 'default')]
+
+
+def _increment(operation: str, outcome: str) -> None:
+    cache = _stats_cache()
+    key = f"{STATS_PREFIX}:{operation}:{outcome}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats() -> Dict:
+    """
+    Hits per tier, misses and hit ratio per operation since the last reset
+
+    Like the list cache counters these live in the Django cache, so they
+    cover every worker only with a shared backend.
+    """
+    cache = _stats_cache()
+    counts = cache.get_many([
+        f"{STATS_PREFIX}:{operation}:{outcome}" for operation in OPERATIONS for outcome in OUTCOMES
+    ])
+    stats = {}
+    for operation in OPERATIONS:
+        row = {outcome: counts.get(f"{STATS_PREFIX}:{operation}:{outcome}", 0) for outcome in OUTCOMES}
+        hits = row['memory_hits'] + row['db_hits']
+        total = hits + row['misses']
+        row['hit_ratio'] = round(hits / total, 4) if total else 0.0
+        stats[operation] = row
+    return stats
+
+
+def reset_stats() -> None:
+    _stats_cache().delete_many([
+        f"{STATS_PREFIX}:{operation}:{outcome}" for operation in OPERATIONS for outcome in OUTCOMES
+    ])
@@ -0,0 +1,225 @@
+"""
+Cross-process scheduler for Gemini requests
+Rate limit buckets and the circuit breaker live in one small state file
+under an exclusive lock, so every worker process on the host shares them
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+import requests
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limits then apply per process
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# Failures worth retrying: quota, overload, timeouts and server faults
+TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,  # Includes ResourceExhausted
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Requests a full bucket allows back to back
+BURST = 10
+
+# A request that would wait longer than this for a token fails instead
+MAX_TOKEN_WAIT = 30
+
+# Longest pause between retries, in seconds
+MAX_RETRY_DELAY = 20
+
+# Buckets untouched this long are full again and dropped from the state
+IDLE_BUCKET_SECONDS = 600
+
+_local_lock = threading.Lock()
+
+
+class AIUnavailable(Exception):
+    """Gemini is over the request rate or the circuit breaker is open"""
+
+
+@contextmanager
+def _locked_state():
+    """The shared state, written back when the block exits"""
+    path = settings.GEMINI_SCHEDULER_STATE
+    with _local_lock, open(path, 'a+') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        handle.seek(0)
+        try:
+            state = json.loads(handle.read() or '{}')
+        except ValueError:
+            state = {}
+        yield state
+        handle.seek(0)
+        handle.truncate()
+        handle.write(json.dumps(state))
+        handle.flush()
+
+
+def _refill(buckets, name: str, per_minute: int, now: float) -> float:
+    """Top up a bucket; returns 0 if it has a token, else seconds until it will"""
+    rate = per_minute / 60.0
+    capacity = max(1.0, min(per_minute, BURST))
+    tokens, updated = buckets.get(name, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    buckets[name] = [tokens, now]
+    return 0 if tokens >= 1 else (1 - tokens) / rate
+
+
+def acquire(user_id: Optional[int] = None) -> None:
+    """
+    Wait for a request slot in the global and per-user buckets
+
+    The per-user bucket keeps one user's batch from using up the shared
+    quota. Tokens are only taken when both buckets have one.
+
+    Raises:
+        AIUnavailable: The breaker is open, or the wait would exceed MAX_TOKEN_WAIT
+    """
+    limits = [('global', getattr(settings, 'GEMINI_REQUESTS_PER_MINUTE', 60))]
+    if user_id is not None:
+        limits.append((f'user:{user_id}', getattr(settings, 'GEMINI_USER_REQUESTS_PER_MINUTE', 20)))
+    limits = [(name, per_minute) for name, per_minute in limits if per_minute > 0]
+
+    waited = 0.0
+    while True:
+        with _locked_state() as state:
+            now = time.time()
+            if not _breaker_allows(state, now):
+                raise AIUnavailable('Gemini circuit breaker is open')
+            buckets = state.setdefault('buckets', {})
+            wait = max([_refill(buckets, name, per_minute, now) for name, per_minute in limits] or [0])
+            if not wait:
+                for name, _ in limits:
+                    buckets[name][0] -= 1
+                for name in [name for name, (_, updated) in buckets.items() if now - updated > IDLE_BUCKET_SECONDS]:
+                    del buckets[name]
+                return
+        if waited + wait > MAX_TOKEN_WAIT:
+            raise AIUnavailable('Gemini request rate limit reached')
+        # Jitter so waiting workers don't all wake on the same tick
+        wait += random.uniform(0, 0.05)
+        time.sleep(wait)
+        waited += wait
+
+
+def _breaker_allows(state, now: float) -> bool:
+    breaker = state.setdefault('breaker', {'failures': 0, 'open_until': 0})
+    if not breaker['open_until']:
+        return True
+    if now < breaker['open_until']:
+        return False
+    # Half open: this request probes, the rest keep failing fast meanwhile
+    breaker['open_until'] = now + getattr(settings, 'GEMINI_BREAKER_COOLDOWN', 60)
+    return True
+
+
+def _record_outcome(success: bool) -> None:
+    with _locked_state() as state:
+        breaker = state.setdefault('breaker', {'failures': 0, 'open_until': 0})
+        if success:
+            breaker.update(failures=0, open_until=0)
+            return
+        breaker['failures'] += 1
+        if breaker['failures'] >= getattr(settings, 'GEMINI_BREAKER_THRESHOLD', 5):
+            breaker['open_until'] = time.time() + getattr(settings, 'GEMINI_BREAKER_COOLDOWN', 60)
+            logger.warning("Gemini circuit breaker opened after %s failed requests", breaker['failures'])
+
+
+def call(request: Callable, user_id: Optional[int] = None):
+    """
+    Run a Gemini request within the shared limits
+
+    Transient errors are retried with exponential backoff and jitter, each
+    attempt taking a new token. A request that still fails counts towards
+    the circuit breaker, which opens after GEMINI_BREAKER_THRESHOLD failures
+    in a row and fails requests fast for GEMINI_BREAKER_COOLDOWN seconds
+    before letting one probe through. Other errors (bad requests, blocked
+    prompts) are raised at once and don't affect the breaker.
+
+    Args:
+        request: Makes the API call
+        user_id: User the request is made for, for the per-user bucket
+
+    Raises:
+        AIUnavailable: Rate limited or breaker open; use a local fallback
+    """
+    retries = getattr(settings, 'GEMINI_MAX_RETRIES', 3)
+    base_delay = getattr(settings, 'GEMINI_RETRY_BASE_DELAY', 1.0)
+    for attempt in range(retries + 1):
+        acquire(user_id)
+        try:
+            result = request()
+        except TRANSIENT_ERRORS as e:
+            if attempt == retries:
+                _record_outcome(False)
+                raise
+            _wait_to_retry(e, attempt, base_delay)
+            continue
+        _record_outcome(True)
+        return result
+
+
+def stream(request: Callable[[], Iterable], user_id: Optional[int] = None) -> Iterator:
+    """
+    Run a streaming Gemini request within the shared limits, yielding its chunks
+
+    As call(), except that a streamed request only fails or succeeds when
+    its last chunk arrives, so the outcome is recorded then. A transient
+    error before the first chunk is retried; after it the caller has
+    already passed partial output on, so the error is raised instead.
+    A consumer that stops early records nothing.
+
+    Raises:
+        AIUnavailable: Rate limited or breaker open; use a local fallback
+    """
+    retries = getattr(settings, 'GEMINI_MAX_RETRIES', 3)
+    base_delay = getattr(settings, 'GEMINI_RETRY_BASE_DELAY', 1.0)
+    for attempt in range(retries + 1):
+        acquire(user_id)
+        started = False
+        try:
+            for chunk in request():
+                started = True
+                yield chunk
+        except TRANSIENT_ERRORS as e:
+            if started or attempt == retries:
+                _record_outcome(False)
+                raise
+            _wait_to_retry(e, attempt, base_delay)
+            continue
+        _record_outcome(True)
+        return
+
+
+def _wait_to_retry(error: Exception, attempt: int, base_delay: float) -> None:
+    """Exponential backoff with jitter before retry number attempt + 1"""
+    delay = min(MAX_RETRY_DELAY, base_delay * 2 ** attempt)
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    logger.warning("Gemini request failed (%s), retrying in %.1fs", error, delay)
+    time.sleep(delay)
+
+
+def breaker_state() -> dict:
+    """Current breaker failures and open_until timestamp (0 when closed)"""
+    with _locked_state() as state:
+        return dict(state.get('breaker', {'failures': 0, 'open_until': 0}))
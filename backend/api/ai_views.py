@@ -5,21 +5,127 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+import orjson
+from .events import format_sse
 from .gemini_service import get_gemini_service
-from .models import Email
+from .local_classifier import predict_priorities
+from .models import ColdEmail, Email
+
+
+def _local_priorities(request, emails):
+    """
+    Confident local predictions for email dicts, None where Gemini is needed
+
+    Send "engine": "gemini" to skip the local classifier.
+    """
+    if request.data.get('engine') == 'gemini':
+        return [None] * len(emails)
+    min_confidence = getattr(settings, 'LOCAL_PRIORITY_MIN_CONFIDENCE', 0.7)
+    predictions = predict_priorities(request.user.id, [
+        (email.get('sender', ''), email.get('subject', ''), email.get('body', '')) for email in emails
+    ])
+    return [
+        prediction if prediction is not None and prediction[1] >= min_confidence else None
+        for prediction in predictions
+    ]
+
+
+def _source_email(request, body_error):
+    """
+    (subject, body, sender) of the email in the request, or an error Response
+    
+    Reads a saved email, hot or cold, when "email_id" is given, else the
+    posted fields.
+    """
+    email_id = request.data.get('email_id')
+    
+    # If email_id provided, fetch from database
+    if email_id:
+        email = Email.objects.filter(id=email_id, user=request.user).first()
+        if email is None:
+            cold = ColdEmail.objects.filter(id=email_id, user=request.user).first()
+            email = cold.to_email() if cold is not None else None
+        if email is None:
+            return Response(
+                {'error': 'Email not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return email.subject, email.body, email.sender
+    
+    # Use provided data
+    body = request.data.get('body', '')
+    if not body:
+        return Response(
+            {'error': body_error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return request.data.get('subject', ''), body, request.data.get('sender', '')
+
+
+async def _iterate_in_thread(iterator):
+    """
+    Pull a blocking iterator from worker threads as an async iterator
+    
+    Under ASGI Django buffers a synchronous streaming body to the end, so
+    streams are handed over this way to reach the client chunk by chunk.
+    """
+    sentinel = object()
+    pull = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            item = await pull(iterator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+    finally:
+        # The client went away: let the generator clean up (cancel requests)
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
+
+
+def _streaming_response(request, chunks, content_type):
+    """StreamingHttpResponse that reaches the client chunk by chunk under WSGI and ASGI"""
+    if isinstance(request._request, ASGIRequest):
+        chunks = _iterate_in_thread(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+
+def _sse_response(request, events):
+    """Server-Sent Events response for (event type, data) pairs"""
+    frames = (format_sse({'type': event, 'data': data}) for event, data in events)
+    response = _streaming_response(request, frames, 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _stream_priorities(emails, local, remote_results):
+    """NDJSON lines for emails in order; local ones are ready, remote ones are awaited"""
+    for email, prediction in zip(emails, local):
+        if prediction is None:
+            _, email['ai_priority'] = next(remote_results)
+            email['source'] = 'gemini'
+        yield orjson.dumps(email) + b'\n'
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def detect_email_priority(request):
     """
-    Detect email priority using Gemini AI
+    Detect email priority with the user's local classifier, or Gemini AI
     
     POST /api/ai/detect-priority/
     Body: {
         "subject": "Email subject",
         "body": "Email body",
-        "sender": "sender@email.com"
+        "sender": "sender@email.com",
+        "engine": "gemini"  // optional: skip the local classifier
     }
     """
     try:
@@ -33,11 +139,21 @@ def detect_email_priority(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        local = _local_priorities(request, [{'subject': subject, 'body': body, 'sender': sender}])[0]
+        if local is not None:
+            return Response({
+                'priority': local[0],
+                'source': 'local',
+                'confidence': round(local[1], 3),
+                'message': f'Email priority detected as {local[0]}'
+            })
+        
         gemini = get_gemini_service()
-        priority = gemini.detect_email_priority(subject, body, sender)
+        priority = gemini.detect_email_priority(subject, body, sender, user_id=request.user.id)
         
         return Response({
             'priority': priority,
+            'source': 'gemini',
             'message': f'Email priority detected as {priority}'
         })
         
@@ -63,34 +179,13 @@ def summarize_email(request):
     }
     """
     try:
-        email_id = request.data.get('email_id')
-        
-        # If email_id provided, fetch from database
-        if email_id:
-            try:
-                email = Email.objects.get(id=email_id, user=request.user)
-                subject = email.subject
-                body = email.body
-                sender = email.sender
-            except Email.DoesNotExist:
-                return Response(
-                    {'error': 'Email not found'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        else:
-            # Use provided data
-            subject = request.data.get('subject', '')
-            body = request.data.get('body', '')
-            sender = request.data.get('sender', '')
-            
-            if not body:
-                return Response(
-                    {'error': 'Email body is required'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        source = _source_email(request, 'Email body is required')
+        if isinstance(source, Response):
+            return source
+        subject, body, sender = source
         
         gemini = get_gemini_service()
-        summary = gemini.summarize_email(subject, body, sender)
+        summary = gemini.summarize_email(subject, body, sender, user_id=request.user.id)
         
         return Response({
             'summary': summary,
@@ -121,31 +216,10 @@ def generate_reply(request):
     }
     """
     try:
-        email_id = request.data.get('email_id')
-        
-        # If email_id provided, fetch from database
-        if email_id:
-            try:
-                email = Email.objects.get(id=email_id, user=request.user)
-                subject = email.subject
-                body = email.body
-                sender = email.sender
-            except Email.DoesNotExist:
-                return Response(
-                    {'error': 'Email not found'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        else:
-            # Use provided data
-            subject = request.data.get('subject', '')
-            body = request.data.get('body', '')
-            sender = request.data.get('sender', '')
-            
-            if not body:
-                return Response(
-                    {'error': 'Original email body is required'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        source = _source_email(request, 'Original email body is required')
+        if isinstance(source, Response):
+            return source
+        subject, body, sender = source
         
         tone = request.data.get('tone', 'professional')
         context = request.data.get('context', '')
@@ -156,7 +230,8 @@ def generate_reply(request):
             original_body=body,
             original_sender=sender,
             reply_tone=tone,
-            context=context
+            context=context,
+            user_id=request.user.id
         )
         
         return Response({
@@ -171,6 +246,72 @@ def generate_reply(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def summarize_email_stream(request):
+    """
+    Stream an AI summary as Server-Sent Events
+    
+    POST /api/ai/summarize/stream/
+    Body: same as /api/ai/summarize/
+    
+    Events: "section" ({"section": "summary" | "key_points" | "action_items",
+    "text": "..."}) as text arrives, then "done" with the same summary
+    object /api/ai/summarize/ returns, or "error". Serve through the ASGI
+    application so a slow generation holds no worker.
+    """
+    try:
+        source = _source_email(request, 'Email body is required')
+        if isinstance(source, Response):
+            return source
+        subject, body, sender = source
+        
+        gemini = get_gemini_service()
+        return _sse_response(request, gemini.stream_summary(subject, body, sender, user_id=request.user.id))
+        
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def generate_reply_stream(request):
+    """
+    Stream an AI reply as Server-Sent Events
+    
+    POST /api/ai/generate-reply/stream/
+    Body: same as /api/ai/generate-reply/
+    
+    Events: "section" ({"section": "subject" | "body", "text": "..."}) as
+    text arrives, then "done" with the same reply object
+    /api/ai/generate-reply/ returns, or "error".
+    """
+    try:
+        source = _source_email(request, 'Original email body is required')
+        if isinstance(source, Response):
+            return source
+        subject, body, sender = source
+        
+        gemini = get_gemini_service()
+        return _sse_response(request, gemini.stream_reply(
+            original_subject=subject,
+            original_body=body,
+            original_sender=sender,
+            reply_tone=request.data.get('tone', 'professional'),
+            context=request.data.get('context', ''),
+            user_id=request.user.id
+        ))
+        
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def batch_analyze_priorities(request):
@@ -182,8 +323,12 @@ def batch_analyze_priorities(request):
         "emails": [
             {"id": 1, "subject": "...", "body": "...", "sender": "..."},
             {"id": 2, "subject": "...", "body": "...", "sender": "..."}
-        ]
+        ],
+        "stream": false  # optional
     }
+    
+    With "stream": true the emails come back as NDJSON, one line per
+    email in input order, each written as soon as it is analyzed.
     """
     try:
         emails = request.data.get('emails', [])
@@ -194,8 +339,26 @@ def batch_analyze_priorities(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        gemini = get_gemini_service()
-        analyzed = gemini.batch_analyze_emails(emails)
+        # Confident local predictions skip the network; the rest go to Gemini
+        local = _local_priorities(request, emails)
+        remote = [email for email, prediction in zip(emails, local) if prediction is None]
+        for email, prediction in zip(emails, local):
+            if prediction is not None:
+                email['ai_priority'] = prediction[0]
+                email['source'] = 'local'
+        
+        if request.data.get('stream'):
+            remote_results = (
+                get_gemini_service().iter_email_priorities(remote, request.user.id) if remote else iter(())
+            )
+            return _streaming_response(
+                request, _stream_priorities(emails, local, remote_results), 'application/x-ndjson'
+            )
+        
+        if remote:
+            for email in get_gemini_service().batch_analyze_emails(remote, request.user.id):
+                email['source'] = 'gemini'
+        analyzed = emails
         
         return Response({
             'emails': analyzed,
@@ -0,0 +1,145 @@
+"""
+Background execution of query-scoped bulk jobs
+Matching emails are processed in short keyset-ordered chunks so each
+UPDATE/DELETE only holds row locks for one chunk. A worker claims a job
+with a conditional UPDATE and renews a heartbeat every chunk, so a job
+runs in one process at a time and is only taken over once it goes stale
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .mailbox_service import filter_emails, apply_bulk_operation, rehydrate_matching
+from .models import BulkJob, Email
+
+logger = logging.getLogger(__name__)
+
+
+def _job_queryset(job: BulkJob):
+    """Emails matched by the job's filters, scoped to the job owner"""
+    return filter_emails(Email.objects.filter(user_id=job.user_id), job.filters)
+
+
+def start_bulk_job(job: BulkJob) -> None:
+    """
+    Run a bulk job in a background thread once the creating transaction commits
+    """
+    def _run():
+        try:
+            run_bulk_job(job.id)
+        finally:
+            connection.close()
+
+    def _start():
+        threading.Thread(target=_run, name=f'bulk-job-{job.id}', daemon=True).start()
+
+    transaction.on_commit(_start)
+
+
+def claim_bulk_job(job_id: int, worker: str) -> bool:
+    """
+    Take a job for this worker
+
+    Succeeds for a pending job, or a running one whose heartbeat is older
+    than BULK_JOB_STALE_AFTER_SECONDS (its worker died). The check and the
+    takeover are one UPDATE, so two workers can never both win.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'BULK_JOB_STALE_AFTER_SECONDS', 300))
+    return BulkJob.objects.filter(pk=job_id).filter(
+        Q(status='pending')
+        | Q(status='running', heartbeat_at__lt=stale)
+        | Q(status='running', heartbeat_at__isnull=True)
+    ).update(status='running', worker=worker, heartbeat_at=now, updated_at=now) == 1
+
+
+def run_bulk_job(job_id: int, chunk_size: int = None, chunk_sleep: float = None) -> BulkJob:
+    """
+    Process a bulk job chunk by chunk until it finishes or is cancelled
+
+    Resumes from the job's keyset cursor, so an interrupted job can be
+    picked up again by the run_bulk_jobs management command. A job another
+    live worker holds is left alone, and a worker that loses its job to a
+    takeover stops before its next chunk.
+
+    Args:
+        job_id: BulkJob primary key
+        chunk_size: Emails per chunk (defaults to BULK_JOB_CHUNK_SIZE)
+        chunk_sleep: Seconds to pause between chunks (defaults to BULK_JOB_CHUNK_SLEEP)
+
+    Returns:
+        The job in its current state (final, unless another worker holds it)
+    """
+    chunk_size = chunk_size or getattr(settings, 'BULK_JOB_CHUNK_SIZE', 500)
+    if chunk_sleep is None:
+        chunk_sleep = getattr(settings, 'BULK_JOB_CHUNK_SLEEP', 0.05)
+
+    worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    if not claim_bulk_job(job_id, worker):
+        return BulkJob.objects.get(pk=job_id)
+
+    job = BulkJob.objects.get(pk=job_id)
+    try:
+        if job.started_at is None:
+            # Matching cold mail comes back first so the job reaches it
+            rehydrate_matching(job.user_id, job.filters)
+            job.started_at = timezone.now()
+            job.total = _job_queryset(job).count()
+            BulkJob.objects.filter(pk=job.pk, worker=worker).update(
+                started_at=job.started_at, total=job.total, updated_at=job.started_at
+            )
+
+        while True:
+            if BulkJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+                job.status = 'cancelled'
+                break
+
+            ids = list(
+                _job_queryset(job)
+                .filter(id__gt=job.last_email_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                job.status = 'completed'
+                break
+
+            with transaction.atomic():
+                # Renewing the heartbeat locks the job row, so a takeover
+                # waits for this chunk and the chunk never runs after one
+                now = timezone.now()
+                if not BulkJob.objects.filter(pk=job.pk, worker=worker).update(heartbeat_at=now):
+                    logger.warning("Bulk job %s was taken over by another worker", job_id)
+                    return BulkJob.objects.get(pk=job_id)
+                chunk = Email.objects.filter(user_id=job.user_id, id__in=ids)
+                affected = apply_bulk_operation(job.user_id, chunk, job.operation)
+                BulkJob.objects.filter(pk=job.pk).update(
+                    processed=F('processed') + len(ids),
+                    affected=F('affected') + affected,
+                    last_email_id=ids[-1],
+                    updated_at=timezone.now(),
+                )
+            job.last_email_id = ids[-1]
+
+            if chunk_sleep:
+                time.sleep(chunk_sleep)
+
+    except Exception as e:
+        logger.exception("Bulk job %s failed", job_id)
+        job.status = 'failed'
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    BulkJob.objects.filter(pk=job.pk, worker=worker).update(
+        status=job.status, error=job.error,
+        finished_at=job.finished_at, updated_at=job.finished_at,
+    )
+    job.refresh_from_db()
+    return job
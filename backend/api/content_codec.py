@@ -0,0 +1,86 @@
+"""
+Compression for stored email content
+Bodies and raw provider payloads are compressed with zstd when the
+zstandard package is installed, zlib otherwise; each row records its codec
+"""
+import json
+import zlib
+from typing import Optional, Tuple
+from django.conf import settings
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+# Snippet length kept on the Email row for list and thread views
+SNIPPET_LENGTH = 200
+
+# Below this size compression costs more than it saves
+MIN_COMPRESS_SIZE = 64
+
+
+def default_codec() -> str:
+    """Codec for new rows: EMAIL_CONTENT_CODEC if available, else zlib"""
+    codec = getattr(settings, 'EMAIL_CONTENT_CODEC', 'zstd')
+    if codec == 'zstd' and zstandard is None:
+        return 'zlib'
+    return codec
+
+
+def compress(data: bytes, codec: Optional[str] = None) -> Tuple[str, bytes]:
+    """
+    Compress bytes for storage
+
+    Returns:
+        (codec actually used, compressed bytes); small inputs are stored as 'none'
+    """
+    codec = codec or default_codec()
+    if len(data) < MIN_COMPRESS_SIZE or codec == 'none':
+        return 'none', data
+    if codec == 'zstd':
+        level = getattr(settings, 'EMAIL_CONTENT_ZSTD_LEVEL', 3)
+        return 'zstd', zstandard.ZstdCompressor(level=level).compress(data)
+    level = getattr(settings, 'EMAIL_CONTENT_ZLIB_LEVEL', 6)
+    return 'zlib', zlib.compress(data, level)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """Reverse compress() for a stored codec"""
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed email content")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+
+def pack_text(text: str, codec: Optional[str] = None) -> Tuple[str, bytes]:
+    return compress((text or '').encode('utf-8'), codec)
+
+
+def unpack_text(codec: str, data: Optional[bytes]) -> str:
+    if data is None:
+        return ''
+    return decompress(codec, data).decode('utf-8')
+
+
+def pack_json(value, codec: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+    """Compress a JSON-serializable payload; None stays None"""
+    if value is None:
+        return 'none', None
+    return compress(json.dumps(value, separators=(',', ':'), default=str).encode('utf-8'), codec)
+
+
+def unpack_json(codec: str, data: Optional[bytes]):
+    if data is None:
+        return None
+    return json.loads(decompress(codec, data))
+
+
+def make_snippet(body: str) -> str:
+    """First SNIPPET_LENGTH characters of a body with whitespace collapsed"""
+    return ' '.join((body or '').split())[:SNIPPET_LENGTH]
@@ -0,0 +1,34 @@
+"""
+Server-Sent Events endpoint for real-time mailbox updates
+"""
+from django.http import JsonResponse, StreamingHttpResponse
+from .events import authenticate_token, stream_events
+
+
+async def mailbox_events(request):
+    """
+    Stream the current user's mailbox events
+    
+    GET /api/events/?token=<access token>
+    (or an "Authorization: Bearer <access token>" header)
+    
+    Events: email.created, email.updated, email.deleted, sync.finished,
+    counters.updated, and resync when the client fell behind. Serve this
+    through the ASGI application so idle connections cost no worker thread.
+    """
+    token = request.GET.get('token', '')
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth_header.startswith('Bearer '):
+        token = auth_header[len('Bearer '):]
+    
+    user_id = authenticate_token(token)
+    if user_id is None:
+        return JsonResponse(
+            {'error': 'Valid access token required'},
+            status=401
+        )
+    
+    response = StreamingHttpResponse(stream_events(user_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
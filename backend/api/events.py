@@ -0,0 +1,223 @@
+"""
+Real-time mailbox events
+Write paths publish per-user events to a broker; the SSE view and the
+WebSocket handler in inboxpilot/asgi.py stream them to connected clients
+"""
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+class Subscription:
+    """One connected client: a bounded queue on the client's event loop"""
+
+    def __init__(self, broker: 'BaseBroker', user_id: int, max_queue: int):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def _put(self, event: Dict) -> None:
+        """Enqueue on the subscriber's loop; a slow client drops old events"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.overflowed = True
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        """Next event, or None if nothing arrived within timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker(ABC):
+    """
+    Interface for mailbox event brokers
+
+    publish() is called from synchronous request threads; subscribe() from
+    the ASGI event loop. Swap implementations with MAILBOX_EVENT_BROKER.
+    """
+
+    @abstractmethod
+    def publish(self, user_id: int, event: Dict) -> None:
+        """Deliver event to the user's subscribers; must not block on them"""
+
+    @abstractmethod
+    def subscribe(self, user_id: int) -> Subscription:
+        """New subscription for the user, bound to the running event loop"""
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop delivering to subscription; safe to call more than once"""
+
+    def has_subscribers(self, user_id: int) -> bool:
+        """Lets publishers skip building events nobody will receive"""
+        return True
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Fan-out to subscribers connected to this process
+
+    Only sees writes made in the same process, so it fits a single ASGI
+    process; multi-process deployments need a shared broker (e.g. Redis).
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.max_queue = getattr(settings, 'MAILBOX_EVENT_QUEUE_SIZE', 100)
+
+    def publish(self, user_id: int, event: Dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # Event loop already closed; drop the dead subscriber
+                self.unsubscribe(subscription)
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(self, user_id, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return user_id in self._subscribers
+
+
+# Singleton instance
+_broker = None
+
+def get_broker() -> BaseBroker:
+    """Get or create the configured broker"""
+    global _broker
+    if _broker is None:
+        broker_path = getattr(settings, 'MAILBOX_EVENT_BROKER', 'api.events.InProcessBroker')
+        _broker = import_string(broker_path)()
+    return _broker
+
+
+def publish_mailbox_event(user_id: int, event_type: str, data: Dict) -> None:
+    """Publish one event to a user's connected clients"""
+    get_broker().publish(user_id, {'type': event_type, 'data': data})
+
+
+def authenticate_token(token: str) -> Optional[int]:
+    """
+    Validate a SimpleJWT access token without a database hit
+
+    Returns:
+        The user id from the token, or None if it is invalid or expired
+    """
+    if not token:
+        return None
+    try:
+        access = AccessToken(token)
+    except TokenError:
+        return None
+    return access.get(settings.SIMPLE_JWT['USER_ID_CLAIM'])
+
+
+def format_sse(event: Dict, event_id: Optional[int] = None) -> str:
+    """Encode an event as a Server-Sent Events frame"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], separators=(',', ':'), cls=DjangoJSONEncoder)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream_events(user_id: int):
+    """
+    Yield a user's events as SSE frames, with keepalive comments while idle
+
+    If the client falls behind and events are dropped, a 'resync' event
+    tells it to catch up through the changes feed.
+    """
+    subscription = get_broker().subscribe(user_id)
+    keepalive = getattr(settings, 'MAILBOX_EVENT_KEEPALIVE', 25)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = await subscription.get(timeout=keepalive)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_sse({'type': 'resync', 'data': {}})
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_sse(event, event['data'].get('cursor'))
+    finally:
+        subscription.close()
+
+
+async def websocket_events(scope, receive, send) -> None:
+    """
+    Raw ASGI WebSocket handler streaming a user's events as JSON messages
+
+    Connect to /ws/events/?token=<access token>.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    user_id = authenticate_token(query.get('token', [''])[0])
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    subscription = get_broker().subscribe(user_id)
+    keepalive = getattr(settings, 'MAILBOX_EVENT_KEEPALIVE', 25)
+    receiver = asyncio.ensure_future(receive())
+    try:
+        while True:
+            getter = asyncio.ensure_future(subscription.get(timeout=keepalive))
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+
+            if getter in done:
+                event = getter.result()
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    await send({'type': 'websocket.send', 'text': json.dumps({'type': 'resync', 'data': {}})})
+                if event is None:
+                    event = {'type': 'keepalive', 'data': {}}
+                await send({'type': 'websocket.send', 'text': json.dumps(event, cls=DjangoJSONEncoder)})
+            else:
+                getter.cancel()
+
+            if receiver in done:
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    return
+                # Ignore client messages other than disconnect
+                receiver = asyncio.ensure_future(receive())
+    finally:
+        receiver.cancel()
+        subscription.close()
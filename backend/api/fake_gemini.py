@@ -0,0 +1,151 @@
+"""
+Fake Gemini API server for tests and offline development
+Answers generateContent and streamGenerateContent over REST with canned,
+keyword-based results; point the app at it with GEMINI_API_ENDPOINT
+"""
+import json
+import re
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Union
+
+# HTTP status -> google.rpc status name, as the real API reports errors
+ERROR_STATUS = {
+    400: 'INVALID_ARGUMENT',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+    504: 'DEADLINE_EXCEEDED',
+}
+
+HIGH_WORDS = ('urgent', 'asap', 'critical', 'emergency', 'deadline')
+LOW_WORDS = ('newsletter', 'unsubscribe', 'promotion', 'digest', 'sale')
+
+
+def canned_priority(text: str) -> str:
+    text = text.lower()
+    if any(word in text for word in HIGH_WORDS):
+        return 'high'
+    if any(word in text for word in LOW_WORDS):
+        return 'low'
+    return 'normal'
+
+
+def canned_reply(prompt: str) -> str:
+    """A plausible answer in the format each app prompt asks for"""
+    if 'JSON array' in prompt:
+        emails = re.split(r'^\[\d+\]$', prompt.split('\nEmails:\n', 1)[-1], flags=re.M)[1:]
+        return json.dumps([
+            {'index': index, 'priority': canned_priority(email)} for index, email in enumerate(emails, 1)
+        ])
+    subject = re.search(r'^Subject: (.*)$', prompt, re.M)
+    subject = subject.group(1) if subject else ''
+    if 'ONLY one word' in prompt:
+        email = prompt.split('Priority Criteria:')[0].split('\nSender:', 1)[-1]
+        return canned_priority(email)
+    if 'SUMMARY:' in prompt:
+        return (
+            f"SUMMARY: An email about {subject or 'an unspecified topic'}.\n"
+            f"KEY_POINTS:\n• {subject or 'No subject'}\n"
+            "ACTION_ITEMS:\nNone"
+        )
+    return f"SUBJECT: Re: {subject}\nBODY:\nHello,\n\nThanks for your email.\n\nBest regards"
+
+
+class FakeGeminiServer:
+    """
+    In-process fake of the Gemini REST API
+
+        with FakeGeminiServer() as server:
+            with override_settings(GEMINI_API_ENDPOINT=server.url): ...
+
+    Responses are canned_reply() unless scripted: queue() text for the next
+    requests, or an HTTP status code to fail them. Received prompts are kept
+    in prompts.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.script = deque()
+        self.prompts: List[str] = []
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def queue(self, *responses: Union[str, int]) -> None:
+        """Script the next responses: text to return, or an HTTP error status"""
+        with self.lock:
+            self.script.extend(responses)
+
+    def start(self) -> 'FakeGeminiServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _next_response(self, prompt: str) -> Union[str, int]:
+        with self.lock:
+            self.prompts.append(prompt)
+            if self.script:
+                return self.script.popleft()
+        return canned_reply(prompt)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                prompt = ''.join(
+                    part.get('text', '')
+                    for content in request.get('contents', []) for part in content.get('parts', [])
+                )
+                response = server._next_response(prompt)
+                if isinstance(response, int):
+                    self._send(response, {'error': {
+                        'code': response,
+                        'message': 'Fake Gemini error',
+                        'status': ERROR_STATUS.get(response, 'UNKNOWN'),
+                    }})
+                elif ':streamGenerateContent' in self.path:
+                    # Three chunks, split mid-text like the real stream
+                    step = max(1, len(response) // 3)
+                    pieces = [response[i:i + step] for i in range(0, len(response), step)]
+                    self._send(200, [self._candidate(piece) for piece in pieces])
+                else:
+                    self._send(200, self._candidate(response))
+
+            def _candidate(self, text):
+                return {'candidates': [{
+                    'content': {'parts': [{'text': text}], 'role': 'model'},
+                    'finishReason': 'STOP',
+                    'index': 0,
+                }]}
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
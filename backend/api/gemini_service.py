@@ -2,9 +2,87 @@
 Google Gemini AI Integration Service
 Provides email priority detection, summarization, and reply generation
 """
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from django.conf import settings
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from . import ai_cache, ai_scheduler
+from .priority_rules import PriorityEngine
+from .prompt_reduction import estimate_tokens, reduce_body
+from .section_parser import SectionParser, parse_sections
+
+logger = logging.getLogger(__name__)
+
+# Part of every cache key, so switching models starts a fresh cache
+MODEL_NAME = 'models/gemini-2.5-flash'
+
+PRIORITIES = ('high', 'normal', 'low')
+
+# Section markers the summary and reply prompts ask for, in order
+SUMMARY_MARKERS = ('SUMMARY', 'KEY_POINTS', 'ACTION_ITEMS')
+REPLY_MARKERS = ('SUBJECT', 'BODY')
+
+PRIORITY_CRITERIA = """Priority Criteria:
+- HIGH: Urgent requests, deadlines within 24-48 hours, critical issues, important stakeholders, words like "urgent", "asap", "critical", "emergency"
+- NORMAL: Regular business correspondence, questions, updates, standard requests
+- LOW: Newsletters, promotional emails, FYI messages, non-urgent updates"""
+
+# Structured output for packed triage: one {index, priority} object per email
+PACKED_RESPONSE_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'index': {'type': 'integer'},
+            'priority': {'type': 'string', 'enum': list(PRIORITIES)},
+        },
+        'required': ['index', 'priority'],
+    },
+}
+
+# Body token budget per operation: setting name and default
+BODY_TOKEN_BUDGETS = {
+    'priority': ('AI_PRIORITY_BODY_TOKENS', 250),
+    'summary': ('AI_SUMMARY_BODY_TOKENS', 2000),
+    'reply': ('AI_REPLY_BODY_TOKENS', 1500),
+}
+
+# Tokens for the packed prompt's instructions, and per email for its header
+PACKED_PROMPT_TOKENS = 200
+PACKED_EMAIL_TOKENS = 15
+
+
+_executor = None
+_pool_lock = threading.Lock()
+
+# Built-in keyword rules, for priorities while Gemini is unavailable
+_fallback_engine = PriorityEngine()
+
+
+def local_priority(subject: str, body: str, sender: str = "") -> str:
+    """Keyword heuristic used when Gemini fails or is unavailable"""
+    return _fallback_engine.classify(sender, subject, body)
+
+
+def prompt_body(body: str, operation: str) -> str:
+    """Email body reduced for an operation's prompt (see prompt_reduction)"""
+    setting, default = BODY_TOKEN_BUDGETS[operation]
+    return reduce_body(body, getattr(settings, setting, default))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Threads for concurrent batch requests, shared so batches can't multiply them"""
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'GEMINI_BATCH_CONCURRENCY', 8),
+                thread_name_prefix='gemini'
+            )
+        return _executor
 
 
 class GeminiAIService:
@@ -14,63 +92,83 @@ class GeminiAIService:
         """Initialize Gemini with API key from settings"""
         if not settings.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is not configured in settings")
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        # Use gemini-2.0-flash - confirmed available model
-        self.model = genai.GenerativeModel('models/gemini-2.5-flash')
+        options = {}
+        if getattr(settings, 'GEMINI_API_ENDPOINT', ''):
+            # e.g. the fake server from python manage.py run_fake_gemini
+            options = {'transport': 'rest', 'client_options': {'api_endpoint': settings.GEMINI_API_ENDPOINT}}
+        genai.configure(api_key=settings.GEMINI_API_KEY, **options)
+        self.model = genai.GenerativeModel(MODEL_NAME)
     
-    def detect_email_priority(self, subject: str, body: str, sender: str = "") -> str:
-        """
-        Analyze email and detect priority level using AI
-        
-        Args:
-            subject: Email subject line
-            body: Email body content
-            sender: Sender email/name (optional)
-            
-        Returns:
-            Priority level: 'high', 'normal', or 'low'
-        """
-        prompt = f"""Analyze the following email and determine its priority level.
+    def _generate(self, prompt: str, user_id: Optional[int] = None, **kwargs):
+        """Send a prompt through the shared scheduler (rate limits, retries, breaker)"""
+        return ai_scheduler.call(
+            lambda: self.model.generate_content(
+                prompt,
+                request_options={'timeout': getattr(settings, 'GEMINI_REQUEST_TIMEOUT', 30)},
+                **kwargs
+            ),
+            user_id
+        )
+    
+    def _generate_stream(self, prompt: str, user_id: Optional[int] = None) -> Iterator:
+        """Response chunks for a prompt, streamed through the shared scheduler"""
+        return ai_scheduler.stream(
+            lambda: self.model.generate_content(
+                prompt, stream=True,
+                request_options={'timeout': getattr(settings, 'GEMINI_REQUEST_TIMEOUT', 30)}
+            ),
+            user_id
+        )
+    
+    def _priority_prompt(self, subject: str, body: str, sender: str = "") -> str:
+        return f"""Analyze the following email and determine its priority level.
 Consider urgency indicators, deadlines, importance keywords, tone, and context.
 
 Sender: {sender}
 Subject: {subject}
-Body: {body[:1000]}  # Limit to first 1000 chars for efficiency
+Body: {body}
 
-Priority Criteria:
-- HIGH: Urgent requests, deadlines within 24-48 hours, critical issues, important stakeholders, words like "urgent", "asap", "critical", "emergency"
-- NORMAL: Regular business correspondence, questions, updates, standard requests
-- LOW: Newsletters, promotional emails, FYI messages, non-urgent updates
+{PRIORITY_CRITERIA}
 
 Respond with ONLY one word: high, normal, or low"""
-
-        try:
-            response = self.model.generate_content(prompt)
-            priority = response.text.strip().lower()
-            
-            # Validate response
-            if priority in ['high', 'normal', 'low']:
-                return priority
-            else:
-                return 'normal'  # Default fallback
-                
-        except Exception as e:
-            print(f"Gemini priority detection error: {e}")
-            return 'normal'  # Fallback to normal on error
     
-    def summarize_email(self, subject: str, body: str, sender: str = "") -> Dict[str, str]:
+    def _request_priority(self, prompt: str, user_id: Optional[int] = None) -> str:
+        response = self._generate(prompt, user_id)
+        priority = response.text.strip().lower()
+        
+        # Validate response
+        if priority in ['high', 'normal', 'low']:
+            return priority
+        else:
+            return 'normal'  # Default fallback
+    
+    def detect_email_priority(
+        self, subject: str, body: str, sender: str = "", user_id: Optional[int] = None
+    ) -> str:
         """
-        Generate an intelligent summary of email content
+        Analyze email and detect priority level using AI
         
         Args:
             subject: Email subject line
             body: Email body content
             sender: Sender email/name (optional)
+            user_id: User the request is for, for per-user rate limiting (optional)
             
         Returns:
-            Dictionary with summary, key_points, and action_items
+            Priority level: 'high', 'normal', or 'low'
         """
-        prompt = f"""Analyze this email and provide a comprehensive summary.
+        prompt = self._priority_prompt(subject, prompt_body(body, 'priority'), sender)
+        try:
+            return ai_cache.cached_result(
+                'priority', MODEL_NAME, prompt, lambda: self._request_priority(prompt, user_id)
+            )
+                
+        except Exception as e:
+            logger.warning("Gemini priority detection error: %s", e)
+            return local_priority(subject, body, sender)  # Keyword fallback on error
+    
+    def _summary_prompt(self, subject: str, body: str, sender: str = "") -> str:
+        return f"""Analyze this email and provide a comprehensive summary.
 
 From: {sender}
 Subject: {subject}
@@ -91,34 +189,53 @@ ACTION_ITEMS:
 • [action 1]
 • [action 2]
 (or "None" if no actions needed)"""
-
-        try:
-            response = self.model.generate_content(prompt)
-            result = response.text.strip()
-            
-            # Parse the response
-            summary_dict = {
-                'full_summary': result,
-                'sender': sender,
-                'subject': subject
-            }
-            
-            # Extract sections
-            if 'SUMMARY:' in result:
-                summary_part = result.split('KEY_POINTS:')[0].replace('SUMMARY:', '').strip()
-                summary_dict['summary'] = summary_part
+    
+    def _parse_summary(self, result: str, subject: str, sender: str) -> Dict[str, str]:
+        summary_dict = {
+            'full_summary': result,
+            'sender': sender,
+            'subject': subject
+        }
+        
+        # Extract sections
+        sections = parse_sections(result, SUMMARY_MARKERS)
+        if 'summary' in sections:
+            summary_dict['summary'] = sections['summary']
+        
+        if 'key_points' in sections and 'action_items' in sections:
+            summary_dict['key_points'] = sections['key_points']
             
-            if 'KEY_POINTS:' in result and 'ACTION_ITEMS:' in result:
-                key_points = result.split('KEY_POINTS:')[1].split('ACTION_ITEMS:')[0].strip()
-                summary_dict['key_points'] = key_points
-                
-                action_items = result.split('ACTION_ITEMS:')[1].strip()
-                summary_dict['action_items'] = action_items if action_items.lower() != 'none' else 'No action required'
+            action_items = sections['action_items']
+            summary_dict['action_items'] = action_items if action_items.lower() != 'none' else 'No action required'
+        
+        return summary_dict
+    
+    def summarize_email(
+        self, subject: str, body: str, sender: str = "", user_id: Optional[int] = None
+    ) -> Dict[str, str]:
+        """
+        Generate an intelligent summary of email content
+        
+        Args:
+            subject: Email subject line
+            body: Email body content
+            sender: Sender email/name (optional)
+            user_id: User the request is for, for per-user rate limiting (optional)
             
-            return summary_dict
+        Returns:
+            Dictionary with summary, key_points, and action_items
+        """
+        prompt = self._summary_prompt(subject, prompt_body(body, 'summary'), sender)
+        
+        def compute():
+            response = self._generate(prompt, user_id)
+            return self._parse_summary(response.text.strip(), subject, sender)
+        
+        try:
+            return ai_cache.cached_result('summary', MODEL_NAME, prompt, compute)
             
         except Exception as e:
-            print(f"Gemini summarization error: {e}")
+            logger.warning("Gemini summarization error: %s", e)
             return {
                 'summary': f"Failed to generate summary: {str(e)}",
                 'key_points': 'Unable to extract key points',
@@ -126,27 +243,24 @@ ACTION_ITEMS:
                 'full_summary': f"Error: {str(e)}"
             }
     
-    def generate_email_reply(
-        self, 
-        original_subject: str, 
-        original_body: str, 
-        original_sender: str = "",
-        reply_tone: str = "professional",
-        context: str = ""
-    ) -> Dict[str, str]:
+    def stream_summary(
+        self, subject: str, body: str, sender: str = "", user_id: Optional[int] = None
+    ) -> Iterator[Tuple[str, Dict]]:
         """
-        Generate an intelligent, contextual email reply
+        Summarize an email, yielding sections as the model writes them
         
-        Args:
-            original_subject: Subject of email being replied to
-            original_body: Body of original email
-            original_sender: Original sender name/email
-            reply_tone: Tone of reply (professional, friendly, formal, casual)
-            context: Additional context or instructions for the reply
-            
-        Returns:
-            Dictionary with suggested_subject and reply_body
+        Yields:
+            ('section', {'section': 'summary' | 'key_points' | 'action_items', 'text': ...})
+            pieces, then ('done', <summarize_email result>) or ('error', {'error': ...})
         """
+        return self._stream_sections(
+            'summary', self._summary_prompt(subject, prompt_body(body, 'summary'), sender), SUMMARY_MARKERS,
+            lambda result: self._parse_summary(result, subject, sender), user_id
+        )
+    
+    def _reply_prompt(
+        self, original_subject: str, original_body: str, original_sender: str, reply_tone: str, context: str
+    ) -> str:
         tone_instructions = {
             'professional': 'professional and courteous',
             'friendly': 'warm and friendly while remaining professional',
@@ -156,7 +270,7 @@ ACTION_ITEMS:
         
         tone_desc = tone_instructions.get(reply_tone, 'professional and courteous')
         
-        prompt = f"""Generate a {tone_desc} reply to the following email.
+        return f"""Generate a {tone_desc} reply to the following email.
 
 Original Email:
 From: {original_sender}
@@ -176,61 +290,335 @@ Format:
 SUBJECT: [suggested reply subject]
 BODY:
 [complete email reply with greeting, body, and closing]"""
-
-        try:
-            response = self.model.generate_content(prompt)
-            result = response.text.strip()
-            
-            # Parse response
-            reply_dict = {}
-            
-            if 'SUBJECT:' in result and 'BODY:' in result:
-                subject_part = result.split('BODY:')[0].replace('SUBJECT:', '').strip()
-                body_part = result.split('BODY:')[1].strip()
-                
-                reply_dict['subject'] = subject_part
-                reply_dict['body'] = body_part
-            else:
-                # Fallback if format not followed
-                reply_dict['subject'] = f"Re: {original_subject}"
-                reply_dict['body'] = result
+    
+    def _parse_reply(self, result: str, original_subject: str) -> Dict[str, str]:
+        reply_dict = {}
+        
+        sections = parse_sections(result, REPLY_MARKERS)
+        if 'subject' in sections and 'body' in sections:
+            reply_dict['subject'] = sections['subject']
+            reply_dict['body'] = sections['body']
+        else:
+            # Fallback if format not followed
+            reply_dict['subject'] = f"Re: {original_subject}"
+            reply_dict['body'] = result
+        
+        return reply_dict
+    
+    def generate_email_reply(
+        self, 
+        original_subject: str, 
+        original_body: str, 
+        original_sender: str = "",
+        reply_tone: str = "professional",
+        context: str = "",
+        user_id: Optional[int] = None
+    ) -> Dict[str, str]:
+        """
+        Generate an intelligent, contextual email reply
+        
+        Args:
+            original_subject: Subject of email being replied to
+            original_body: Body of original email
+            original_sender: Original sender name/email
+            reply_tone: Tone of reply (professional, friendly, formal, casual)
+            context: Additional context or instructions for the reply
+            user_id: User the request is for, for per-user rate limiting (optional)
             
-            return reply_dict
+        Returns:
+            Dictionary with suggested_subject and reply_body
+        """
+        prompt = self._reply_prompt(
+            original_subject, prompt_body(original_body, 'reply'), original_sender, reply_tone, context
+        )
+        
+        def compute():
+            response = self._generate(prompt, user_id)
+            return self._parse_reply(response.text.strip(), original_subject)
+        
+        try:
+            return ai_cache.cached_result('reply', MODEL_NAME, prompt, compute)
             
         except Exception as e:
-            print(f"Gemini reply generation error: {e}")
+            logger.warning("Gemini reply generation error: %s", e)
             return {
                 'subject': f"Re: {original_subject}",
                 'body': f"Error generating reply: {str(e)}\n\nPlease compose your reply manually."
             }
     
-    def batch_analyze_emails(self, emails: list) -> list:
+    def stream_reply(
+        self,
+        original_subject: str,
+        original_body: str,
+        original_sender: str = "",
+        reply_tone: str = "professional",
+        context: str = "",
+        user_id: Optional[int] = None
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        Generate a reply, yielding sections as the model writes them
+        
+        Yields:
+            ('section', {'section': 'subject' | 'body', 'text': ...}) pieces,
+            then ('done', <generate_email_reply result>) or ('error', {'error': ...})
+        """
+        return self._stream_sections(
+            'reply',
+            self._reply_prompt(
+                original_subject, prompt_body(original_body, 'reply'), original_sender, reply_tone, context
+            ),
+            REPLY_MARKERS,
+            lambda result: self._parse_reply(result, original_subject),
+            user_id
+        )
+    
+    def _stream_sections(
+        self, operation: str, prompt: str, markers, parse, user_id: Optional[int] = None
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream a sectioned response through SectionParser
+        
+        A cached result is sent as a single 'done' event. Text before the
+        first marker is not sent as a section, only as part of the result.
+        The complete result is cached like the non-streaming call's.
+        """
+        cached = ai_cache.get_cached(operation, MODEL_NAME, prompt)
+        if cached is not None:
+            yield 'done', cached
+            return
+        
+        parser = SectionParser(markers)
+        chunks = []
+        try:
+            for chunk in self._generate_stream(prompt, user_id):
+                chunks.append(chunk.text)
+                for section, text in parser.feed(chunk.text):
+                    if section is not None:
+                        yield 'section', {'section': section, 'text': text}
+            for section, text in parser.close():
+                if section is not None:
+                    yield 'section', {'section': section, 'text': text}
+        except Exception as e:
+            logger.warning("Gemini streaming error: %s", e)
+            yield 'error', {'error': str(e)}
+            return
+        
+        result = parse(''.join(chunks).strip())
+        ai_cache.store_result(operation, MODEL_NAME, prompt, result)
+        yield 'done', result
+    
+    def _packed_prompt(self, emails: Sequence[Tuple[str, str, str]]) -> str:
+        parts = [
+            f"""[{number}]
+Sender: {sender}
+Subject: {subject}
+Body: {body}"""
+            for number, (subject, body, sender) in enumerate(emails, 1)
+        ]
+        emails_text = '\n\n'.join(parts)
+        return f"""Analyze each of the following {len(emails)} emails and determine its priority level.
+Consider urgency indicators, deadlines, importance keywords, tone, and context.
+
+{PRIORITY_CRITERIA}
+
+Emails:
+
+{emails_text}
+
+Respond with a JSON array holding one object per email, in order:
+{{"index": <email number>, "priority": "high" | "normal" | "low"}}"""
+    
+    def _request_packed(
+        self, emails: Sequence[Tuple[str, str, str]], user_id: Optional[int] = None
+    ) -> List[Optional[str]]:
+        """
+        Priorities for several (subject, body, sender) emails in one request
+        
+        Emails the model drops or garbles, and whole chunks whose request
+        fails, are split in half and asked again; a single email falls back
+        to the one-word prompt. None marks an email that still failed. While
+        Gemini is unavailable (rate limited, breaker open) nothing is split.
+        """
+        if len(emails) == 1:
+            try:
+                return [self._request_priority(self._priority_prompt(*emails[0]), user_id)]
+            except Exception as e:
+                logger.warning("Gemini priority detection error: %s", e)
+                return [None]
+        
+        try:
+            response = self._generate(
+                self._packed_prompt(emails),
+                user_id,
+                generation_config=genai.GenerationConfig(
+                    response_mime_type='application/json',
+                    response_schema=PACKED_RESPONSE_SCHEMA,
+                )
+            )
+            results = parse_priority_array(response.text, len(emails))
+        except ai_scheduler.AIUnavailable as e:
+            logger.warning("Gemini packed triage skipped: %s", e)
+            return [None] * len(emails)
+        except Exception as e:
+            logger.warning("Gemini packed triage error (%s emails): %s", len(emails), e)
+            results = [None] * len(emails)
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            retry = [emails[i] for i in missing]
+            if len(retry) == len(emails):
+                half = len(retry) // 2
+                redone = self._request_packed(retry[:half], user_id) + self._request_packed(retry[half:], user_id)
+            else:
+                redone = self._request_packed(retry, user_id)
+            for i, result in zip(missing, redone):
+                results[i] = result
+        return results
+    
+    def iter_email_priorities(self, emails: list, user_id: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Detect priorities with packed prompts, yielding results in input order
+        
+        Cached results are looked up first. The rest are packed several to a
+        request (see pack_emails), and the requests run concurrently on the
+        shared thread pool within the shared rate limit. Each (index, priority)
+        pair is yielded as soon as it and every earlier one are ready. A failed
+        or timed-out email gets the local keyword priority without holding
+        up the others.
+        
+        Args:
+            emails: List of email dicts with 'subject', 'body', 'sender'
+            user_id: User the requests are for, for per-user rate limiting (optional)
+            
+        Yields:
+            (index into emails, priority) tuples
+        """
+        fields = [
+            (email.get('subject', ''), prompt_body(email.get('body', ''), 'priority'), email.get('sender', ''))
+            for email in emails
+        ]
+        # Keyed like single requests, so both modes share cached priorities
+        prompts = [self._priority_prompt(*item) for item in fields]
+        cached = [ai_cache.get_cached('priority', MODEL_NAME, prompt) for prompt in prompts]
+        
+        # Identical emails in one batch share a slot
+        slots = {}
+        for index, (prompt, result) in enumerate(zip(prompts, cached)):
+            if result is None and prompt not in slots:
+                slots[prompt] = index
+        unique = list(slots.values())
+        
+        executor = _get_executor()
+        futures = []
+        located = {}
+        for chunk in pack_emails([fields[i] for i in unique]):
+            future = executor.submit(self._request_packed, [fields[unique[i]] for i in chunk], user_id)
+            futures.append(future)
+            for position, i in enumerate(chunk):
+                located[prompts[unique[i]]] = (future, position)
+        
+        stored = set()
+        try:
+            for index, (prompt, result) in enumerate(zip(prompts, cached)):
+                if result is None:
+                    future, position = located[prompt]
+                    try:
+                        result = future.result()[position]
+                    except Exception as e:
+                        result = None
+                        logger.warning("Error analyzing email %s: %s", emails[index].get('id', 'unknown'), e)
+                    if result is None:
+                        yield index, local_priority(*fields[index])
+                        continue
+                    if prompt not in stored:
+                        ai_cache.store_result('priority', MODEL_NAME, prompt, result)
+                        stored.add(prompt)
+                yield index, result
+        finally:
+            # The consumer went away (client disconnected); drop queued requests
+            for future in futures:
+                future.cancel()
+    
+    def batch_analyze_emails(self, emails: list, user_id: Optional[int] = None) -> list:
         """
         Analyze multiple emails for priority in batch
         
         Args:
             emails: List of email dicts with 'subject', 'body', 'sender'
+            user_id: User the requests are for, for per-user rate limiting (optional)
             
         Returns:
             List of emails with added 'ai_priority' field
         """
-        analyzed_emails = []
-        
-        for email in emails:
-            try:
-                priority = self.detect_email_priority(
-                    subject=email.get('subject', ''),
-                    body=email.get('body', ''),
-                    sender=email.get('sender', '')
-                )
-                email['ai_priority'] = priority
-                analyzed_emails.append(email)
-            except Exception as e:
-                print(f"Error analyzing email {email.get('id', 'unknown')}: {e}")
-                email['ai_priority'] = 'normal'
-                analyzed_emails.append(email)
-        
-        return analyzed_emails
+        for index, priority in self.iter_email_priorities(emails, user_id):
+            emails[index]['ai_priority'] = priority
+        return emails
+
+
+def pack_emails(emails: Sequence[Tuple[str, str, str]]) -> List[List[int]]:
+    """
+    Group (subject, body, sender) emails into chunks for packed requests
+    
+    Bodies are expected reduced already, as they go into the prompt.
+    
+    Chunks keep input order and hold up to GEMINI_TRIAGE_MAX_EMAILS emails
+    while the estimated prompt stays within GEMINI_TRIAGE_MAX_TOKENS, so
+    short emails pack densely and long ones get smaller chunks.
+    
+    Returns:
+        Lists of indexes into emails
+    """
+    max_emails = max(1, getattr(settings, 'GEMINI_TRIAGE_MAX_EMAILS', 20))
+    max_tokens = getattr(settings, 'GEMINI_TRIAGE_MAX_TOKENS', 4000)
+    chunks, current, tokens = [], [], PACKED_PROMPT_TOKENS
+    for index, (subject, body, sender) in enumerate(emails):
+        size = PACKED_EMAIL_TOKENS + estimate_tokens(sender) + estimate_tokens(subject) + estimate_tokens(body)
+        if current and (len(current) >= max_emails or tokens + size > max_tokens):
+            chunks.append(current)
+            current, tokens = [], PACKED_PROMPT_TOKENS
+        current.append(index)
+        tokens += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def parse_priority_array(text: str, count: int) -> List[Optional[str]]:
+    """
+    Priorities from a packed response, None for any email missing from it
+    
+    Accepts the schema's [{"index": n, "priority": "..."}] objects (1-based
+    indexes) or a bare list of priority strings in order, with or without a
+    Markdown code fence or surrounding prose.
+    """
+    results = [None] * count
+    text = (text or '').strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find('['), text.rfind(']')
+        if start == -1 or end <= start:
+            return results
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return results
+    if not isinstance(data, list):
+        return results
+
+    for position, item in enumerate(data, 1):
+        if isinstance(item, dict):
+            index, priority = item.get('index'), item.get('priority')
+        else:
+            index, priority = position, item
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if not isinstance(index, int) or not 1 <= index <= count or results[index - 1] is not None:
+            continue
+        priority = str(priority or '').strip().lower()
+        if priority in PRIORITIES:
+            results[index - 1] = priority
+    return results
 
 
 # Singleton instance
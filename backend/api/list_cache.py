@@ -0,0 +1,85 @@
+"""
+Read-through cache for email list pages
+The first pages of each listing are cached under the mailbox version, so
+any recorded write makes earlier entries unreachable without deleting them
+"""
+import hashlib
+from typing import Dict, Optional
+from django.conf import settings
+from django.core.cache import caches
+
+
+CACHE_PREFIX = 'emails:list'
+
+# Params that change the representation but not the page data
+IGNORED_PARAMS = {'format'}
+
+
+def _cache():
+    return caches[getattr(settings, 'EMAIL_LIST_CACHE_ALIAS', 'default')]
+
+
+def list_cache_key(request, version: int, last_modified) -> Optional[str]:
+    """
+    Cache key for a list request, or None if it should not be cached
+
+    Only the first EMAIL_LIST_CACHE_PAGES pages are cached, and only once
+    the mailbox has a recorded version. The key includes the version's
+    timestamp so a recycled user id can never match an old entry.
+    """
+    max_pages = getattr(settings, 'EMAIL_LIST_CACHE_PAGES', 3)
+    page = request.query_params.get('page', '1')
+    if not max_pages or not version or not page.isdigit() or int(page) > max_pages:
+        return None
+
+    params = sorted(
+        (name, value) for name, values in request.query_params.lists()
+        if name not in IGNORED_PARAMS for value in values
+    )
+    # Pagination links are absolute, so the host is part of the key
+    query = hashlib.md5(f"{request.get_host()}|{params}".encode()).hexdigest()[:16]
+    stamp = int(last_modified.timestamp() * 1000000) if last_modified else 0
+    return f"{CACHE_PREFIX}:{request.user.id}:{version}:{stamp}:{query}"
+
+
+def get_page(key: str):
+    """Cached page data for a key, or None; counts the hit or miss"""
+    data = _cache().get(key)
+    _increment('hits' if data is not None else 'misses')
+    return data
+
+
+def set_page(key: str, data) -> None:
+    _cache().set(key, data, getattr(settings, 'EMAIL_LIST_CACHE_TIMEOUT', 300))
+
+
+def _increment(name: str) -> None:
+    cache = _cache()
+    key = f"{CACHE_PREFIX}:stats:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats() -> Dict:
+    """
+    Hit and miss counts since the last reset
+
+    Counts live in the cache itself, so they cover every worker with a
+    shared backend (Redis, file) and only the current process with locmem.
+    """
+    cache = _cache()
+    hits = cache.get(f"{CACHE_PREFIX}:stats:hits", 0)
+    misses = cache.get(f"{CACHE_PREFIX}:stats:misses", 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats() -> None:
+    _cache().delete_many([f"{CACHE_PREFIX}:stats:hits", f"{CACHE_PREFIX}:stats:misses"])
@@ -0,0 +1,284 @@
+"""
+Local priority classifier
+A per-user multinomial naive Bayes over hashed bag-of-words features,
+trained from the user's own email priorities and corrections, so the
+default priority path needs no network call
+"""
+import io
+import re
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from .models import Email, PriorityClassifier, PriorityCorrection
+
+
+CLASSES = ['high', 'normal', 'low']
+CLASS_INDEX = {name: i for i, name in enumerate(CLASSES)}
+
+# Hashed feature space; 3 x 2**15 float32 counts (384 KB) while training.
+# Models stored with 2**16 features are folded into it exactly on load.
+N_FEATURES = 2 ** 15
+
+# Only the start of long bodies is used
+MAX_BODY_CHARS = 4000
+
+# Additive smoothing for token counts
+ALPHA = 0.1
+
+# A manual correction counts as this many ordinary examples
+CORRECTION_WEIGHT = 3.0
+
+# Emails per training query
+TRAIN_CHUNK_SIZE = 1000
+
+# Memory for loaded models per process, most recently used kept. A loaded
+# model holds 16 bytes per feature seen in training, at most 512 KB, and
+# typically well under 100 KB for a mailbox of a few thousand emails.
+MODEL_CACHE_BYTES = 32 * 1024 * 1024
+
+_TOKEN = re.compile(r'[a-z0-9]{2,24}')
+
+
+@lru_cache(maxsize=200000)
+def _feature(token: str) -> int:
+    # crc32 rather than hash(): indexes must be stable across processes
+    return zlib.crc32(token.encode('utf-8')) % N_FEATURES
+
+
+def features(sender: str, subject: str, body: str) -> List[int]:
+    """
+    Hashed feature indexes for one email, repeated per occurrence
+
+    Subject and body tokens are kept apart, and the sender address and
+    domain are features of their own. A bias feature keeps the list
+    non-empty.
+    """
+    sender = (sender or '').lower()
+    tokens = ['_bias', f'f:{sender}', f'd:{sender.rpartition("@")[2]}']
+    tokens += [f's:{token}' for token in _TOKEN.findall((subject or '').lower())]
+    tokens += _TOKEN.findall((body or '')[:MAX_BODY_CHARS].lower())
+    return [_feature(token) for token in tokens]
+
+
+class NaiveBayesModel:
+    """Token counts per class; training is adding counts, so it is incremental"""
+
+    def __init__(self, counts: Optional[np.ndarray] = None, class_counts: Optional[np.ndarray] = None):
+        self.counts = counts if counts is not None else np.zeros((len(CLASSES), N_FEATURES), dtype=np.float32)
+        self.class_counts = class_counts if class_counts is not None else np.zeros(len(CLASSES), dtype=np.float64)
+        self._compiled = None
+
+    def add(self, rows: Sequence[Tuple[List[int], str]], weight: float = 1.0) -> None:
+        """Add (features, priority) examples; a negative weight removes them"""
+        for class_index in range(len(CLASSES)):
+            indexes = [f for feats, priority in rows if CLASS_INDEX.get(priority) == class_index for f in feats]
+            if indexes:
+                np.add.at(self.counts[class_index], np.asarray(indexes, dtype=np.int64), weight)
+        for _, priority in rows:
+            if priority in CLASS_INDEX:
+                self.class_counts[CLASS_INDEX[priority]] += weight
+        np.maximum(self.counts, 0, out=self.counts)
+        np.maximum(self.class_counts, 0, out=self.class_counts)
+        self._compiled = None
+
+    @property
+    def examples(self) -> int:
+        return int(round(self.class_counts.sum()))
+
+    def compile(self) -> 'CompiledModel':
+        if self._compiled is None:
+            self._compiled = CompiledModel(self.counts, self.class_counts)
+        return self._compiled
+
+    def predict(self, batch: Sequence[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """See CompiledModel.predict"""
+        return self.compile().predict(batch)
+
+    def dumps(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, counts=self.counts, class_counts=self.class_counts)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'NaiveBayesModel':
+        arrays = np.load(io.BytesIO(bytes(data)))
+        counts = arrays['counts'].astype(np.float32)
+        if counts.shape[1] != N_FEATURES:
+            # A larger power-of-two space: crc % 2**16 % 2**15 == crc % 2**15
+            counts = counts.reshape(len(CLASSES), -1, N_FEATURES).sum(axis=1)
+        return cls(counts, arrays['class_counts'].astype(np.float64))
+
+
+class CompiledModel:
+    """
+    Prediction-only form of a model
+
+    Keeps log-probabilities for the features seen in training, plus one per
+    class shared by every unseen feature (they all have the smoothed zero
+    count), instead of dense 3 x N_FEATURES arrays.
+    """
+
+    def __init__(self, counts: np.ndarray, class_counts: np.ndarray):
+        self.features = np.flatnonzero(counts.any(axis=0)).astype(np.int32)
+        totals = counts.sum(axis=1, keepdims=True, dtype=np.float64) + ALPHA * N_FEATURES
+        # Columns per seen feature, then a last column for unseen features
+        self.log_probs = np.log(np.concatenate(
+            [counts[:, self.features] + ALPHA, np.full((len(CLASSES), 1), ALPHA)], axis=1
+        ) / totals).astype(np.float32)
+        priors = class_counts + 1.0
+        self.log_priors = np.log(priors / priors.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self.features.nbytes + self.log_probs.nbytes + self.log_priors.nbytes
+
+    def predict(self, batch: Sequence[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify a batch of feature lists in one vectorized pass
+
+        Returns:
+            (class index per email, probability of that class)
+        """
+        lengths = np.fromiter((len(feats) for feats in batch), dtype=np.int64, count=len(batch))
+        indexes = np.fromiter((f for feats in batch for f in feats), dtype=np.int64, count=int(lengths.sum()))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        seen = len(self.features)
+        columns = np.searchsorted(self.features, indexes)
+        known = columns < seen
+        known[known] = self.features[columns[known]] == indexes[known]
+        columns[~known] = seen
+        scores = np.add.reduceat(self.log_probs[:, columns], offsets, axis=1) + self.log_priors[:, None]
+        scores -= scores.max(axis=0)
+        probs = np.exp(scores)
+        probs /= probs.sum(axis=0)
+        best = probs.argmax(axis=0)
+        return best, probs[best, np.arange(len(batch))]
+
+
+_models = OrderedDict()  # user_id -> (updated_at, CompiledModel)
+_models_bytes = 0
+
+
+def load_model(user_id: int) -> Optional[CompiledModel]:
+    """
+    The user's trained model, or None if there isn't a usable one yet
+
+    Models are cached per process within MODEL_CACHE_BYTES and reloaded
+    when retrained; checking costs one indexed query.
+    """
+    global _models_bytes
+    row = PriorityClassifier.objects.filter(user_id=user_id).values_list('updated_at', 'trained_emails').first()
+    min_emails = getattr(settings, 'LOCAL_PRIORITY_MIN_EMAILS', 50)
+    if row is None or row[1] < min_emails:
+        return None
+    cached = _models.get(user_id)
+    if cached is not None and cached[0] == row[0]:
+        _models.move_to_end(user_id)
+        return cached[1]
+
+    weights = PriorityClassifier.objects.filter(user_id=user_id).values_list('weights', flat=True).first()
+    model = NaiveBayesModel.loads(weights).compile()
+    if cached is not None:
+        _models_bytes -= cached[1].nbytes
+    _models[user_id] = (row[0], model)
+    _models.move_to_end(user_id)
+    _models_bytes += model.nbytes
+    while _models_bytes > MODEL_CACHE_BYTES and len(_models) > 1:
+        _, (_, evicted) = _models.popitem(last=False)
+        _models_bytes -= evicted.nbytes
+    return model
+
+
+def predict_priorities(
+    user_id: int, emails: Iterable[Tuple[str, str, str]]
+) -> List[Optional[Tuple[str, float]]]:
+    """
+    Local predictions for (sender, subject, body) tuples
+
+    Returns:
+        (priority, confidence) per email, or all None if the user has no
+        trained model
+    """
+    emails = list(emails)
+    model = load_model(user_id) if emails else None
+    if model is None:
+        return [None] * len(emails)
+    best, confidence = model.predict([features(*email) for email in emails])
+    return [(CLASSES[index], float(p)) for index, p in zip(best.tolist(), confidence.tolist())]
+
+
+def record_correction(user_id: int, email_id: int, old_priority: str, new_priority: str) -> None:
+    """Log a manual priority change; folded into the model on the next training run"""
+    if old_priority != new_priority:
+        PriorityCorrection.objects.create(
+            user_id=user_id, email_id=email_id,
+            old_priority=old_priority, new_priority=new_priority,
+        )
+
+
+def _email_rows(queryset) -> List[Tuple[int, List[int], str]]:
+    rows = queryset.select_related('content').only(
+        'id', 'sender', 'subject', 'priority', 'content__body_codec', 'content__body_data'
+    )
+    return [(email.id, features(email.sender, email.subject, email.body), email.priority) for email in rows]
+
+
+def train_user_model(user_id: int, full: bool = False) -> int:
+    """
+    Bring a user's model up to date
+
+    Adds emails created since the last run, then folds in pending
+    corrections for emails the model has already seen (later emails are
+    learned with their corrected priority anyway). full=True retrains
+    from scratch.
+
+    Note: priorities the classifier assigned itself are trained on like
+    any other, so corrections are what move the model away from its own
+    mistakes.
+
+    Returns:
+        Number of emails and corrections applied
+    """
+    with transaction.atomic():
+        record, _ = PriorityClassifier.objects.select_for_update().get_or_create(user_id=user_id)
+        if full or not record.weights:
+            model, record.last_email_id, record.last_correction_id, record.trained_emails = NaiveBayesModel(), 0, 0, 0
+        else:
+            model = NaiveBayesModel.loads(record.weights)
+        applied = 0
+
+        emails = Email.objects.filter(user_id=user_id, id__gt=record.last_email_id).order_by('id')
+        seen_up_to = record.last_email_id
+        while True:
+            rows = _email_rows(emails.filter(id__gt=seen_up_to)[:TRAIN_CHUNK_SIZE])
+            if not rows:
+                break
+            model.add([(feats, priority) for _, feats, priority in rows])
+            seen_up_to = rows[-1][0]
+            record.trained_emails += len(rows)
+            applied += len(rows)
+
+        corrections = list(
+            PriorityCorrection.objects.filter(user_id=user_id, id__gt=record.last_correction_id)
+            .order_by('id').values_list('id', 'email_id', 'old_priority', 'new_priority')
+        )
+        if corrections:
+            seen = [c for c in corrections if c[1] <= record.last_email_id]
+            bodies = {email_id: feats for email_id, feats, _ in _email_rows(
+                Email.objects.filter(user_id=user_id, id__in={c[1] for c in seen})
+            )}
+            for _, email_id, old, new in seen:
+                if email_id in bodies:
+                    model.add([(bodies[email_id], old)], weight=-1.0)
+                    model.add([(bodies[email_id], new)], weight=CORRECTION_WEIGHT)
+                    applied += 1
+            record.last_correction_id = corrections[-1][0]
+
+        record.last_email_id = seen_up_to
+        record.weights = model.dumps()
+        record.save()
+    return applied
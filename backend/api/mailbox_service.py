@@ -0,0 +1,568 @@
+"""
+Mailbox query and bulk-write helpers
+Shared by the email views and background jobs so filtering and set-based
+updates behave the same everywhere
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, Q, QuerySet
+from django.utils import timezone
+from .events import get_broker, publish_mailbox_event
+from .mailbox_stats import STATE_FIELDS, apply_values, record_created, record_state_change
+from .models import ColdEmail, Email, EmailChange, EmailContent, EmailLabel, MailboxState, UserPreference
+from .thread_service import HEAD_FIELDS, assign_threads, refresh_thread_heads, thread_ids_for
+from .tiering import rehydrate_threads
+from .priority_rules import apply_priority_rules
+
+
+# Boolean query params accepted by the email list endpoint
+BOOLEAN_FILTERS = ['is_read', 'is_archived', 'is_trashed', 'is_starred']
+
+
+def filter_emails(queryset: QuerySet, params: Mapping) -> QuerySet:
+    """
+    Apply the email list filters to a queryset
+
+    Args:
+        queryset: Email queryset already scoped to a user
+        params: Query params or a plain dict of filter values
+
+    Returns:
+        Filtered queryset
+    """
+    for field in BOOLEAN_FILTERS:
+        value = params.get(field, None)
+        if value is not None:
+            queryset = queryset.filter(**{field: str(value).lower() == 'true'})
+
+    priority = params.get('priority', None)
+    if priority:
+        queryset = queryset.filter(priority=priority)
+
+    label = params.get('label', None)
+    if label is not None and str(label).isdigit():
+        # Joins EmailLabel on its (label, email) index
+        queryset = queryset.filter(labels=int(label))
+
+    older_than_days = params.get('older_than_days', None)
+    if older_than_days is not None and str(older_than_days).isdigit():
+        cutoff = timezone.now() - timedelta(days=int(older_than_days))
+        queryset = queryset.filter(created_at__lt=cutoff)
+
+    return queryset
+
+
+def cold_emails_matching(user_id: int, params: Mapping) -> QuerySet:
+    """
+    Cold-tier emails matching the email list filters
+
+    Cold mail is always archived or trashed and never labeled, so filters
+    that rule those out skip the cold table without querying it.
+    """
+    queryset = ColdEmail.objects.filter(user_id=user_id)
+    is_archived = str(params.get('is_archived', '')).lower()
+    is_trashed = str(params.get('is_trashed', '')).lower()
+    if params.get('label') is not None or (is_archived == 'false' and is_trashed == 'false'):
+        return queryset.none()
+    return filter_emails(queryset, params)
+
+
+def rehydrate_matching(user_id: int, params: Mapping) -> int:
+    """Move cold threads with emails matching the list filters back to the hot table"""
+    thread_ids = (
+        cold_emails_matching(user_id, params)
+        .order_by().values_list('thread_id', flat=True).distinct()
+    )
+    return rehydrate_threads(user_id, list(thread_ids))
+
+
+def prefetch_email_details(queryset: QuerySet) -> QuerySet:
+    """
+    Prefetch what EmailSerializer reads beyond the Email row
+
+    Labels and bodies come in one query each per page; raw provider
+    payloads are left unloaded.
+    """
+    return queryset.prefetch_related(
+        'labels',
+        Prefetch('content', EmailContent.objects.defer('raw_codec', 'raw_payload')),
+    )
+
+
+def _bulk_updates() -> Dict[str, tuple]:
+    """
+    Column updates for each bulk operation
+
+    Each entry is (values to write, Q matching rows that already have them).
+    Rows that already match are skipped so they are not rewritten.
+    """
+    now = timezone.now()
+    return {
+        'archive': (
+            {'is_archived': True, 'is_trashed': False},
+            Q(is_archived=True, is_trashed=False),
+        ),
+        'trash': (
+            {'is_trashed': True, 'is_archived': False, 'trashed_at': now},
+            Q(is_trashed=True, is_archived=False),
+        ),
+        'restore': (
+            {'is_archived': False, 'is_trashed': False, 'trashed_at': None},
+            Q(is_archived=False, is_trashed=False, trashed_at__isnull=True),
+        ),
+        'star': ({'is_starred': True}, Q(is_starred=True)),
+        'unstar': ({'is_starred': False}, Q(is_starred=False)),
+        'mark_read': ({'is_read': True}, Q(is_read=True)),
+        'mark_unread': ({'is_read': False}, Q(is_read=False)),
+    }
+
+
+BULK_OPERATIONS = [
+    'archive', 'trash', 'restore', 'star', 'unstar',
+    'mark_read', 'mark_unread', 'permanent_delete',
+]
+
+
+def apply_bulk_operation(user_id: int, queryset: QuerySet, operation: str) -> int:
+    """
+    Run a mailbox operation as a set-based UPDATE or DELETE
+
+    Matching ids are read in keyset pages of up to BULK_CHUNK_SIZE, so a
+    whole-mailbox request never holds every id in memory. Each page is then
+    locked and its stats columns re-read, so only rows that still need the
+    change are written and recorded in the changes feed and the rollups,
+    even if they were changed in between.
+
+    Args:
+        user_id: Owner of the emails
+        queryset: Email queryset already scoped to that user
+        operation: One of BULK_OPERATIONS
+
+    Returns:
+        Number of emails changed
+    """
+    if operation not in BULK_OPERATIONS:
+        raise ValueError(f"Unknown bulk operation: {operation}")
+
+    # permanent_delete has no values and no rows to skip
+    values, unchanged = _bulk_updates().get(operation, (None, None))
+    if unchanged is not None:
+        queryset = queryset.exclude(unchanged)
+    affected = 0
+    for chunk in _id_pages(queryset):
+        locked = Email.objects.filter(user_id=user_id, id__in=chunk)
+        if unchanged is not None:
+            locked = locked.exclude(unchanged)
+        with transaction.atomic():
+            rows = list(locked.select_for_update().order_by('id').values_list('id', *STATE_FIELDS))
+            if not rows:
+                continue
+            ids = [row[0] for row in rows]
+            states = [row[1:] for row in rows]
+            emails = Email.objects.filter(id__in=ids)
+            if values is None:
+                thread_ids = thread_ids_for(ids)
+                _, deleted = emails.delete()
+                affected += deleted.get('api.Email', 0)
+                record_state_change(user_id, states)
+                record_email_changes(user_id, ids, deleted=True, thread_ids=thread_ids)
+            else:
+                affected += emails.update(updated_at=timezone.now(), **values)
+                record_state_change(user_id, states, apply_values(states, values))
+                record_email_changes(user_id, ids, fields=values)
+    return affected
+
+
+def set_email_flags(user_id: int, email_id: int, operation: str) -> Optional[bool]:
+    """
+    Apply a flag operation to one email with a single targeted UPDATE
+
+    The row is locked and its stats columns read first, only if it doesn't
+    already have the values, so repeating an action writes nothing. Only
+    the operation's columns and updated_at are written.
+
+    Args:
+        user_id: Owner of the email
+        email_id: Email to change
+        operation: One of BULK_OPERATIONS except permanent_delete
+
+    Returns:
+        True if the email changed, False if it already had the values,
+        None if the user has no such email in the hot table
+    """
+    values, unchanged = _bulk_updates()[operation]
+    emails = Email.objects.filter(id=email_id, user_id=user_id)
+    with transaction.atomic():
+        before = list(emails.exclude(unchanged).select_for_update().values_list(*STATE_FIELDS))
+        if before:
+            emails.update(updated_at=timezone.now(), **values)
+            record_state_change(user_id, before, apply_values(before, values))
+            record_email_changes(user_id, [email_id], fields=values)
+            return True
+    return False if emails.exists() else None
+
+
+def flag_values(operation: str) -> Dict:
+    """Column values a flag operation writes"""
+    return _bulk_updates()[operation][0]
+
+
+# Opted-in users handled per auto-archive UPDATE
+AUTO_ARCHIVE_USER_BATCH = 200
+
+
+def auto_archive_read(user_batch_size: int = AUTO_ARCHIVE_USER_BATCH, batch_sleep: float = 0) -> Dict[str, int]:
+    """
+    Archive read inbox mail for every user with auto_archive_read enabled
+
+    Opted-in users are processed in batches with one set-based UPDATE per
+    batch; the rows it touches are locked and collected first so each
+    user's changes are recorded in the changes feed.
+
+    Args:
+        user_batch_size: Users per UPDATE
+        batch_sleep: Seconds to pause between batches
+
+    Returns:
+        dict with 'users' processed and 'archived' emails
+    """
+    user_ids = list(
+        UserPreference.objects.filter(auto_archive_read=True)
+        .order_by('user_id').values_list('user_id', flat=True)
+    )
+    archived = 0
+    for start in range(0, len(user_ids), user_batch_size):
+        batch = user_ids[start:start + user_batch_size]
+        read_inbox = Email.objects.filter(
+            user_id__in=batch, is_read=True, is_archived=False, is_trashed=False, is_sent=False
+        )
+        with transaction.atomic():
+            rows = list(read_inbox.select_for_update().order_by().values_list('id', 'user_id', *STATE_FIELDS))
+            if not rows:
+                continue
+            values = {'is_archived': True}
+            # Only the locked rows: mail read meanwhile waits for the next run,
+            # as it has no recorded state to adjust the stats and feed from
+            for chunk in _chunks([row[0] for row in rows]):
+                archived += Email.objects.filter(id__in=chunk).update(updated_at=timezone.now(), **values)
+            by_user = defaultdict(list)
+            for row in rows:
+                by_user[row[1]].append(row)
+            for user_id, user_rows in by_user.items():
+                states = [row[2:] for row in user_rows]
+                record_state_change(user_id, states, apply_values(states, values))
+                record_email_changes(user_id, [row[0] for row in user_rows], fields=values)
+        if batch_sleep:
+            time.sleep(batch_sleep)
+    return {'users': len(user_ids), 'archived': archived}
+
+
+def apply_label(user_id: int, queryset: QuerySet, label_id: int) -> int:
+    """
+    Add a label to every email in a queryset
+
+    Emails that already carry the label are skipped; the rest get one
+    INSERT per chunk.
+
+    Returns:
+        Number of emails labeled
+    """
+    ids = list(queryset.exclude(labels=label_id).values_list('id', flat=True))
+    for chunk in _chunks(ids):
+        with transaction.atomic():
+            EmailLabel.objects.bulk_create(
+                [EmailLabel(email_id=email_id, label_id=label_id) for email_id in chunk],
+                ignore_conflicts=True,
+            )
+            touch_emails(user_id, chunk, {'label_added': label_id})
+    return len(ids)
+
+
+def remove_label(user_id: int, queryset: QuerySet, label_id: int) -> int:
+    """
+    Remove a label from every email in a queryset with one DELETE per chunk
+
+    Returns:
+        Number of emails unlabeled
+    """
+    ids = list(queryset.filter(labels=label_id).values_list('id', flat=True))
+    for chunk in _chunks(ids):
+        with transaction.atomic():
+            EmailLabel.objects.filter(label_id=label_id, email_id__in=chunk).delete()
+            touch_emails(user_id, chunk, {'label_removed': label_id})
+    return len(ids)
+
+
+def touch_emails(user_id: int, email_ids: List[int], fields: Dict = None) -> None:
+    """
+    Record a change to emails whose own columns did not change
+
+    Used when related data shown with an email (its labels) changes: bumps
+    updated_at so detail ETags change, and records the emails as updated.
+    """
+    for chunk in _chunks(list(email_ids)):
+        with transaction.atomic():
+            Email.objects.filter(user_id=user_id, id__in=chunk).update(updated_at=timezone.now())
+            record_email_changes(user_id, chunk, fields=fields)
+
+
+# Most ids written by one UPDATE/DELETE statement
+BULK_CHUNK_SIZE = 1000
+
+
+def _chunks(items: List, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _id_pages(queryset: QuerySet, size: int = BULK_CHUNK_SIZE):
+    """Ids matching a queryset in ascending pages, one query per page"""
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def record_email_changes(
+    user_id: int,
+    email_ids: Iterable[int],
+    deleted: bool = False,
+    event: str = None,
+    fields: Dict = None,
+    thread_ids: Iterable[int] = None,
+) -> int:
+    """
+    Record that emails were created, updated or deleted
+
+    Every email write must call this. Each email gets the next value of the
+    user's mailbox version, which drives list ETags and the changes feed;
+    deletes are kept as tombstones. Connected clients are notified once the
+    transaction commits.
+
+    Args:
+        user_id: Owner of the emails
+        email_ids: Emails that changed
+        deleted: True if the emails were permanently deleted
+        event: Push event type (defaults to email.updated / email.deleted)
+        fields: Changed column values, included in the push event
+        thread_ids: Threads to refresh; required for deletes since the
+            emails are already gone, looked up otherwise unless fields
+            shows no column used by thread heads changed
+
+    Returns:
+        The new mailbox version
+    """
+    email_ids = list(email_ids)
+    if not email_ids:
+        return get_mailbox_version(user_id)[0]
+
+    with transaction.atomic():
+        # The row lock taken by this UPDATE serializes writers per user, so
+        # sequence numbers become visible in order
+        version = _allocate_versions(user_id, len(email_ids))
+        first = version - len(email_ids) + 1
+        EmailChange.objects.bulk_create(
+            [
+                EmailChange(user_id=user_id, email_id=email_id, seq=first + i, deleted=deleted)
+                for i, email_id in enumerate(email_ids)
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'email_id'],
+            update_fields=['seq', 'deleted'],
+        )
+
+        if thread_ids is None and not deleted:
+            # Changes limited to columns heads don't use leave them as they are
+            heads_affected = fields is None or not HEAD_FIELDS.isdisjoint(fields)
+            thread_ids = thread_ids_for(email_ids) if heads_affected else []
+        refresh_thread_heads(thread_ids or [])
+
+        data = {'ids': email_ids, 'cursor': version}
+        if fields:
+            data['fields'] = fields
+        event = event or ('email.deleted' if deleted else 'email.updated')
+        transaction.on_commit(lambda: _publish_changes(user_id, event, data))
+    return version
+
+
+def _publish_changes(user_id: int, event: str, data: Dict) -> None:
+    """Push a change event, plus fresh counters if anyone is listening"""
+    publish_mailbox_event(user_id, event, data)
+    if get_broker().has_subscribers(user_id):
+        publish_mailbox_event(user_id, 'counters.updated', get_mailbox_counters(user_id))
+
+
+def get_mailbox_counters(user_id: int) -> Dict[str, int]:
+    """Folder badge counts for a user, one aggregate query per tier"""
+    inbox = Q(is_archived=False, is_trashed=False, is_sent=False)
+    counters = Email.objects.filter(user_id=user_id).aggregate(
+        inbox=Count('id', filter=inbox),
+        unread=Count('id', filter=inbox & Q(is_read=False)),
+        starred=Count('id', filter=Q(is_starred=True, is_trashed=False)),
+        archived=Count('id', filter=Q(is_archived=True)),
+        trash=Count('id', filter=Q(is_trashed=True)),
+    )
+    # Cold mail is never in the inbox
+    cold = ColdEmail.objects.filter(user_id=user_id).aggregate(
+        starred=Count('id', filter=Q(is_starred=True, is_trashed=False)),
+        archived=Count('id', filter=Q(is_archived=True)),
+        trash=Count('id', filter=Q(is_trashed=True)),
+    )
+    for key, value in cold.items():
+        counters[key] += value
+    return counters
+
+
+def _allocate_versions(user_id: int, count: int) -> int:
+    """Advance the mailbox version by count and return the new value"""
+    now = timezone.now()
+    updated = MailboxState.objects.filter(user_id=user_id).update(
+        version=F('version') + count, updated_at=now
+    )
+    if not updated:
+        state, created = MailboxState.objects.get_or_create(
+            user_id=user_id, defaults={'version': count, 'updated_at': now}
+        )
+        if not created:
+            return _allocate_versions(user_id, count)
+    return get_mailbox_version(user_id)[0]
+
+
+def get_mailbox_version(user_id: int) -> Tuple[int, object]:
+    """
+    Current mailbox version and when it last changed
+
+    Returns:
+        (version, updated_at); (0, None) if the mailbox was never written
+    """
+    row = MailboxState.objects.filter(user_id=user_id).values_list('version', 'updated_at').first()
+    return row if row else (0, None)
+
+
+def get_email_changes(user_id: int, since: int, limit: int) -> Dict:
+    """
+    Emails changed after a changes-feed cursor
+
+    Args:
+        user_id: Mailbox owner
+        since: Cursor from a previous call (0 for a full sync)
+        limit: Maximum number of changes to return
+
+    Returns:
+        dict with 'changed' (Emails, labels and bodies prefetched),
+        'deleted' (ids), 'cursor' and 'has_more'
+    """
+    rows = list(
+        EmailChange.objects.filter(user_id=user_id, seq__gt=since)
+        .order_by('seq')
+        .values_list('email_id', 'seq', 'deleted')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Taken from the rows themselves, never from the live version, so a
+    # write committing during this call is picked up by the next one
+    cursor = rows[-1][1] if rows else since
+
+    changed_ids = [email_id for email_id, _, deleted in rows if not deleted]
+    deleted_ids = [email_id for email_id, _, deleted in rows if deleted]
+
+    changed = list(prefetch_email_details(Email.objects.filter(user_id=user_id, id__in=changed_ids)))
+    if len(changed) < len(changed_ids):
+        found = {email.id for email in changed}
+        missing = [email_id for email_id in changed_ids if email_id not in found]
+        changed += [row.to_email() for row in ColdEmail.objects.filter(user_id=user_id, id__in=missing)]
+    changed.sort(key=lambda email: email.id)
+
+    return {
+        'changed': changed,
+        'deleted': deleted_ids,
+        'cursor': cursor,
+        'has_more': has_more,
+    }
+
+
+def ingest_emails(user_id: int, email_account, parsed_emails: List[Dict]) -> List[int]:
+    """
+    Store emails fetched from a provider
+
+    Skips emails already stored in either tier (by provider message ID),
+    applies priority rules (and Gemini triage with GEMINI_INGEST_TRIAGE) and
+    threads to the batch, inserts the rest with one bulk INSERT and records
+    them as created.
+
+    Args:
+        user_id: Owner of the mailbox
+        email_account: EmailAccount the emails came from
+        parsed_emails: Dicts from GmailOAuthService/OutlookOAuthService parsing
+
+    Returns:
+        IDs of the emails created
+    """
+    external_ids = [data['external_id'] for data in parsed_emails]
+    # Tiered mail keeps its external_id, so a refetch of it is a duplicate too
+    seen = set(
+        Email.objects.filter(user_id=user_id, external_id__in=external_ids)
+        .values_list('external_id', flat=True)
+    )
+    seen.update(
+        ColdEmail.objects.filter(user_id=user_id, external_id__in=external_ids)
+        .values_list('external_id', flat=True)
+    )
+
+    items = []
+    for data in parsed_emails:
+        if data['external_id'] in seen:
+            continue
+        seen.add(data['external_id'])
+
+        received_at = data.get('received_at')
+        if received_at and timezone.is_naive(received_at):
+            received_at = timezone.make_aware(received_at)
+
+        email = Email(
+            user_id=user_id,
+            email_account=email_account,
+            external_id=data['external_id'],
+            message_id=data.get('message_id') or '',
+            in_reply_to=data.get('in_reply_to') or '',
+            references=data.get('references') or '',
+            subject=data['subject'][:500],
+            sender=data['sender'],
+            recipient=data['recipient'],
+            body=data['body'],
+            raw_data=data.get('raw_data'),
+            received_at=received_at,
+            is_read=data['is_read'],
+            is_starred=data['is_starred'],
+        )
+        items.append((email, data.get('thread_id') or ''))
+
+    if not items:
+        return []
+
+    # Before the transaction: triage may wait on Gemini
+    apply_priority_rules(
+        user_id, [email for email, _ in items],
+        triage=getattr(settings, 'GEMINI_INGEST_TRIAGE', False)
+    )
+    with transaction.atomic():
+        assign_threads(user_id, items)
+        # Replies to dormant threads bring the thread back to the hot tier
+        rehydrate_threads(user_id, {email.thread_id for email, _ in items})
+        emails = Email.objects.bulk_create([email for email, _ in items])
+        # bulk_create bypasses Email.save(), so write content rows here
+        EmailContent.objects.bulk_create([
+            EmailContent.build(email.id, email.body, email.raw_data) for email in emails
+        ])
+        created_ids = [email.id for email in emails]
+        record_created(user_id, emails)
+        record_email_changes(user_id, created_ids, event='email.created')
+    return created_ids
@@ -0,0 +1,164 @@
+"""
+Mailbox statistics rollups
+Per-user counters, daily volume and top senders are adjusted by each email
+write from the rows' state before and after it, so dashboards read a few
+rollup rows instead of aggregating over the user's mail
+"""
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import ColdEmail, DailyEmailStats, Email, MailboxStats, SenderStats
+
+
+# Email columns the MailboxStats counters depend on, in state tuple order
+STATE_FIELDS = ('is_read', 'is_starred', 'is_archived', 'is_trashed', 'is_sent', 'priority')
+
+COUNTER_FIELDS = ['total', 'unread', 'starred', 'high_priority', 'normal_priority', 'low_priority']
+
+
+def email_state(email) -> Tuple:
+    """State tuple for an Email instance"""
+    return tuple(getattr(email, field) for field in STATE_FIELDS)
+
+
+def apply_values(states: Iterable[Tuple], values: Dict) -> List[Tuple]:
+    """State tuples after an UPDATE writing values"""
+    return [
+        tuple(values.get(field, state[i]) for i, field in enumerate(STATE_FIELDS))
+        for state in states
+    ]
+
+
+def _counters(states: Iterable[Tuple]) -> Counter:
+    """MailboxStats counts contributed by emails in the given states"""
+    counts = Counter()
+    for is_read, is_starred, is_archived, is_trashed, is_sent, priority in states:
+        if is_trashed:
+            continue
+        counts['total'] += 1
+        counts[f'{priority}_priority'] += 1
+        if is_starred:
+            counts['starred'] += 1
+        if not is_read and not is_archived and not is_sent:
+            counts['unread'] += 1
+    return counts
+
+
+def record_state_change(user_id: int, before: Iterable[Tuple], after: Iterable[Tuple] = ()) -> None:
+    """
+    Adjust a user's counters for emails that changed state
+
+    Call after the write, in the same transaction, with the changed emails'
+    state tuples from before and after it; deleted emails have no after
+    state. Changes that don't move any counter write nothing.
+    """
+    delta = _counters(after)
+    delta.subtract(_counters(before))
+    changes = {field: F(field) + n for field, n in delta.items() if n}
+    if not changes:
+        return
+    if not MailboxStats.objects.filter(user_id=user_id).update(updated_at=timezone.now(), **changes):
+        # First write since the rollups were added: count from the rows,
+        # which already include this change
+        rebuild_counters(user_id)
+
+
+def record_created(user_id: int, emails: Iterable) -> None:
+    """
+    Add new emails to a user's counters, daily volume and sender counts
+
+    Args:
+        user_id: Owner of the emails
+        emails: Saved Email instances
+    """
+    emails = list(emails)
+    if not emails:
+        return
+    record_state_change(user_id, [], [email_state(email) for email in emails])
+
+    days = defaultdict(Counter)
+    senders = Counter()
+    for email in emails:
+        arrived = email.received_at or email.created_at or timezone.now()
+        days[timezone.localtime(arrived).date()]['sent' if email.is_sent else 'received'] += 1
+        if not email.is_sent:
+            senders[email.sender.lower()[:254]] += 1
+    _increment(DailyEmailStats, user_id, 'day', days)
+    _increment(SenderStats, user_id, 'sender', {sender: {'received': n} for sender, n in senders.items()})
+
+
+def _increment(model, user_id: int, key_field: str, increments: Dict) -> None:
+    """
+    Add counts to per-key rollup rows with one INSERT and one UPDATE
+
+    Missing rows are inserted at zero first, so the UPDATE can add to every
+    row whatever its key.
+    """
+    if not increments:
+        return
+    model.objects.bulk_create(
+        [model(user_id=user_id, **{key_field: key}) for key in increments], ignore_conflicts=True
+    )
+    fields = {field for counts in increments.values() for field in counts}
+    model.objects.filter(user_id=user_id, **{f'{key_field}__in': list(increments)}).update(**{
+        field: F(field) + Case(
+            *[When(**{key_field: key, 'then': Value(counts[field])})
+              for key, counts in increments.items() if counts.get(field)],
+            default=Value(0), output_field=IntegerField(),
+        )
+        for field in fields
+    })
+
+
+def rebuild_counters(user_id: int) -> MailboxStats:
+    """Recount a user's MailboxStats from the hot and cold email rows"""
+    counts = {field: 0 for field in COUNTER_FIELDS}
+    for model in (Email, ColdEmail):
+        rows = model.objects.filter(user_id=user_id, is_trashed=False).aggregate(
+            total=Count('id'),
+            unread=Count('id', filter=Q(is_read=False, is_archived=False, is_sent=False)),
+            starred=Count('id', filter=Q(is_starred=True)),
+            high_priority=Count('id', filter=Q(priority='high')),
+            normal_priority=Count('id', filter=Q(priority='normal')),
+            low_priority=Count('id', filter=Q(priority='low')),
+        )
+        for field, n in rows.items():
+            counts[field] += n
+    stats, _ = MailboxStats.objects.update_or_create(
+        user_id=user_id, defaults={**counts, 'updated_at': timezone.now()}
+    )
+    return stats
+
+
+def rebuild_user_stats(user_id: int) -> None:
+    """
+    Recount every rollup for a user from the hot and cold email rows
+
+    Daily volume and sender counts only cover mail that still exists, so a
+    rebuild drops history for deleted mail that the incremental counts keep.
+    """
+    rebuild_counters(user_id)
+    days = defaultdict(Counter)
+    senders = Counter()
+    for model in (Email, ColdEmail):
+        arrivals = (
+            model.objects.filter(user_id=user_id)
+            .annotate(day=TruncDate(Coalesce('received_at', 'created_at')))
+            .values('day', 'is_sent').annotate(n=Count('id')).order_by()
+        )
+        for row in arrivals:
+            days[row['day']]['sent' if row['is_sent'] else 'received'] += row['n']
+        for row in model.objects.filter(user_id=user_id, is_sent=False).values('sender').annotate(n=Count('id')).order_by():
+            senders[row['sender'].lower()[:254]] += row['n']
+
+    DailyEmailStats.objects.filter(user_id=user_id).delete()
+    SenderStats.objects.filter(user_id=user_id).delete()
+    DailyEmailStats.objects.bulk_create([
+        DailyEmailStats(user_id=user_id, day=day, received=counts['received'], sent=counts['sent'])
+        for day, counts in days.items()
+    ])
+    SenderStats.objects.bulk_create([
+        SenderStats(user_id=user_id, sender=sender, received=n) for sender, n in senders.items()
+    ])
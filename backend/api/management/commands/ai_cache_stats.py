@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from api.ai_cache import get_stats, reset_stats
+from api.models import AIResultCache
+
+
+class Command(BaseCommand):
+    help = 'Reports Gemini result cache hits per tier, misses and hit ratio per operation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after reporting')
+
+    def handle(self, *args, **options):
+        for operation, stats in get_stats().items():
+            self.stdout.write(
+                f"{operation:<9} memory hits: {stats['memory_hits']}  db hits: {stats['db_hits']}  "
+                f"misses: {stats['misses']}  hit ratio: {stats['hit_ratio']:.1%}"
+            )
+        self.stdout.write(f"stored results: {AIResultCache.objects.count()}")
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from api.mailbox_service import AUTO_ARCHIVE_USER_BATCH, auto_archive_read
+
+
+class Command(BaseCommand):
+    help = 'Archives read inbox mail for users with the auto_archive_read preference enabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=AUTO_ARCHIVE_USER_BATCH,
+            help='Users per UPDATE',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.05,
+            help='Seconds to pause between batches',
+        )
+
+    def handle(self, *args, **options):
+        result = auto_archive_read(options['batch_size'], options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result['archived']} read email(s) for {result['users']} opted-in user(s)."
+        ))
@@ -0,0 +1,100 @@
+import gzip
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.models import Email
+from api.renderers import ORJSONRenderer
+from api.serializers import EmailSerializer
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+WORDS = (
+    'meeting report deadline project client invoice review update team schedule '
+    'budget proposal quarterly feedback launch contract follow-up agenda summary '
+    'please attached thanks regards tomorrow next week status release customer'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks serialize+render time and bytes on the wire for an email list page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=100, help='Emails per page')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed iterations')
+
+    def build_page(self, count):
+        """Unsaved emails with realistic, varied bodies"""
+        rng = random.Random(42)
+        now = timezone.now()
+        emails = []
+        for i in range(count):
+            paragraphs = [
+                ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + '.'
+                for _ in range(rng.randint(2, 6))
+            ]
+            emails.append(Email(
+                id=i + 1, user_id=1,
+                sender=f'sender{i}@example.com', recipient='me@example.com',
+                subject=' '.join(rng.choice(WORDS) for _ in range(6)).title(),
+                body='Hi,\n\n' + '\n\n'.join(paragraphs) + '\n\nBest regards,\nSender',
+                priority=rng.choice(['high', 'normal', 'low']),
+                created_at=now, updated_at=now,
+            ))
+        return emails
+
+    def time_it(self, fn, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) / iterations * 1000
+
+    def handle(self, *args, **options):
+        emails = self.build_page(options['emails'])
+        iterations = options['iterations']
+
+        def page():
+            return {
+                'count': len(emails), 'next': None, 'previous': None,
+                'results': EmailSerializer(emails, many=True).data,
+            }
+
+        data = page()
+        serialize_ms = self.time_it(page, iterations)
+
+        self.stdout.write(f"{len(emails)}-email list page, {iterations} iterations\n")
+        self.stdout.write(f"{'serialize (EmailSerializer)':<32}{serialize_ms:>10.3f} ms")
+
+        results = {}
+        for name, renderer in [('JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())]:
+            render_ms = self.time_it(lambda: renderer.render(data, 'application/json'), iterations)
+            results[name] = render_ms
+            self.stdout.write(
+                f"{name + ' render':<32}{render_ms:>10.3f} ms   "
+                f"serialize+render {serialize_ms + render_ms:.3f} ms"
+            )
+
+        self.stdout.write(
+            f"{'render speedup':<32}{results['JSONRenderer'] / results['ORJSONRenderer']:>10.1f}x\n"
+        )
+
+        body = ORJSONRenderer().render(data, 'application/json')
+        sizes = [('identity', len(body), 0.0)]
+        start = time.perf_counter()
+        gzipped = gzip.compress(body, compresslevel=6)
+        sizes.append(('gzip -6', len(gzipped), (time.perf_counter() - start) * 1000))
+        if brotli is not None:
+            start = time.perf_counter()
+            compressed = brotli.compress(body, quality=5)
+            sizes.append(('brotli q5', len(compressed), (time.perf_counter() - start) * 1000))
+
+        for name, size, ms in sizes:
+            self.stdout.write(
+                f"{'bytes on wire (' + name + ')':<32}{size:>10,d} B   "
+                f"{size * 100 / len(body):5.1f}%   compress {ms:.3f} ms"
+            )
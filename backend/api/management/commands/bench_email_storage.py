@@ -0,0 +1,151 @@
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from api.content_codec import unpack_text
+from api.models import Email, EmailContent
+from .bench_api_rendering import WORDS
+
+
+# Old layout: the body stored inline on the email row
+WIDE_TABLE = 'bench_wide_email'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks list query latency and table size with bodies in EmailContent '
+        'versus inline on the email row. Runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=20000, help='Emails to generate')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed iterations')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['emails'], options['iterations'])
+            transaction.set_rollback(True)
+
+    def run(self, count, iterations):
+        user = User.objects.create_user(username=f'bench-storage-{time.time_ns()}')
+        raw_bytes = self.generate(user, count)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {WIDE_TABLE}')
+            cursor.execute(
+                f'CREATE TABLE {WIDE_TABLE} AS SELECT e.*, CAST(NULL AS TEXT) AS body '
+                f'FROM api_email e WHERE e.user_id = %s',
+                [user.id],
+            )
+            # Same indexes as api_email
+            cursor.execute(f'CREATE INDEX {WIDE_TABLE}_created ON {WIDE_TABLE} (created_at DESC)')
+            cursor.execute(f'CREATE INDEX {WIDE_TABLE}_read ON {WIDE_TABLE} (user_id, is_read)')
+        # Fill bodies through Python so any codec can be read back
+        with connection.cursor() as cursor:
+            for content in EmailContent.objects.filter(email__user=user).iterator(chunk_size=1000):
+                cursor.execute(
+                    f'UPDATE {WIDE_TABLE} SET body = %s WHERE id = %s', [content.body, content.email_id]
+                )
+
+        self.stdout.write(f"{count:,} emails, {iterations} iterations\n")
+
+        stored = sum(len(data) for data in EmailContent.objects.filter(
+            email__user=user).values_list('body_data', flat=True))
+        self.stdout.write(
+            f"{'body bytes raw / stored':<36}{raw_bytes:>12,d} / {stored:,d} "
+            f"({stored * 100 / max(raw_bytes, 1):.1f}%)"
+        )
+        for label, table in [
+            ('api_email (narrow)', 'api_email'),
+            ('api_emailcontent', 'api_emailcontent'),
+            (f'{WIDE_TABLE} (old layout)', WIDE_TABLE),
+        ]:
+            size = self.table_size(table)
+            self.stdout.write(f"{label:<36}{size:>12,d} B" if size is not None else f"{label:<36}{'n/a':>12}")
+        self.stdout.write('')
+
+        columns = 'id, subject, sender, priority, is_read, is_starred, created_at'
+        narrow_page = f'SELECT {columns} FROM api_email WHERE user_id = %s ORDER BY created_at DESC LIMIT 50'
+        wide_page = f'SELECT {columns}, body FROM {WIDE_TABLE} WHERE user_id = %s ORDER BY created_at DESC LIMIT 50'
+
+        def narrow_with_bodies(cursor):
+            # What the list view does: page query, then one prefetch by id
+            cursor.execute(narrow_page, [user.id])
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                f"SELECT email_id, body_codec, body_data FROM api_emailcontent "
+                f"WHERE email_id IN ({', '.join(['%s'] * len(ids))})", ids
+            )
+            return [unpack_text(codec, data) for _, codec, data in cursor.fetchall()]
+
+        queries = [
+            ('list page (50 rows, no body)', narrow_page, f'SELECT {columns} FROM {WIDE_TABLE} '
+             f'WHERE user_id = %s ORDER BY created_at DESC LIMIT 50'),
+            ('list page with bodies', narrow_with_bodies, wide_page),
+            ('row scan (starred count)',
+             'SELECT COUNT(*) FROM api_email WHERE user_id = %s AND is_starred',
+             f'SELECT COUNT(*) FROM {WIDE_TABLE} WHERE user_id = %s AND is_starred'),
+        ]
+        self.stdout.write(f"{'query':<36}{'narrow':>10}{'inline body':>14}")
+        for label, narrow, wide in queries:
+            narrow_ms = self.time_query(narrow, [user.id], iterations)
+            wide_ms = self.time_query(wide, [user.id], iterations)
+            self.stdout.write(f"{label:<36}{narrow_ms:>7.3f} ms{wide_ms:>11.3f} ms")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {WIDE_TABLE}')
+
+    def generate(self, user, count):
+        """Insert emails with realistic bodies; returns total raw body bytes"""
+        rng = random.Random(42)
+        now = timezone.now()
+        raw_bytes = 0
+        for start in range(0, count, 1000):
+            emails = []
+            for i in range(start, min(start + 1000, count)):
+                paragraphs = [
+                    ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + '.'
+                    for _ in range(rng.randint(2, 8))
+                ]
+                body = 'Hi,\n\n' + '\n\n'.join(paragraphs) + '\n\nBest regards,\nSender'
+                raw_bytes += len(body.encode('utf-8'))
+                emails.append(Email(
+                    user=user, sender=f'sender{i % 200}@example.com', recipient='me@example.com',
+                    subject=' '.join(rng.choice(WORDS) for _ in range(6)).title(), body=body,
+                    is_read=rng.random() < 0.7, is_starred=rng.random() < 0.05,
+                    received_at=now,
+                ))
+            emails = Email.objects.bulk_create(emails)
+            EmailContent.objects.bulk_create([EmailContent.build(e.id, e.body) for e in emails])
+        return raw_bytes
+
+    def table_size(self, table):
+        """On-disk bytes for a table, or None if the backend can't tell"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+                return cursor.fetchone()[0]
+            if connection.vendor == 'sqlite':
+                try:
+                    cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+                except Exception:
+                    return None
+                return cursor.fetchone()[0]
+        return None
+
+    def time_query(self, query, params, iterations):
+        """Mean ms for a SQL string or a callable taking a cursor"""
+        def run(cursor):
+            if callable(query):
+                return query(cursor)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        with connection.cursor() as cursor:
+            run(cursor)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                run(cursor)
+        return (time.perf_counter() - start) / iterations * 1000
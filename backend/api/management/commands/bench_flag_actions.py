@@ -0,0 +1,80 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from api.mailbox_service import (
+    flag_values, prefetch_email_details, record_email_changes, set_email_flags,
+)
+from api.models import Email, EmailContent
+from api.renderers import ORJSONRenderer
+from api.serializers import EmailSerializer
+from api.thread_service import assign_threads
+from .bench_api_rendering import WORDS
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks queries, latency and response bytes of a flag action (mark_read) as a '
+        'full-row save versus a targeted UPDATE. Runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500, help='Emails marked read per approach')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['iterations'])
+            transaction.set_rollback(True)
+
+    def run(self, iterations):
+        user = User.objects.create_user(username=f'bench-flags-{time.time_ns()}')
+        legacy_ids = self.generate(user, iterations)
+        targeted_ids = self.generate(user, iterations)
+        renderer = ORJSONRenderer()
+
+        def legacy(email_id):
+            # Previous action: load with details, save every column, serialize everything
+            email = prefetch_email_details(Email.objects.filter(user=user)).get(pk=email_id)
+            email.is_read = True
+            email.save()
+            record_email_changes(user.id, [email.id], fields={'is_read': True})
+            return renderer.render({'message': 'Email marked as read', 'email': EmailSerializer(email).data})
+
+        def targeted(email_id):
+            set_email_flags(user.id, email_id, 'mark_read')
+            return renderer.render({
+                'message': 'Email marked as read', 'email': {'id': email_id, **flag_values('mark_read')}
+            })
+
+        self.stdout.write(f"mark_read on {iterations} emails per approach\n")
+        self.stdout.write(f"{'approach':<24}{'queries/op':>12}{'latency':>14}{'response':>12}")
+        for label, action, ids in [
+            ('full-row save', legacy, legacy_ids),
+            ('targeted UPDATE', targeted, targeted_ids),
+        ]:
+            size = 0
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for email_id in ids:
+                    size = len(action(email_id))
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{label:<24}{len(queries.captured_queries) / len(ids):>12.1f}"
+                f"{elapsed / len(ids) * 1000:>11.3f} ms{size:>10,d} B"
+            )
+
+    def generate(self, user, count):
+        """Unread threaded emails with realistic bodies; returns their ids"""
+        emails = [
+            Email(
+                user=user, sender=f'sender{i % 50}@example.com', recipient='me@example.com',
+                subject=' '.join(WORDS[(i + j) % len(WORDS)] for j in range(6)).title(),
+                body=' '.join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(400)),
+            )
+            for i in range(count)
+        ]
+        assign_threads(user.id, [(email, '') for email in emails])
+        emails = Email.objects.bulk_create(emails)
+        EmailContent.objects.bulk_create([EmailContent.build(email.id, email.body) for email in emails])
+        return [email.id for email in emails]
@@ -0,0 +1,57 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.local_classifier import CLASSES, NaiveBayesModel, features
+from .bench_api_rendering import WORDS
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks local priority classifier training and batched inference on synthetic email'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=20000, help='Training emails')
+        parser.add_argument('--batch', type=int, default=500, help='Emails per inference batch')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        # Each class has its own sender pool and a few marker words mixed into common text
+        markers = {'high': ['outage', 'pager', 'deadline'], 'normal': ['lunch', 'agenda'], 'low': ['digest', 'sale']}
+
+        def email(priority):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(40, 300))]
+            for _ in range(3):
+                words[rng.randrange(len(words))] = rng.choice(markers[priority])
+            sender = f'{priority}{rng.randint(0, 30)}@example{rng.randint(0, 5)}.com'
+            return sender, ' '.join(rng.choice(WORDS) for _ in range(6)), ' '.join(words)
+
+        train = [(email(p), p) for p in rng.choices(CLASSES, weights=[1, 6, 3], k=options['emails'])]
+        test = [(email(p), p) for p in rng.choices(CLASSES, weights=[1, 6, 3], k=options['batch'])]
+
+        start = time.perf_counter()
+        rows = [(features(*message), priority) for message, priority in train]
+        featurize_s = time.perf_counter() - start
+        start = time.perf_counter()
+        model = NaiveBayesModel()
+        model.add(rows)
+        train_s = time.perf_counter() - start
+        size = len(model.dumps())
+        # The prediction-only form load_model() caches
+        model = NaiveBayesModel.loads(model.dumps()).compile()
+
+        start = time.perf_counter()
+        batch = [features(*message) for message, _ in test]
+        batch_featurize_s = time.perf_counter() - start
+        start = time.perf_counter()
+        best, _ = model.predict(batch)
+        predict_s = time.perf_counter() - start
+        accuracy = sum(CLASSES[i] == p for i, (_, p) in zip(best.tolist(), test)) / len(test)
+
+        n = len(test)
+        self.stdout.write(f"{len(train):,} training emails, {n} per inference batch\n")
+        self.stdout.write(f"{'featurize (training set)':<32}{featurize_s * 1000:>10.0f} ms")
+        self.stdout.write(f"{'train (add counts)':<32}{train_s * 1000:>10.0f} ms")
+        self.stdout.write(f"{'stored model':<32}{size / 1024:>10.0f} KB")
+        self.stdout.write(f"{'loaded model (in memory)':<32}{model.nbytes / 1024:>10.0f} KB")
+        self.stdout.write(f"{'inference: featurize':<32}{batch_featurize_s / n * 1e6:>10.1f} us/email")
+        self.stdout.write(f"{'inference: score':<32}{predict_s / n * 1e6:>10.1f} us/email")
+        self.stdout.write(f"{'accuracy (held out)':<32}{accuracy:>10.1%}")
@@ -0,0 +1,80 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api import priority_rules
+from api.priority_rules import DEFAULT_KEYWORDS, PriorityEngine
+from .bench_api_rendering import WORDS
+
+
+def legacy_detect_priority(subject, body, keywords=DEFAULT_KEYWORDS):
+    """The previous Email.detect_priority: lowercase everything, scan per keyword"""
+    subject_lower = subject.lower()
+    body_lower = body.lower()
+    if any(keyword in subject_lower or keyword in body_lower for keyword in keywords):
+        return 'high'
+    return 'normal'
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the compiled priority rule engine against the previous keyword scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=100000, help='Synthetic emails to classify')
+        parser.add_argument(
+            '--keywords', type=int, nargs='+', default=[0, 4, 8, 10, 14, 18, 25, 50, 100],
+            help='User keyword rule counts to compare, on top of the built-in keywords'
+        )
+
+    def handle(self, *args, **options):
+        emails = self.generate(options['emails'])
+        self.stdout.write(f"{len(emails):,} emails, classify_many per matcher\n")
+        self.stdout.write(f"{'keywords':>10}{'legacy scan':>14}{'scan':>10}{'automaton':>12}{'engine uses':>14}")
+
+        for count in options['keywords']:
+            extra = [f'{word}-{i}' for i, word in enumerate(WORDS * (count // len(WORDS) + 1))][:count]
+            all_keywords = DEFAULT_KEYWORDS + extra
+            start = time.perf_counter()
+            legacy = [legacy_detect_priority(subject, body, all_keywords) for _, subject, body in emails]
+            timings = [time.perf_counter() - start]
+
+            # User keywords marked high so results are comparable with the legacy scan
+            rules = [('keyword', keyword, 'high') for keyword in extra]
+            for use_automaton in (False, True):
+                if use_automaton and priority_rules.ahocorasick is None:
+                    timings.append(None)
+                    continue
+                engine = self.build_engine(rules, use_automaton)
+                start = time.perf_counter()
+                result = engine.classify_many(emails)
+                timings.append(time.perf_counter() - start)
+                if result != legacy:
+                    mismatches = sum(a != b for a, b in zip(result, legacy))
+                    self.stdout.write(self.style.ERROR(f"{mismatches} results differ from the legacy scan"))
+
+            chosen = 'automaton' if PriorityEngine(rules).automaton else 'scan'
+            cells = ''.join(
+                f"{'n/a' if seconds is None else f'{seconds * 1000:.0f} ms':>{width}}"
+                for seconds, width in zip(timings, (14, 10, 12))
+            )
+            self.stdout.write(f"{len(all_keywords):>10}{cells}{chosen:>14}")
+
+    def build_engine(self, rules, use_automaton):
+        """An engine with the given matcher regardless of AUTOMATON_MIN_KEYWORDS"""
+        saved = priority_rules.AUTOMATON_MIN_KEYWORDS
+        priority_rules.AUTOMATON_MIN_KEYWORDS = 0 if use_automaton else float('inf')
+        try:
+            return PriorityEngine(rules)
+        finally:
+            priority_rules.AUTOMATON_MIN_KEYWORDS = saved
+
+    def generate(self, count):
+        """(sender, subject, body) tuples; about 1 in 10 contains an urgent keyword"""
+        rng = random.Random(42)
+        emails = []
+        for i in range(count):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(40, 400))]
+            if rng.random() < 0.1:
+                words[rng.randrange(len(words))] = rng.choice(DEFAULT_KEYWORDS).upper()
+            subject = ' '.join(rng.choice(WORDS) for _ in range(6)).title()
+            emails.append((f'sender{i % 500}@example{i % 40}.com', subject, ' '.join(words)))
+        return emails
@@ -0,0 +1,139 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.gemini_service import prompt_body
+from api.prompt_reduction import estimate_tokens
+from .bench_api_rendering import WORDS
+
+
+SIGN_OFFS = ('Best regards,', 'Thanks,', 'Cheers,', 'Kind regards,')
+
+SIGNATURE = """--
+{name}
+Senior Account Manager | Example Corp
++1 (555) 010-{number:04d} | www.example.com"""
+
+DISCLAIMER = """CONFIDENTIALITY NOTICE: This e-mail message, including any attachments, is for the sole use of the intended recipient(s) and may contain confidential and privileged information. Any unauthorized review, use, disclosure or distribution is prohibited. If you have received this message in error, please contact the sender by reply e-mail and destroy all copies of the original message."""
+
+KINDS = ('plain', 'reply chain', 'outlook thread', 'html', 'mobile')
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraph(rng):
+    return ' '.join(sentence(rng, rng.randint(6, 16)) for _ in range(rng.randint(2, 5)))
+
+
+def message(rng, name):
+    paragraphs = '\n\n'.join(paragraph(rng) for _ in range(rng.randint(1, 3)))
+    return f"Hi,\n\n{paragraphs}\n\n{rng.choice(SIGN_OFFS)}\n{name}"
+
+
+def fixture_email(rng, kind, number):
+    """One synthetic email body of the given kind"""
+    name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+    if kind == 'plain':
+        return message(rng, name)
+    if kind == 'reply chain':
+        # Gmail-style: each reply quotes the whole thread below it
+        body = message(rng, name)
+        for depth in range(rng.randint(2, 5)):
+            quoted = '\n'.join(f"> {line}" if line else '>' for line in body.split('\n'))
+            body = (
+                f"{message(rng, name)}\n\n{SIGNATURE.format(name=name, number=number)}\n\n"
+                f"On Mon, Mar {depth + 3}, 2025 at 10:{depth:02d} AM {name} <{name.split()[0].lower()}"
+                f"@example.com> wrote:\n\n{quoted}"
+            )
+        return body
+    if kind == 'outlook thread':
+        body = f"{message(rng, name)}\n\n{DISCLAIMER}"
+        for depth in range(rng.randint(1, 4)):
+            body = (
+                f"{message(rng, name)}\n\n{DISCLAIMER}\n\n"
+                f"-----Original Message-----\nFrom: {name} <{name.split()[0].lower()}@example.com>\n"
+                f"Sent: Tuesday, April {depth + 1}, 2025 9:15 AM\nTo: Support Team\n"
+                f"Subject: RE: Ticket {number}\n\n{body}"
+            )
+        return body
+    if kind == 'html':
+        paragraphs = ''.join(
+            f"<p style=\"margin:0 0 12px 0;font-family:Arial\">{paragraph(rng)}&nbsp;</p>\n"
+            for _ in range(rng.randint(2, 4))
+        )
+        return (
+            "<html><head><style>p { color: #333; } .footer { font-size: 10px; }</style></head>"
+            f"<body><div>\n{paragraphs}<br/><br/>\n"
+            f"<table><tr><td>{name}</td></tr></table>\n"
+            f"<div class=\"footer\">{DISCLAIMER}</div></body></html>"
+        )
+    return f"{message(rng, name)}\n\nSent from my iPhone"
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures prompt token savings from body reduction (quotes, signatures, '
+        'disclaimers, HTML remnants, whitespace, token budgets) on a synthetic corpus.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=500, help='Emails per kind')
+        parser.add_argument('--seed', type=int, default=7, help='Corpus random seed')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['emails']
+        corpus = {kind: [fixture_email(rng, kind, i) for i in range(count)] for kind in KINDS}
+
+        self.stdout.write(f"{count:,} emails per kind, estimated tokens per email body\n")
+        self.stdout.write(
+            f"{'':<16}{'raw':>9}{'priority':>20}{'summary':>20}{'reply':>20}"
+        )
+        self.stdout.write(
+            f"{'':<16}{'':>9}{'1000 chars > now':>20}{'raw > now':>20}{'raw > now':>20}"
+        )
+        totals = {'raw': 0, 'old_priority': 0, 'priority': 0, 'summary': 0, 'reply': 0}
+        elapsed = 0.0
+        for kind, bodies in corpus.items():
+            row = {key: 0 for key in totals}
+            for body in bodies:
+                row['raw'] += estimate_tokens(body)
+                row['old_priority'] += estimate_tokens(body[:1000])
+                for operation in ('priority', 'summary', 'reply'):
+                    start = time.perf_counter()
+                    reduced = prompt_body(body, operation)
+                    elapsed += time.perf_counter() - start
+                    row[operation] += estimate_tokens(reduced)
+            for key in totals:
+                totals[key] += row[key]
+            self.stdout.write(self.format_row(kind, row, len(bodies)))
+
+        self.stdout.write('')
+        self.stdout.write(self.format_row('all', totals, count * len(KINDS)))
+        self.stdout.write(
+            f"\n{'saved vs raw':<16}{'':>9}"
+            f"{self.saving(totals['raw'], totals['priority']):>20}"
+            f"{self.saving(totals['raw'], totals['summary']):>20}"
+            f"{self.saving(totals['raw'], totals['reply']):>20}"
+        )
+        self.stdout.write(
+            f"{'priority vs 1000 chars':<34}{self.saving(totals['old_priority'], totals['priority']):>11}"
+        )
+        self.stdout.write(
+            f"{'reduction time':<34}{elapsed * 1e6 / (count * len(KINDS) * 3):>8.1f} us per body"
+        )
+
+    def format_row(self, label, row, count):
+        def pair(before, after):
+            return f"{before / count:.0f} > {after / count:.0f}"
+
+        return (
+            f"{label:<16}{row['raw'] / count:>9.0f}"
+            f"{pair(row['old_priority'], row['priority']):>20}"
+            f"{pair(row['raw'], row['summary']):>20}"
+            f"{pair(row['raw'], row['reply']):>20}"
+        )
+
+    def saving(self, before, after):
+        return f"{(before - after) * 100 / max(before, 1):.1f}%"
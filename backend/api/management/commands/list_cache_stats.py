@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from api.list_cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Reports email list cache hits, misses and hit ratio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after reporting')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}  misses: {stats['misses']}  hit ratio: {stats['hit_ratio']:.1%}"
+        )
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
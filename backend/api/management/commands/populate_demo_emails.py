@@ -2,6 +2,9 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.utils import timezone
 from api.models import Email
+from api.mailbox_service import apply_bulk_operation, record_email_changes
+from api.mailbox_stats import rebuild_user_stats
+from api.thread_service import assign_threads
 from datetime import timedelta
 import random
 
@@ -25,7 +28,7 @@ class Command(BaseCommand):
             return
 
         # Clear existing emails for this user (optional)
-        Email.objects.filter(user=user).delete()
+        apply_bulk_operation(user.id, Email.objects.filter(user=user), 'permanent_delete')
         self.stdout.write(self.style.WARNING('Cleared existing emails'))
 
         # Awesome demo emails with various scenarios
@@ -436,19 +439,24 @@ Amazon Customer Service''',
         ]
 
         # Create the emails
-        created_count = 0
+        created = []
         for email_data in demo_emails:
             try:
-                Email.objects.create(
-                    user=user,
-                    **email_data
-                )
-                created_count += 1
+                email = Email(user=user, **email_data)
+                assign_threads(user.id, [(email, '')])
+                email.save()
+                created.append(email)
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'Error creating email: {e}'))
 
+        created_ids = [email.id for email in created]
+        record_email_changes(user.id, created_ids, event='email.created')
+        # The seed replaces the mailbox, so recount every rollup rather than
+        # keep daily and sender history for the cleared demo mail
+        rebuild_user_stats(user.id)
+
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully created {created_count} awesome demo emails!'
+                f'Successfully created {len(created_ids)} awesome demo emails!'
             )
         )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from api.ai_cache import prune
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired Gemini results and the least recently used beyond the size cap'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-entries',
+            type=int,
+            default=None,
+            help='Results to keep (defaults to AI_CACHE_MAX_ENTRIES)',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune(options['max_entries'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} cached result(s).'))
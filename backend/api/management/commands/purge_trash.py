@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.retention import PURGE_CHUNK_SIZE, purge_trash, trash_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Permanently deletes emails that have been in trash longer than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=None,
+            help='Days to keep trashed emails (defaults to TRASH_RETENTION_DAYS)',
+        )
+        parser.add_argument('--user', type=int, default=None, help='Only purge this user id')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=PURGE_CHUNK_SIZE,
+            help='Emails deleted per transaction',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=getattr(settings, 'BULK_JOB_CHUNK_SLEEP', 0.05),
+            help='Seconds to pause between chunks',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = trash_cutoff(options['retention_days'])
+        deleted = purge_trash(
+            cutoff,
+            user_id=options['user'],
+            chunk_size=options['chunk_size'],
+            chunk_sleep=options['sleep'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} email(s) trashed before {cutoff:%Y-%m-%d}.'
+        ))
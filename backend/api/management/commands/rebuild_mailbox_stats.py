@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.mailbox_stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the mailbox statistics rollups from the email rows. Writes keep the rollups '
+        'up to date; this repairs them after writes made outside the app.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help='Only rebuild this user id')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user'] is not None:
+            users = users.filter(id=options['user'])
+        rebuilt = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                rebuild_user_stats(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt mailbox stats for {rebuilt} user(s).'))
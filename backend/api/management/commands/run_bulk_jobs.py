@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from api.models import BulkJob
+from api.bulk_jobs import run_bulk_job
+
+
+class Command(BaseCommand):
+    help = 'Runs pending bulk jobs and resumes jobs whose worker stopped sending heartbeats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Emails per chunk (defaults to BULK_JOB_CHUNK_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        job_ids = list(
+            BulkJob.objects.filter(status__in=['pending', 'running'])
+            .order_by('created_at')
+            .values_list('id', flat=True)
+        )
+
+        if not job_ids:
+            self.stdout.write(self.style.WARNING('No bulk jobs to run.'))
+            return
+
+        for job_id in job_ids:
+            job = run_bulk_job(job_id, chunk_size=options['chunk_size'])
+            if job.status == 'running':
+                self.stdout.write(f'Job {job.id} ({job.operation}): running in {job.worker}, skipped')
+                continue
+            self.stdout.write(
+                f'Job {job.id} ({job.operation}): {job.status}, '
+                f'{job.affected}/{job.processed} emails changed'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(job_ids)} bulk job(s).'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from api.fake_gemini import FakeGeminiServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a fake Gemini API that answers with canned results. Start the backend with '
+        'GEMINI_API_ENDPOINT=http://127.0.0.1:<port> (and any GEMINI_API_KEY) to use it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        server = FakeGeminiServer(options['host'], options['port'])
+        self.stdout.write(self.style.SUCCESS(f'Fake Gemini API listening on {server.url}'))
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
@@ -0,0 +1,49 @@
+import time
+from django.core.management.base import BaseCommand
+from api.tiering import THREAD_BATCH_SIZE, cold_cutoff, dormant_thread_ids, move_threads_to_cold
+
+
+class Command(BaseCommand):
+    help = 'Moves dormant threads (old, archived or trashed, unlabeled) to the cold email table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=None,
+            help='Minimum email age in days (defaults to MAILBOX_COLD_AFTER_DAYS)',
+        )
+        parser.add_argument('--user', type=int, default=None, help='Only tier this user id')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=THREAD_BATCH_SIZE,
+            help='Threads moved per transaction',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.05,
+            help='Seconds to pause between batches',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = cold_cutoff(options['older_than_days'])
+        after = 0
+        threads = emails = 0
+
+        while True:
+            thread_ids = dormant_thread_ids(
+                cutoff, user_id=options['user'], after=after, limit=options['batch_size']
+            )
+            if not thread_ids:
+                break
+            emails += move_threads_to_cold(thread_ids, cutoff)
+            threads += len(thread_ids)
+            after = thread_ids[-1]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {emails} email(s) in {threads} thread(s) created before {cutoff:%Y-%m-%d} to cold storage.'
+        ))
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from api.local_classifier import train_user_model
+from api.models import Email, PriorityCorrection
+
+
+class Command(BaseCommand):
+    help = 'Trains each user\'s local priority classifier on new emails and priority corrections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help='Only train this user id')
+        parser.add_argument('--full', action='store_true', help='Retrain from scratch instead of incrementally')
+
+    def handle(self, *args, **options):
+        if options['user'] is not None:
+            user_ids = [options['user']]
+        else:
+            user_ids = sorted(
+                set(Email.objects.order_by().values_list('user_id', flat=True).distinct())
+                | set(PriorityCorrection.objects.order_by().values_list('user_id', flat=True).distinct())
+            )
+
+        start = time.perf_counter()
+        applied = 0
+        for user_id in user_ids:
+            applied += train_user_model(user_id, full=options['full'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Trained {len(user_ids)} model(s) on {applied} new example(s) '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0006_bulkjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_state', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
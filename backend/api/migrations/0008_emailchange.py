@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def backfill_changes(apps, schema_editor):
+    """Record every existing email so a changes feed from 0 is a full sync"""
+    Email = apps.get_model('api', 'Email')
+    EmailChange = apps.get_model('api', 'EmailChange')
+    MailboxState = apps.get_model('api', 'MailboxState')
+
+    user_ids = Email.objects.order_by().values_list('user_id', flat=True).distinct()
+    for user_id in user_ids:
+        state, _ = MailboxState.objects.get_or_create(user_id=user_id)
+        email_ids = list(Email.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True))
+        for start in range(0, len(email_ids), 1000):
+            EmailChange.objects.bulk_create([
+                EmailChange(user_id=user_id, email_id=email_id, seq=state.version + start + i + 1)
+                for i, email_id in enumerate(email_ids[start:start + 1000])
+            ])
+        state.version += len(email_ids)
+        state.updated_at = timezone.now()
+        state.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0007_mailboxstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_id', models.BigIntegerField()),
+                ('seq', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'seq'], name='api_emailch_user_id_68e0aa_idx')],
+                'unique_together': {('user', 'email_id')},
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+SUBJECT_PREFIX = re.compile(r'^\s*((re|fw|fwd|aw|sv)(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+
+def backfill_threads(apps, schema_editor):
+    """Give every existing email its own thread (no Message-IDs were stored)"""
+    Email = apps.get_model('api', 'Email')
+    Thread = apps.get_model('api', 'Thread')
+
+    last_id = 0
+    while True:
+        batch = list(
+            Email.objects.filter(thread__isnull=True, id__gt=last_id)
+            .order_by('id')
+            .only('id', 'user_id', 'subject', 'sender', 'is_read', 'is_trashed', 'received_at', 'created_at')[:1000]
+        )
+        if not batch:
+            break
+        threads = Thread.objects.bulk_create([
+            Thread(
+                user_id=email.user_id,
+                subject=SUBJECT_PREFIX.sub('', email.subject).strip(),
+                latest_email_id=None if email.is_trashed else email.id,
+                latest_sender='' if email.is_trashed else email.sender,
+                participants='' if email.is_trashed else email.sender,
+                message_count=0 if email.is_trashed else 1,
+                unread_count=0 if email.is_trashed or email.is_read else 1,
+                last_message_at=None if email.is_trashed else (email.received_at or email.created_at),
+            )
+            for email in batch
+        ])
+        for email, thread in zip(batch, threads):
+            email.thread_id = thread.id
+        Email.objects.bulk_update(batch, ['thread'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0008_emailchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Thread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider_thread_id', models.CharField(blank=True, default='', max_length=255)),
+                ('subject', models.CharField(blank=True, default='', max_length=500)),
+                ('latest_sender', models.CharField(blank=True, default='', max_length=254)),
+                ('participants', models.TextField(blank=True, default='')),
+                ('message_count', models.IntegerField(default=0)),
+                ('unread_count', models.IntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-last_message_at', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='email_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails', to='api.emailaccount'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='external_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='in_reply_to',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='message_id',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='references',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['user', 'external_id'], name='api_email_user_id_9b3e96_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['user', 'message_id'], name='api_email_user_id_b64b37_idx'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='latest_email',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.email'),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='threads', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='thread',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='api.thread'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['thread', '-created_at'], name='api_email_thread__7645c9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='api_thread_user_id_c01634_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user', 'provider_thread_id'], name='api_thread_user_id_f01f47_idx'),
+        ),
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+    ]
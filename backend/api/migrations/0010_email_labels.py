@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='labels',
+            field=models.ManyToManyField(blank=True, related_name='emails', through='api.EmailLabel', to='api.label'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillabel',
+            index=models.Index(fields=['label', 'email'], name='api_emailla_label_i_1afff0_idx'),
+        ),
+    ]
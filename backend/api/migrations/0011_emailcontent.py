@@ -0,0 +1,123 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:07
+
+import zlib
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+# Frozen copy of api.content_codec as of this migration, so later changes
+# to the live codec can't change what this backfill writes or reads
+SNIPPET_LENGTH = 200
+MIN_COMPRESS_SIZE = 64
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+# Emails per batch; each batch commits on its own
+BATCH_SIZE = 1000
+
+
+def pack_text(text):
+    data = (text or '').encode('utf-8')
+    if len(data) < MIN_COMPRESS_SIZE:
+        return 'none', data
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return 'zlib', zlib.compress(data, ZLIB_LEVEL)
+
+
+def unpack_text(codec, data):
+    if data is None:
+        return ''
+    data = bytes(data)
+    if codec == 'zstd':
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+def make_snippet(body):
+    return ' '.join((body or '').split())[:SNIPPET_LENGTH]
+
+
+def copy_bodies(apps, schema_editor):
+    """Compress existing bodies into EmailContent, one transaction per batch"""
+    Email = apps.get_model('api', 'Email')
+    EmailContent = apps.get_model('api', 'EmailContent')
+    alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=alias):
+            batch = list(
+                Email.objects.using(alias).filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'body')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            contents = []
+            for email in batch:
+                codec, data = pack_text(email.body)
+                contents.append(EmailContent(email_id=email.id, body_codec=codec, body_data=data))
+                email.snippet = make_snippet(email.body)
+            EmailContent.objects.using(alias).bulk_create(contents, ignore_conflicts=True)
+            Email.objects.using(alias).bulk_update(batch, ['snippet'])
+        last_id = batch[-1].id
+
+
+def restore_bodies(apps, schema_editor):
+    Email = apps.get_model('api', 'Email')
+    EmailContent = apps.get_model('api', 'EmailContent')
+    alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        with transaction.atomic(using=alias):
+            batch = list(
+                EmailContent.objects.using(alias).filter(email_id__gt=last_id)
+                .order_by('email_id')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            Email.objects.using(alias).bulk_update(
+                [Email(id=c.email_id, body=unpack_text(c.body_codec, c.body_data)) for c in batch],
+                ['body'],
+            )
+        last_id = batch[-1].email_id
+
+
+class Migration(migrations.Migration):
+
+    # A single transaction would hold every email row's lock until the
+    # whole table is copied; batches commit as they go instead
+    atomic = False
+
+    dependencies = [
+        ('api', '0010_email_labels'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailContent',
+            fields=[
+                ('email', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='content', serialize=False, to='api.email')),
+                ('body_codec', models.CharField(default='none', max_length=8)),
+                ('body_data', models.BinaryField(default=b'')),
+                ('raw_codec', models.CharField(default='none', max_length=8)),
+                ('raw_payload', models.BinaryField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='snippet',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.RunPython(copy_bodies, restore_bodies),
+    ]
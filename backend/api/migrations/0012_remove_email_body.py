@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:07
+# Separate from 0011 so the column drop runs after the backfill has committed
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_emailcontent'),
+    ]
+
+    operations = [
+        # A default lets the column be re-added when migrating backwards
+        migrations.AlterField(
+            model_name='email',
+            name='body',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='email',
+            name='body',
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0012_remove_email_body'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='thread',
+            name='latest_email',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.email'),
+        ),
+        migrations.CreateModel(
+            name='ColdEmail',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('external_id', models.CharField(blank=True, default='', max_length=255)),
+                ('message_id', models.CharField(blank=True, default='', max_length=500)),
+                ('in_reply_to', models.CharField(blank=True, default='', max_length=500)),
+                ('references', models.TextField(blank=True, default='')),
+                ('sender', models.EmailField(max_length=254)),
+                ('recipient', models.EmailField(max_length=254)),
+                ('cc', models.TextField(blank=True, default='')),
+                ('bcc', models.TextField(blank=True, default='')),
+                ('subject', models.CharField(max_length=500)),
+                ('snippet', models.CharField(blank=True, default='', max_length=200)),
+                ('priority', models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=10)),
+                ('is_read', models.BooleanField(default=False)),
+                ('is_starred', models.BooleanField(default=False)),
+                ('is_archived', models.BooleanField(default=False)),
+                ('is_trashed', models.BooleanField(default=False)),
+                ('is_sent', models.BooleanField(default=False)),
+                ('trashed_at', models.DateTimeField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('body_codec', models.CharField(default='none', max_length=8)),
+                ('body_data', models.BinaryField(default=b'')),
+                ('raw_codec', models.CharField(default='none', max_length=8)),
+                ('raw_payload', models.BinaryField(blank=True, null=True)),
+                ('moved_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('email_account', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.emailaccount')),
+                ('thread', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cold_messages', to='api.thread')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='api_coldema_user_id_dd9697_idx'), models.Index(fields=['user', 'message_id'], name='api_coldema_user_id_9d5f75_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0013_cold_emails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriorityRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('keyword', 'Keyword'), ('sender', 'Sender'), ('domain', 'Domain')], max_length=10)),
+                ('pattern', models.CharField(max_length=255)),
+                ('priority', models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='priority_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['kind', 'pattern'],
+                'unique_together': {('user', 'kind', 'pattern')},
+            },
+        ),
+    ]
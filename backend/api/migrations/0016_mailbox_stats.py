@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from collections import Counter, defaultdict
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_stats(apps, schema_editor):
+    """Count the rollups for existing mail, hot and cold, with a few GROUP BYs per table"""
+    counters = defaultdict(Counter)
+    days = defaultdict(Counter)
+    senders = Counter()
+    for model_name in ('Email', 'ColdEmail'):
+        model = apps.get_model('api', model_name)
+        for row in model.objects.filter(is_trashed=False).values('user_id').annotate(
+            total=Count('id'),
+            unread=Count('id', filter=Q(is_read=False, is_archived=False, is_sent=False)),
+            starred=Count('id', filter=Q(is_starred=True)),
+            high_priority=Count('id', filter=Q(priority='high')),
+            normal_priority=Count('id', filter=Q(priority='normal')),
+            low_priority=Count('id', filter=Q(priority='low')),
+        ).order_by():
+            user_id = row.pop('user_id')
+            counters[user_id].update(row)
+        for row in (
+            model.objects.annotate(day=TruncDate(Coalesce('received_at', 'created_at')))
+            .values('user_id', 'day', 'is_sent').annotate(n=Count('id')).order_by()
+        ):
+            days[(row['user_id'], row['day'])]['sent' if row['is_sent'] else 'received'] += row['n']
+        for row in model.objects.filter(is_sent=False).values('user_id', 'sender').annotate(n=Count('id')).order_by():
+            senders[(row['user_id'], row['sender'].lower()[:254])] += row['n']
+
+    MailboxStats = apps.get_model('api', 'MailboxStats')
+    DailyEmailStats = apps.get_model('api', 'DailyEmailStats')
+    SenderStats = apps.get_model('api', 'SenderStats')
+    MailboxStats.objects.bulk_create([
+        MailboxStats(user_id=user_id, **counts) for user_id, counts in counters.items()
+    ], batch_size=1000)
+    DailyEmailStats.objects.bulk_create([
+        DailyEmailStats(user_id=user_id, day=day, received=counts['received'], sent=counts['sent'])
+        for (user_id, day), counts in days.items()
+    ], batch_size=1000)
+    SenderStats.objects.bulk_create([
+        SenderStats(user_id=user_id, sender=sender, received=n) for (user_id, sender), n in senders.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0015_local_priority_classifier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0)),
+                ('unread', models.IntegerField(default=0)),
+                ('starred', models.IntegerField(default=0)),
+                ('high_priority', models.IntegerField(default=0)),
+                ('normal_priority', models.IntegerField(default=0)),
+                ('low_priority', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SenderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender', models.CharField(max_length=254)),
+                ('received', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sender_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-received'], name='api_senders_user_id_cb1ddc_idx')],
+                'unique_together': {('user', 'sender')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyEmailStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('received', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_email_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_ai_result_cache'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='coldemail',
+            name='api_coldema_user_id_dd9697_idx',
+        ),
+        migrations.AddIndex(
+            model_name='coldemail',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='api_coldema_user_id_2fd2bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='api_email_user_id_5d3f92_idx'),
+        ),
+    ]
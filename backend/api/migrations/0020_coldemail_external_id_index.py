@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_bulk_job_worker_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coldemail',
+            index=models.Index(fields=['user', 'external_id'], name='api_coldema_user_id_979348_idx'),
+        ),
+    ]
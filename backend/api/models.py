@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .content_codec import make_snippet, pack_json, pack_text, unpack_json, unpack_text
 
 # Create your models here.
 
@@ -12,12 +14,23 @@ class Email(models.Model):
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='emails')
+    email_account = models.ForeignKey(
+        'EmailAccount', on_delete=models.SET_NULL, null=True, blank=True, related_name='emails'
+    )
+    thread = models.ForeignKey(
+        'Thread', on_delete=models.SET_NULL, null=True, blank=True, related_name='messages'
+    )
+    labels = models.ManyToManyField('Label', through='EmailLabel', related_name='emails', blank=True)
+    external_id = models.CharField(max_length=255, blank=True, default='')  # Provider message ID
+    message_id = models.CharField(max_length=500, blank=True, default='')  # RFC 5322 Message-ID
+    in_reply_to = models.CharField(max_length=500, blank=True, default='')
+    references = models.TextField(blank=True, default='')  # Space-separated Message-IDs
     sender = models.EmailField()
     recipient = models.EmailField()
     cc = models.TextField(blank=True, default='')  # Comma-separated CC recipients
     bcc = models.TextField(blank=True, default='')  # Comma-separated BCC recipients
     subject = models.CharField(max_length=500)
-    body = models.TextField()
+    snippet = models.CharField(max_length=200, blank=True, default='')  # Body preview; full body in EmailContent
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal')
     is_read = models.BooleanField(default=False)
     is_starred = models.BooleanField(default=False)
@@ -33,23 +46,213 @@ class Email(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
+            models.Index(fields=['user', '-created_at', '-id']),  # Keyset folder listing
             models.Index(fields=['user', 'is_read']),
             models.Index(fields=['user', 'priority']),
             models.Index(fields=['user', 'is_trashed']),
+            models.Index(fields=['user', 'external_id']),
+            models.Index(fields=['user', 'message_id']),
+            models.Index(fields=['thread', '-created_at']),
         ]
 
     def __str__(self):
         return f"{self.subject} - {self.sender}"
     
+    # Unsaved body/raw payload; written to EmailContent by save()
+    _pending_content = None
+    
+    @property
+    def body(self):
+        """Full body, loaded from EmailContent on first access"""
+        if self._pending_content and 'body' in self._pending_content:
+            return self._pending_content['body']
+        content = self._get_content()
+        return content.body if content else ''
+    
+    @body.setter
+    def body(self, value):
+        self._set_pending('body', value)
+    
+    @property
+    def raw_data(self):
+        """Raw provider payload, if stored"""
+        if self._pending_content and 'raw_data' in self._pending_content:
+            return self._pending_content['raw_data']
+        content = self._get_content()
+        return content.raw_data if content else None
+    
+    @raw_data.setter
+    def raw_data(self, value):
+        self._set_pending('raw_data', value)
+    
+    def _set_pending(self, key, value):
+        if self._pending_content is None:
+            self._pending_content = {}
+        self._pending_content[key] = value
+        if key == 'body':
+            self.snippet = make_snippet(value)
+    
+    def _get_content(self):
+        if self.pk is None:
+            return None
+        try:
+            return self.content
+        except EmailContent.DoesNotExist:
+            return None
+    
+    def save(self, *args, **kwargs):
+        """Save the row, then any pending body/raw payload to EmailContent"""
+        pending = self._pending_content
+        update_fields = kwargs.get('update_fields')
+        if pending and 'body' in pending and update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'snippet'}
+        super().save(*args, **kwargs)
+        if pending:
+            content = self._get_content() or EmailContent(email=self)
+            content.apply(**pending)
+            content.save()
+            self.content = content
+            self._pending_content = None
+    
     def detect_priority(self):
-        """Auto-detect email priority based on keywords"""
-        urgent_keywords = ['urgent', 'asap', 'important', 'critical', 'emergency', 'immediate']
-        subject_lower = self.subject.lower()
-        body_lower = self.body.lower()
-        
-        if any(keyword in subject_lower or keyword in body_lower for keyword in urgent_keywords):
-            return 'high'
-        return 'normal'
+        """Priority from the owner's priority rules and the built-in urgent keywords"""
+        from .priority_rules import engine_for_user
+        return engine_for_user(self.user_id).classify(self.sender, self.subject, self.body)
+
+
+class EmailContent(models.Model):
+    """
+    Compressed body and raw provider payload of an email
+    
+    Kept off the Email row so flag updates and list scans never touch them.
+    """
+    email = models.OneToOneField(Email, on_delete=models.CASCADE, primary_key=True, related_name='content')
+    body_codec = models.CharField(max_length=8, default='none')  # zstd, zlib or none
+    body_data = models.BinaryField(default=b'')
+    raw_codec = models.CharField(max_length=8, default='none')
+    raw_payload = models.BinaryField(null=True, blank=True)  # Compressed JSON
+    
+    def __str__(self):
+        return f"Content of email {self.email_id}"
+    
+    @property
+    def body(self):
+        if not hasattr(self, '_body'):
+            self._body = unpack_text(self.body_codec, self.body_data)
+        return self._body
+    
+    @property
+    def raw_data(self):
+        return unpack_json(self.raw_codec, self.raw_payload)
+    
+    def apply(self, **values):
+        """Compress new body and/or raw_data values onto this row"""
+        if 'body' in values:
+            self.body_codec, self.body_data = pack_text(values['body'])
+            self._body = values['body'] or ''
+        if 'raw_data' in values:
+            self.raw_codec, self.raw_payload = pack_json(values['raw_data'])
+    
+    @classmethod
+    def build(cls, email_id, body, raw_data=None):
+        """Unsaved row for bulk_create"""
+        content = cls(email_id=email_id)
+        content.apply(body=body, raw_data=raw_data)
+        return content
+
+
+class Thread(models.Model):
+    """Conversation grouping replies, with denormalized head data for listing"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='threads')
+    provider_thread_id = models.CharField(max_length=255, blank=True, default='')  # Gmail threadId / Outlook conversationId
+    subject = models.CharField(max_length=500, blank=True, default='')
+    # No constraint: a dormant thread's latest email may live in ColdEmail
+    latest_email = models.ForeignKey(
+        Email, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    latest_sender = models.CharField(max_length=254, blank=True, default='')
+    participants = models.TextField(blank=True, default='')  # Comma-separated senders
+    message_count = models.IntegerField(default=0)  # Messages not in trash
+    unread_count = models.IntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-last_message_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id']),
+            models.Index(fields=['user', 'provider_thread_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.message_count} messages)"
+
+
+class ColdEmail(models.Model):
+    """
+    Email moved out of the hot table by mailbox tiering (see api/tiering.py)
+    
+    Holds whole dormant threads: old, archived or trashed, unlabeled mail.
+    Keeps the Email id and columns plus its compressed content in one row,
+    with only the indexes the cold read paths need.
+    """
+    id = models.BigIntegerField(primary_key=True)  # Same id as the Email row
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    email_account = models.ForeignKey(
+        'EmailAccount', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', db_index=False
+    )
+    thread = models.ForeignKey(
+        Thread, on_delete=models.SET_NULL, null=True, blank=True, related_name='cold_messages'
+    )
+    external_id = models.CharField(max_length=255, blank=True, default='')
+    message_id = models.CharField(max_length=500, blank=True, default='')
+    in_reply_to = models.CharField(max_length=500, blank=True, default='')
+    references = models.TextField(blank=True, default='')
+    sender = models.EmailField()
+    recipient = models.EmailField()
+    cc = models.TextField(blank=True, default='')
+    bcc = models.TextField(blank=True, default='')
+    subject = models.CharField(max_length=500)
+    snippet = models.CharField(max_length=200, blank=True, default='')
+    priority = models.CharField(max_length=10, choices=Email.PRIORITY_CHOICES, default='normal')
+    is_read = models.BooleanField(default=False)
+    is_starred = models.BooleanField(default=False)
+    is_archived = models.BooleanField(default=False)
+    is_trashed = models.BooleanField(default=False)
+    is_sent = models.BooleanField(default=False)
+    trashed_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField()  # Copied from Email, not auto-set
+    updated_at = models.DateTimeField()
+    body_codec = models.CharField(max_length=8, default='none')
+    body_data = models.BinaryField(default=b'')
+    raw_codec = models.CharField(max_length=8, default='none')
+    raw_payload = models.BinaryField(null=True, blank=True)
+    moved_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),  # Keyset folder listing
+            models.Index(fields=['user', 'message_id']),  # Threading replies
+            models.Index(fields=['user', 'external_id']),  # Ingest duplicate check
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {self.sender} (cold)"
+    
+    def to_email(self):
+        """Read-only Email instance, serializable like a hot one"""
+        email = Email(**{field.attname: getattr(self, field.attname) for field in Email._meta.concrete_fields})
+        email._state.adding = False
+        email.content = EmailContent(
+            email_id=self.id, body_codec=self.body_codec, body_data=self.body_data,
+            raw_codec=self.raw_codec, raw_payload=self.raw_payload,
+        )
+        # Labeled mail is never moved, so there is nothing to look up
+        email._prefetched_objects_cache = {'labels': Label.objects.none()}
+        return email
 
 
 class Label(models.Model):
@@ -66,6 +269,53 @@ class Label(models.Model):
         return self.name
 
 
+class PriorityRule(models.Model):
+    """User rule that sets the priority of new email by keyword, sender or domain"""
+    KIND_CHOICES = [
+        ('keyword', 'Keyword'),  # Anywhere in subject or body, case-insensitive
+        ('sender', 'Sender'),  # Exact sender address
+        ('domain', 'Domain'),  # Sender domain or any subdomain
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='priority_rules')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    pattern = models.CharField(max_length=255)  # Stored lowercase
+    priority = models.CharField(max_length=10, choices=Email.PRIORITY_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'kind', 'pattern']
+        ordering = ['kind', 'pattern']
+
+    def __str__(self):
+        return f"{self.kind} '{self.pattern}' -> {self.priority}"
+
+
+class PriorityClassifier(models.Model):
+    """Trained local priority classifier for one user (see local_classifier)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='priority_classifier')
+    weights = models.BinaryField(default=b'')  # Compressed numpy arrays
+    trained_emails = models.PositiveIntegerField(default=0)
+    last_email_id = models.BigIntegerField(default=0)  # Emails up to here are learned
+    last_correction_id = models.BigIntegerField(default=0)  # Corrections up to here are learned
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Priority classifier for {self.user.username} ({self.trained_emails} emails)"
+
+
+class PriorityCorrection(models.Model):
+    """A manual priority change, used as a training signal"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='priority_corrections')
+    email_id = models.BigIntegerField()  # No FK: the email may be deleted before training
+    old_priority = models.CharField(max_length=10, choices=Email.PRIORITY_CHOICES)
+    new_priority = models.CharField(max_length=10, choices=Email.PRIORITY_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Email {self.email_id}: {self.old_priority} -> {self.new_priority}"
+
+
 class EmailLabel(models.Model):
     """Many-to-many relationship between emails and labels"""
     email = models.ForeignKey(Email, on_delete=models.CASCADE)
@@ -74,6 +324,9 @@ class EmailLabel(models.Model):
 
     class Meta:
         unique_together = ['email', 'label']
+        indexes = [
+            models.Index(fields=['label', 'email']),  # Label filter join
+        ]
 
 
 class UserPreference(models.Model):
@@ -170,3 +423,130 @@ class UserSubscription(models.Model):
             self.email_accounts_limit = 999999  # Effectively unlimited
         super().save(*args, **kwargs)
 
+
+
+class BulkJob(models.Model):
+    """Background bulk operation over every email matching a filter"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bulk_jobs')
+    operation = models.CharField(max_length=20)
+    filters = models.JSONField(default=dict, blank=True)  # Same keys as the email list filters
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.IntegerField(default=0)  # Matching emails when the job started
+    processed = models.IntegerField(default=0)  # Emails scanned so far
+    affected = models.IntegerField(default=0)  # Emails actually changed
+    last_email_id = models.BigIntegerField(default=0)  # Keyset cursor for the next chunk
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')  # Process holding the job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Renewed by the worker every chunk
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} job for {self.user.username} ({self.status})"
+
+
+class MailboxState(models.Model):
+    """Per-user mailbox version, bumped on every email write"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='mailbox_state')
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)  # Set explicitly by UPDATE ... version + 1
+
+    def __str__(self):
+        return f"Mailbox v{self.version} for {self.user.username}"
+
+
+class EmailChange(models.Model):
+    """Latest change to each email, keyed by the mailbox version that made it"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_changes')
+    email_id = models.BigIntegerField()  # Not a FK so tombstones outlive the email
+    seq = models.BigIntegerField()  # MailboxState.version allocated to this change
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ['user', 'email_id']
+        indexes = [
+            models.Index(fields=['user', 'seq']),
+        ]
+
+    def __str__(self):
+        return f"Email {self.email_id} {'deleted' if self.deleted else 'changed'} @ {self.seq}"
+
+
+class MailboxStats(models.Model):
+    """
+    Per-user rollup of current mailbox state, kept up to date by every
+    email write (see mailbox_stats); trashed mail is not counted
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='mailbox_stats')
+    total = models.IntegerField(default=0)
+    unread = models.IntegerField(default=0)  # Unread inbox mail, as in the folder badge
+    starred = models.IntegerField(default=0)
+    high_priority = models.IntegerField(default=0)
+    normal_priority = models.IntegerField(default=0)
+    low_priority = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Mailbox stats for {self.user.username}"
+
+
+class DailyEmailStats(models.Model):
+    """Emails received and sent per user per day; counted on arrival, never decremented"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_email_stats')
+    day = models.DateField()
+    received = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'day']
+
+    def __str__(self):
+        return f"{self.user.username} {self.day}: {self.received} in, {self.sent} out"
+
+
+class SenderStats(models.Model):
+    """Emails received per user per sender address; counted on arrival"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sender_stats')
+    sender = models.CharField(max_length=254)
+    received = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'sender']
+        indexes = [
+            models.Index(fields=['user', '-received']),  # Top senders
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} <- {self.sender}: {self.received}"
+
+
+class AIResultCache(models.Model):
+    """Gemini result keyed by a hash of (operation, model, prompt); shared across users"""
+    key = models.CharField(max_length=64, primary_key=True)
+    operation = models.CharField(max_length=20)
+    model = models.CharField(max_length=100)
+    result = models.JSONField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    last_used_at = models.DateTimeField(db_index=True)  # Size eviction drops the oldest
+
+    def __str__(self):
+        return f"{self.operation} {self.key[:12]} ({self.hits} hits)"
@@ -213,6 +213,10 @@ class GmailOAuthService:
         
         return {
             'external_id': message['id'],
+            'thread_id': message.get('threadId', ''),
+            'message_id': headers.get('Message-ID', headers.get('Message-Id', '')),
+            'in_reply_to': headers.get('In-Reply-To', ''),
+            'references': headers.get('References', ''),
             'subject': headers.get('Subject', '(No Subject)'),
             'sender': headers.get('From', ''),
             'recipient': headers.get('To', ''),
@@ -377,6 +381,8 @@ class OutlookOAuthService:
         """Parse Outlook message into our email format"""
         return {
             'external_id': message['id'],
+            'thread_id': message.get('conversationId', ''),
+            'message_id': message.get('internetMessageId', ''),
             'subject': message.get('subject', '(No Subject)'),
             'sender': message.get('from', {}).get('emailAddress', {}).get('address', ''),
             'recipient': ', '.join([r['emailAddress']['address'] for r in message.get('toRecipients', [])]),
@@ -9,7 +9,9 @@ from django.conf import settings
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from .oauth_services import GmailOAuthService, OutlookOAuthService
-from .models import EmailAccount, Email
+from .models import EmailAccount
+from .mailbox_service import ingest_emails
+from .events import publish_mailbox_event
 
 
 @api_view(['GET'])
@@ -205,14 +207,14 @@ def sync_emails(request, account_id):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        if not email_account.is_active:
+        if not email_account.sync_enabled:
             return Response(
                 {'error': 'Email account is inactive'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Check if token needs refresh
-        if email_account.token_expires_at and timezone.now() >= timezone.datetime.fromisoformat(email_account.token_expires_at):
+        if email_account.token_expires_at and timezone.now() >= email_account.token_expires_at:
             # Refresh token
             if email_account.provider == 'gmail':
                 new_tokens = GmailOAuthService.refresh_access_token(email_account.refresh_token)
@@ -229,35 +231,21 @@ def sync_emails(request, account_id):
         else:  # outlook
             result = OutlookOAuthService.fetch_emails(email_account.access_token)
         
-        # Save emails to database
-        emails_created = 0
-        for email_data in result['emails']:
-            # Check if email already exists
-            if not Email.objects.filter(
-                user=request.user,
-                external_id=email_data['external_id']
-            ).exists():
-                Email.objects.create(
-                    user=request.user,
-                    email_account=email_account,
-                    external_id=email_data['external_id'],
-                    subject=email_data['subject'],
-                    sender=email_data['sender'],
-                    recipient=email_data['recipient'],
-                    body=email_data['body'],
-                    received_at=email_data['received_at'],
-                    is_read=email_data['is_read'],
-                    is_starred=email_data['is_starred'],
-                )
-                emails_created += 1
+        # Save new emails to database, grouped into threads
+        created_ids = ingest_emails(request.user.id, email_account, result['emails'])
         
         # Update last sync time
-        email_account.last_synced_at = timezone.now()
+        email_account.last_sync = timezone.now()
         email_account.save()
         
+        publish_mailbox_event(request.user.id, 'sync.finished', {
+            'account_id': email_account.id,
+            'emails_synced': len(created_ids)
+        })
+        
         return Response({
             'message': 'Emails synced successfully',
-            'emails_synced': emails_created,
+            'emails_synced': len(created_ids),
             'total_emails': len(result['emails'])
         })
         
@@ -0,0 +1,195 @@
+"""
+Priority rule engine
+Keyword, sender and domain rules are compiled once per user into lookup
+tables and an Aho-Corasick automaton, then applied to emails before insert
+"""
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db.models import Count, Max
+from .local_classifier import predict_priorities
+from .models import PriorityRule
+
+try:
+    import ahocorasick  # type: ignore
+except ImportError:
+    ahocorasick = None
+
+
+# Built-in keywords that mark an email high priority for every user
+DEFAULT_KEYWORDS = ['urgent', 'asap', 'important', 'critical', 'emergency', 'immediate']
+
+# When several keywords match, the highest ranked priority wins
+PRIORITY_RANK = {'high': 2, 'low': 1, 'normal': 0}
+
+# Keyword count from which one automaton pass over the text beats a
+# substring search per keyword. The scan costs about 19 ms per keyword per
+# 20k emails and the automaton about 480 ms whatever the count, so they
+# cross near 20 (bench_priority_rules --emails 20000)
+AUTOMATON_MIN_KEYWORDS = 20
+
+# Compiled engines kept in memory, most recently used last
+ENGINE_CACHE_SIZE = 256
+
+
+class PriorityEngine:
+    """
+    Rules compiled for fast classification
+
+    Resolution order: exact sender rule, then domain rule (including parent
+    domains), then the highest ranked keyword found in the subject or body.
+    Keywords match case-insensitively anywhere in the text.
+    """
+
+    def __init__(self, rules: Iterable[Tuple[str, str, str]] = ()):
+        keywords = {keyword: 'high' for keyword in DEFAULT_KEYWORDS}
+        self.senders = {}
+        self.domains = {}
+        for kind, pattern, priority in rules:
+            if kind == 'sender':
+                self.senders[pattern] = priority
+            elif kind == 'domain':
+                self.domains[pattern] = priority
+            else:
+                keywords[pattern] = priority
+
+        # Highest rank first, so a substring scan can stop at the first hit
+        self.keywords = sorted(keywords.items(), key=lambda item: -PRIORITY_RANK[item[1]])
+        self.top_rank = PRIORITY_RANK[self.keywords[0][1]] if self.keywords else 0
+        # Without pyahocorasick large rule sets fall back to the scan; a re
+        # alternation of the keywords measured slower than scanning
+        self.automaton = None
+        if len(self.keywords) >= AUTOMATON_MIN_KEYWORDS and ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for keyword, priority in keywords.items():
+                self.automaton.add_word(keyword, priority)
+            self.automaton.make_automaton()
+
+    def classify(self, sender: str, subject: str, body: str, default: Optional[str] = 'normal') -> Optional[str]:
+        """Priority for one email, or default if no rule matches"""
+        return self.classify_many([(sender, subject, body)], default)[0]
+
+    def classify_many(
+        self, emails: Iterable[Tuple[str, str, str]], default: Optional[str] = 'normal'
+    ) -> List[Optional[str]]:
+        """
+        Priorities for (sender, subject, body) tuples
+
+        The keyword matcher is chosen once per batch, and each text is
+        searched on its own while it is in cache: one search over all texts
+        joined together measured slower with either matcher.
+        """
+        senders = self.senders
+        match_domain = self._match_domain if self.domains else None
+        match_keywords = self._match_scan if self.automaton is None else self._match_automaton
+        results = []
+        for sender, subject, body in emails:
+            sender = (sender or '').lower()
+            priority = senders.get(sender)
+            if priority is None and match_domain is not None:
+                priority = match_domain(sender)
+            if priority is None:
+                priority = match_keywords((subject or '').lower(), (body or '').lower())
+            results.append(default if priority is None else priority)
+        return results
+
+    def _match_domain(self, sender: str) -> Optional[str]:
+        domain = sender.rpartition('@')[2]
+        while domain:
+            if domain in self.domains:
+                return self.domains[domain]
+            domain = domain.partition('.')[2]
+        return None
+
+    def _match_scan(self, subject: str, body: str) -> Optional[str]:
+        for keyword, priority in self.keywords:
+            if keyword in subject or keyword in body:
+                return priority
+        return None
+
+    def _match_automaton(self, subject: str, body: str) -> Optional[str]:
+        best = None
+        for _, priority in self.automaton.iter(f"{subject}\n{body}"):
+            if best is None or PRIORITY_RANK[priority] > PRIORITY_RANK[best]:
+                best = priority
+                if PRIORITY_RANK[best] == self.top_rank:
+                    break
+        return best
+
+
+_engines = OrderedDict()
+
+
+def engine_for_user(user_id: int) -> PriorityEngine:
+    """
+    Compiled rules for a user
+
+    Engines are cached per process and rebuilt when the user's rules
+    change; checking costs one aggregate query.
+    """
+    stamp = PriorityRule.objects.filter(user_id=user_id).aggregate(n=Count('id'), last=Max('updated_at'))
+    stamp = (stamp['n'], stamp['last'])
+    cached = _engines.get(user_id)
+    if cached is not None and cached[0] == stamp:
+        _engines.move_to_end(user_id)
+        return cached[1]
+
+    rules = PriorityRule.objects.filter(user_id=user_id).values_list('kind', 'pattern', 'priority') if stamp[0] else []
+    engine = PriorityEngine(rules)
+    _engines[user_id] = (stamp, engine)
+    _engines.move_to_end(user_id)
+    while len(_engines) > ENGINE_CACHE_SIZE:
+        _engines.popitem(last=False)
+    return engine
+
+
+def apply_priority_rules(
+    user_id: int, emails: List, engine: Optional[PriorityEngine] = None, triage: bool = False
+) -> None:
+    """
+    Set priority on unsaved emails that don't have an explicit one
+
+    An email at the default 'normal' priority is classified; 'high' and
+    'low' set by the caller are kept. Rules decide first; emails no rule
+    matches go to the user's local classifier when it is confident. With
+    triage, the rest are sent to Gemini in packed requests, so call it
+    outside a transaction. Runs before insert, so no second write is needed.
+    """
+    pending = [email for email in emails if not email.priority or email.priority == 'normal']
+    if not pending:
+        return
+    engine = engine or engine_for_user(user_id)
+    priorities = engine.classify_many(((email.sender, email.subject, email.body) for email in pending), None)
+
+    unmatched = [i for i, priority in enumerate(priorities) if priority is None]
+    if unmatched:
+        min_confidence = getattr(settings, 'LOCAL_PRIORITY_MIN_CONFIDENCE', 0.7)
+        predictions = predict_priorities(
+            user_id, [(pending[i].sender, pending[i].subject, pending[i].body) for i in unmatched]
+        )
+        for i, prediction in zip(unmatched, predictions):
+            if prediction is not None and prediction[1] >= min_confidence:
+                priorities[i] = prediction[0]
+
+    unmatched = [i for i, priority in enumerate(priorities) if priority is None]
+    if unmatched and triage:
+        for i, priority in zip(unmatched, _triage(user_id, [pending[i] for i in unmatched])):
+            priorities[i] = priority
+
+    for email, priority in zip(pending, priorities):
+        email.priority = priority or 'normal'
+
+
+def _triage(user_id: int, emails: List) -> List[Optional[str]]:
+    """Gemini priorities for unsaved emails, or None each if Gemini is unavailable"""
+    from .gemini_service import get_gemini_service
+    try:
+        service = get_gemini_service()
+    except ValueError:  # No API key configured
+        return [None] * len(emails)
+    results = [None] * len(emails)
+    for index, priority in service.iter_email_priorities([
+        {'subject': email.subject, 'body': email.body, 'sender': email.sender} for email in emails
+    ], user_id):
+        results[index] = priority
+    return results
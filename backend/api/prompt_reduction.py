@@ -0,0 +1,150 @@
+"""
+Email body reduction before AI calls
+Drops quoted reply chains, signatures, legal disclaimers and HTML remnants,
+normalizes whitespace and truncates to a token budget
+"""
+import html
+import re
+
+# Rough token estimate; Gemini averages about 4 characters per token
+CHARS_PER_TOKEN = 4
+
+# Appended where a body was cut to its budget
+TRUNCATION_MARK = ' [...]'
+
+# Start of a quoted earlier message: Gmail/Apple "On <date>, <name> wrote:"
+# (often wrapped over two lines), Outlook's separator or header block
+REPLY_HEADER = re.compile(
+    r'^[ \t]*(?:'
+    r'On\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:[ \t]*$'
+    r'|-{2,}[ \t]*Original Message[ \t]*-{2,}'
+    r'|From:[^\n]+\n(?:Sent|Date):[^\n]+\n(?:To|Subject):'
+    r')',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+QUOTED_LINE = re.compile(r'^[ \t]*>.*(?:\n|$)', re.MULTILINE)
+
+# "-- " on its own line (RFC 3676), and mobile client footers
+SIGNATURE_DELIMITER = re.compile(r'^--[ \t]?$', re.MULTILINE)
+MOBILE_FOOTER = re.compile(
+    r'^[ \t]*(?:Sent from my \w+.*|Get Outlook for \w+.*|Sent from (?:Mail|Yahoo Mail|Outlook) for .*)$',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Paragraphs of legal boilerplate; the regex only runs on paragraphs that
+# contain one of the cheap DISCLAIMER_HINTS
+DISCLAIMER_HINTS = ('confidential', 'intended', 'in error', 'environment')
+DISCLAIMER = re.compile(
+    r'confidentiality notice|this (?:e-?mail|message|communication)[^.]{0,80}\bconfidential'
+    r'|intended (?:solely |only )?for the (?:use of the )?(?:individual|addressee|named recipient|recipient)'
+    r'|(?:have )?received this (?:e-?mail|message|communication) in error'
+    r'|please consider the environment before printing',
+    re.IGNORECASE,
+)
+
+HTML_TAG = re.compile(r'<[a-zA-Z/!][^>]*>')
+HTML_BLOCK = re.compile(r'<(style|script|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+HTML_BREAK = re.compile(r'<(?:br\s*/?|/p|/div|/tr|/li|/h[1-6])\s*>', re.IGNORECASE)
+
+# Runs of blanks, or any blank but a plain space; includes no-break and
+# zero-width spaces, common in HTML-converted mail. Single spaces are left
+# alone, which keeps the substitution cheap.
+INLINE_SPACE = re.compile(r'[ \t\f\v\u00a0\u200b]{2,}|[\t\f\v\u00a0\u200b]')
+LINE_EDGE_SPACE = re.compile(r' *\n *')
+EXTRA_NEWLINES = re.compile(r'\n{3,}')
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def strip_html(text: str) -> str:
+    """Text content of HTML remnants (tags, entities, style blocks)"""
+    if HTML_TAG.search(text):
+        text = HTML_BLOCK.sub('', text)
+        text = HTML_BREAK.sub('\n', text)
+        text = HTML_TAG.sub('', text)
+    return html.unescape(text)
+
+
+def strip_quotes(text: str) -> str:
+    """
+    Drop the quoted earlier message and '>' lines
+
+    Everything from the first reply header on is cut, unless nothing would
+    be left (a bare forward keeps its content).
+    """
+    match = REPLY_HEADER.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    without_quotes = QUOTED_LINE.sub('', text)
+    return without_quotes if without_quotes.strip() else text
+
+
+def strip_signature(text: str) -> str:
+    """Cut at the signature delimiter and drop mobile footers"""
+    match = SIGNATURE_DELIMITER.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    return MOBILE_FOOTER.sub('', text)
+
+
+def strip_disclaimers(text: str) -> str:
+    """Drop paragraphs of legal boilerplate"""
+    paragraphs = re.split(r'\n[ \t]*\n', text)
+    kept = [paragraph for paragraph in paragraphs if not _is_disclaimer(paragraph)]
+    return '\n\n'.join(kept) if kept else text
+
+
+def _is_disclaimer(paragraph: str) -> bool:
+    lowered = paragraph.lower()
+    return any(hint in lowered for hint in DISCLAIMER_HINTS) and DISCLAIMER.search(paragraph) is not None
+
+
+def normalize_whitespace(text: str) -> str:
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = INLINE_SPACE.sub(' ', text)
+    text = LINE_EDGE_SPACE.sub('\n', text)
+    return EXTRA_NEWLINES.sub('\n\n', text).strip()
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Cut text to about max_tokens, at a paragraph, sentence or word boundary
+
+    The boundary is only used if it keeps at least half of the allowed text.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    window = text[:max_chars - len(TRUNCATION_MARK)]
+    for boundary in ('\n\n', '. ', '\n', ' '):
+        at = window.rfind(boundary)
+        if at >= len(window) // 2:
+            window = window[:at + (1 if boundary == '. ' else 0)]
+            break
+    return window.rstrip() + TRUNCATION_MARK
+
+
+def reduce_body(body: str, max_tokens: int) -> str:
+    """
+    Body text worth sending to the model, within a token budget
+
+    Args:
+        body: Raw email body (plain text, possibly with HTML remnants)
+        max_tokens: Estimated token budget for the result (0 for no limit)
+
+    Returns:
+        The new content of the email without quotes, signature, disclaimers
+        and redundant whitespace, truncated to the budget
+    """
+    if not body:
+        return ''
+    text = body.replace('\r\n', '\n').replace('\r', '\n')
+    text = strip_html(text)
+    text = strip_quotes(text)
+    text = strip_signature(text)
+    text = strip_disclaimers(text)
+    text = normalize_whitespace(text)
+    return truncate_to_budget(text, max_tokens)
@@ -0,0 +1,41 @@
+"""
+orjson-based renderer and parser for the REST API
+Drop-in replacements for DRF's JSONRenderer/JSONParser that serialize and
+parse several times faster
+"""
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Render API responses with orjson"""
+
+    # Types orjson does not handle natively (Decimal, lazy strings, UUID
+    # subclasses, ...) fall back to DRF's encoder
+    _fallback_encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = orjson.OPT_NON_STR_KEYS
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            options |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(data, default=self._fallback_encoder.default, option=options)
+
+
+class ORJSONParser(JSONParser):
+    """Parse JSON request bodies with orjson"""
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
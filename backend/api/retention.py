@@ -0,0 +1,94 @@
+"""
+Trash retention
+Permanently deletes emails that have been in trash longer than the
+retention period, in bounded primary-key chunks from both storage tiers
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .mailbox_service import record_email_changes
+from .models import ColdEmail, Email, EmailLabel
+
+
+# Emails deleted per transaction
+PURGE_CHUNK_SIZE = 500
+
+
+def trash_cutoff(retention_days: Optional[int] = None):
+    """Emails trashed before this are past retention"""
+    if retention_days is None:
+        retention_days = getattr(settings, 'TRASH_RETENTION_DAYS', 30)
+    return timezone.now() - timedelta(days=retention_days)
+
+
+def _purge_chunk(model, ids, cutoff) -> int:
+    """
+    Delete one chunk of expired trash and record tombstones per user
+
+    Rows are re-checked under lock, so an email restored since the chunk
+    was selected is kept. Trash is not counted in thread heads, so no
+    thread needs refreshing.
+    """
+    with transaction.atomic():
+        rows = list(
+            model.objects.select_for_update()
+            .filter(id__in=ids, is_trashed=True, trashed_at__lt=cutoff)
+            .values_list('id', 'user_id')
+        )
+        if not rows:
+            return 0
+        ids = [email_id for email_id, _ in rows]
+        if model is Email:
+            # Explicit so the cascade collector never has to load them
+            EmailLabel.objects.filter(email_id__in=ids).delete()
+        model.objects.filter(id__in=ids).delete()
+
+        by_user = defaultdict(list)
+        for email_id, user_id in rows:
+            by_user[user_id].append(email_id)
+        for user_id, email_ids in by_user.items():
+            record_email_changes(user_id, email_ids, deleted=True, thread_ids=[])
+    return len(rows)
+
+
+def purge_trash(
+    cutoff,
+    user_id: Optional[int] = None,
+    chunk_size: int = PURGE_CHUNK_SIZE,
+    chunk_sleep: float = 0,
+) -> int:
+    """
+    Permanently delete emails trashed before cutoff
+
+    Walks hot then cold trash by primary key, deleting at most chunk_size
+    emails per transaction and sleeping between chunks so other writers
+    are not locked out.
+
+    Args:
+        cutoff: Delete emails with trashed_at before this
+        user_id: Only purge this user's trash
+        chunk_size: Emails per transaction
+        chunk_sleep: Seconds to pause between chunks
+
+    Returns:
+        Number of emails deleted
+    """
+    deleted = 0
+    for model in (Email, ColdEmail):
+        expired = model.objects.filter(is_trashed=True, trashed_at__lt=cutoff)
+        if user_id is not None:
+            expired = expired.filter(user_id=user_id)
+        after = 0
+        while True:
+            ids = list(expired.filter(id__gt=after).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            deleted += _purge_chunk(model, ids, cutoff)
+            after = ids[-1]
+            if chunk_sleep:
+                time.sleep(chunk_sleep)
+    return deleted
@@ -0,0 +1,83 @@
+"""
+Incremental parser for sectioned model output
+Gemini is asked to answer in MARKER: sections (SUMMARY:, KEY_POINTS:, ...);
+this splits streamed text into sections as chunks arrive
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class SectionParser:
+    """
+    Attribute streamed text to the most recent section marker
+
+    Markers are matched anywhere in the text, in order: once a section has
+    started, only the markers after it are looked for, so a reply body that
+    mentions "SUBJECT:" stays in the body. Text before the first marker
+    belongs to the None section. A marker split across chunks is held back
+    until it can be recognised.
+    """
+
+    def __init__(self, markers: Sequence[str]):
+        self.markers = [f"{marker}:" for marker in markers]
+        self.names = [marker.lower() for marker in markers]
+        self.position = -1  # Index of the current section in markers
+        self.sections: Dict[Optional[str], str] = {}
+        self.buffer = ''
+
+    @property
+    def section(self) -> Optional[str]:
+        return self.names[self.position] if self.position >= 0 else None
+
+    def feed(self, text: str) -> List[Tuple[Optional[str], str]]:
+        """
+        Add a chunk of text
+
+        Returns:
+            (section, text) pieces that are now known to belong to a section
+        """
+        self.buffer += text
+        pieces = []
+        while True:
+            found = None
+            for index in range(self.position + 1, len(self.markers)):
+                at = self.buffer.find(self.markers[index])
+                if at != -1 and (found is None or at < found[0]):
+                    found = (at, index)
+            if found is None:
+                break
+            at, index = found
+            self._emit(self.buffer[:at], pieces)
+            self.buffer = self.buffer[at + len(self.markers[index]):]
+            self.position = index
+            self.sections.setdefault(self.section, '')
+
+        # Keep back a tail that could be the start of a later marker
+        keep = 0
+        for marker in self.markers[self.position + 1:]:
+            for size in range(min(len(marker) - 1, len(self.buffer)), keep, -1):
+                if marker.startswith(self.buffer[-size:]):
+                    keep = size
+                    break
+        self._emit(self.buffer[:len(self.buffer) - keep], pieces)
+        self.buffer = self.buffer[len(self.buffer) - keep:]
+        return pieces
+
+    def close(self) -> List[Tuple[Optional[str], str]]:
+        """Flush held-back text at the end of the stream"""
+        pieces = []
+        self._emit(self.buffer, pieces)
+        self.buffer = ''
+        return pieces
+
+    def _emit(self, text: str, pieces: List) -> None:
+        if text:
+            self.sections[self.section] = self.sections.get(self.section, '') + text
+            pieces.append((self.section, text))
+
+
+def parse_sections(text: str, markers: Sequence[str]) -> Dict[Optional[str], str]:
+    """Sections of a complete response, each stripped"""
+    parser = SectionParser(markers)
+    parser.feed(text)
+    parser.close()
+    return {name: value.strip() for name, value in parser.sections.items()}
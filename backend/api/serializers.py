@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Email, Label, EmailLabel, UserPreference, EmailAccount, UserSubscription
+from .models import Email, Label, EmailLabel, UserPreference, EmailAccount, UserSubscription, BulkJob, Thread, PriorityRule
+from .mailbox_service import BULK_OPERATIONS, prefetch_email_details
 
 
 class LabelSerializer(serializers.ModelSerializer):
@@ -11,16 +12,171 @@ class LabelSerializer(serializers.ModelSerializer):
 
 
 class EmailSerializer(serializers.ModelSerializer):
-    # Fix: Use correct related field path for labels
+    # Use prefetch_email_details() when serializing many emails
+    labels = LabelSerializer(many=True, read_only=True)
+    body = serializers.CharField()  # Stored compressed in EmailContent
     
     class Meta:
         model = Email
         fields = [
-            'id', 'sender', 'recipient', 'subject', 'body', 'priority',
+            'id', 'thread', 'sender', 'recipient', 'subject', 'snippet', 'body', 'priority',
             'is_read', 'is_starred', 'is_archived', 'is_trashed', 'trashed_at',
-            'created_at', 'updated_at'
+            'labels', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'thread', 'snippet', 'created_at', 'updated_at', 'trashed_at']
+
+
+class ThreadSerializer(serializers.ModelSerializer):
+    """Thread list row, built from denormalized head columns only"""
+    
+    class Meta:
+        model = Thread
+        fields = [
+            'id', 'subject', 'latest_email', 'latest_sender', 'participants',
+            'message_count', 'unread_count', 'last_message_at'
+        ]
+        read_only_fields = fields
+
+
+class ThreadDetailSerializer(ThreadSerializer):
+    messages = serializers.SerializerMethodField()
+    
+    class Meta(ThreadSerializer.Meta):
+        fields = ThreadSerializer.Meta.fields + ['messages']
+        read_only_fields = fields
+    
+    def get_messages(self, obj):
+        """Messages oldest first, excluding trash"""
+        messages = list(prefetch_email_details(
+            obj.messages.filter(is_trashed=False).order_by('created_at', 'id')
+        ))
+        if not messages:
+            # Dormant threads are moved to the cold tier as a whole
+            cold = obj.cold_messages.filter(is_trashed=False).order_by('created_at', 'id')
+            messages = [row.to_email() for row in cold]
+        return EmailSerializer(messages, many=True).data
+
+
+# Most ids accepted by one bulk request
+BULK_MAX_IDS = 1000
+
+
+class EmailFiltersSerializer(serializers.Serializer):
+    """
+    Email list filters sent in a bulk request body
+
+    Unknown keys are rejected: a misspelled filter would otherwise be
+    dropped and the operation would widen to the whole mailbox.
+    """
+    is_read = serializers.BooleanField(required=False)
+    is_archived = serializers.BooleanField(required=False)
+    is_trashed = serializers.BooleanField(required=False)
+    is_starred = serializers.BooleanField(required=False)
+    priority = serializers.ChoiceField(choices=Email.PRIORITY_CHOICES, required=False)
+    label = serializers.IntegerField(min_value=1, required=False)
+    older_than_days = serializers.IntegerField(min_value=0, required=False)
+    
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            unknown = sorted(set(data) - set(self.fields))
+            if unknown:
+                raise serializers.ValidationError(f"unknown filters: {', '.join(unknown)}")
+        return super().to_internal_value(data)
+    
+    def validate_label(self, value):
+        user = self.context['request'].user
+        if not Label.objects.filter(user=user, id=value).exists():
+            raise serializers.ValidationError("label not found")
+        return value
+
+
+def validate_bulk_scope(filters, match_all):
+    """Empty filters match every email, so they need an explicit "all": true"""
+    if not filters and not match_all:
+        raise serializers.ValidationError(
+            {'filters': 'empty filters match every email; send "all": true to confirm'}
+        )
+
+
+class BulkSelectionSerializer(serializers.Serializer):
+    """Emails targeted by a bulk request: ids, list filters, or "all": true"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), max_length=BULK_MAX_IDS, required=False
+    )
+    filters = EmailFiltersSerializer(required=False)
+    all = serializers.BooleanField(default=False)
+    
+    def validate(self, attrs):
+        if 'ids' not in attrs:
+            validate_bulk_scope(attrs.get('filters'), attrs['all'])
+        return attrs
+
+
+class BulkActionSerializer(BulkSelectionSerializer):
+    operation = serializers.ChoiceField(choices=BULK_OPERATIONS)
+
+
+class BulkJobSerializer(serializers.ModelSerializer):
+    operation = serializers.ChoiceField(choices=BULK_OPERATIONS)
+    progress = serializers.SerializerMethodField()
+    all = serializers.BooleanField(default=False, write_only=True)
+    
+    class Meta:
+        model = BulkJob
+        fields = [
+            'id', 'operation', 'filters', 'all', 'status', 'total', 'processed',
+            'affected', 'progress', 'cancel_requested', 'error',
+            'started_at', 'finished_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'status', 'total', 'processed', 'affected', 'cancel_requested',
+            'error', 'started_at', 'finished_at', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'trashed_at']
+    
+    def get_progress(self, obj):
+        """Percentage of matching emails processed so far"""
+        if obj.status == 'completed':
+            return 100
+        if not obj.total:
+            return 0
+        return min(100, round(obj.processed * 100 / obj.total))
+    
+    def validate_filters(self, value):
+        filters = EmailFiltersSerializer(data=value, context=self.context)
+        filters.is_valid(raise_exception=True)
+        return filters.validated_data
+    
+    def validate(self, attrs):
+        validate_bulk_scope(attrs.get('filters'), attrs.pop('all', False))
+        return attrs
+
+
+class PriorityRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PriorityRule
+        fields = ['id', 'kind', 'pattern', 'priority', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def validate(self, attrs):
+        kind = attrs.get('kind', getattr(self.instance, 'kind', None))
+        pattern = attrs.get('pattern', getattr(self.instance, 'pattern', ''))
+        pattern = ' '.join(pattern.split()).lower()
+        if kind == 'domain':
+            pattern = pattern.lstrip('@')
+        if not pattern:
+            raise serializers.ValidationError({'pattern': "pattern must not be blank"})
+        if kind == 'sender' and '@' not in pattern:
+            raise serializers.ValidationError({'pattern': "sender rules need a full email address"})
+        
+        # user is not a serializer field, so unique_together isn't checked for us
+        user = self.context['request'].user
+        duplicates = PriorityRule.objects.filter(user=user, kind=kind, pattern=pattern)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError({'pattern': "a rule for this pattern already exists"})
+        attrs['pattern'] = pattern
+        return attrs
 
 
 class UserPreferenceSerializer(serializers.ModelSerializer):
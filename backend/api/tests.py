@@ -1,12 +1,28 @@
 """
 Test cases for InboxPilot API
 """
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.conf import settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
-from api.models import Email, EmailAccount, UserPreference
+from api.models import Email, EmailAccount, EmailContent, UserPreference, BulkJob, Thread, Label, EmailLabel, ColdEmail, PriorityRule
+from api.bulk_jobs import run_bulk_job
+from api.events import InProcessBroker
+from api.mailbox_service import ingest_emails
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
+from rest_framework_simplejwt.tokens import AccessToken
 import json
+from datetime import timedelta
 
 
 class AuthenticationTestCase(APITestCase):
@@ -287,3 +303,1860 @@ class EmailOperationsTestCase(TestCase):
         high_priority_emails = Email.objects.filter(priority='high')
         self.assertEqual(high_priority_emails.count(), 1)
         print("✅ Test Passed: Email filtering by priority working correctly")
+
+
+class BulkEmailActionsTestCase(APITestCase):
+    """Test the bulk mailbox actions endpoint"""
+    
+    def setUp(self):
+        """Set up a user with a few emails"""
+        self.user = User.objects.create_user(
+            username='bulkuser',
+            email='bulk@example.com',
+            password='TestPass123!'
+        )
+        self.other_user = User.objects.create_user(
+            username='otherbulkuser',
+            email='otherbulk@example.com',
+            password='TestPass123!'
+        )
+        self.emails = [
+            Email.objects.create(
+                user=self.user, subject=f'Bulk {i}', body='Test',
+                sender='s@ex.com', recipient='r@ex.com',
+                priority='low' if i % 2 else 'high'
+            )
+            for i in range(4)
+        ]
+        self.other_email = Email.objects.create(
+            user=self.other_user, subject='Not mine', body='Test',
+            sender='s@ex.com', recipient='r@ex.com'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.bulk_url = '/api/emails/bulk/'
+        
+    def test_bulk_trash_by_ids_is_scoped_to_user(self):
+        """Test trashing by ids only touches the user's own emails"""
+        ids = [self.emails[0].id, self.emails[1].id, self.other_email.id]
+        response = self.client.post(
+            self.bulk_url, {'operation': 'trash', 'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['affected'], 2)
+        self.assertEqual(Email.objects.filter(user=self.user, is_trashed=True).count(), 2)
+        self.assertFalse(Email.objects.get(id=self.other_email.id).is_trashed)
+        print("✅ Test Passed: Bulk trash by ids scoped to the current user")
+        
+    def test_bulk_by_filters_skips_unchanged_rows(self):
+        """Test filter-based bulk operations only count rows they change"""
+        Email.objects.filter(id=self.emails[1].id).update(is_read=True)
+        response = self.client.post(
+            self.bulk_url,
+            {'operation': 'mark_read', 'filters': {'priority': 'low'}},
+            format='json'
+        )
+        self.assertEqual(response.json()['affected'], 1)
+        self.assertEqual(Email.objects.filter(user=self.user, is_read=True).count(), 2)
+        print("✅ Test Passed: Bulk mark_read by filters")
+        
+    def test_bulk_permanent_delete(self):
+        """Test bulk permanent delete returns the deleted count"""
+        ids = [email.id for email in self.emails]
+        response = self.client.post(
+            self.bulk_url, {'operation': 'permanent_delete', 'ids': ids}, format='json'
+        )
+        self.assertEqual(response.json()['affected'], 4)
+        self.assertFalse(Email.objects.filter(user=self.user).exists())
+        print("✅ Test Passed: Bulk permanent delete")
+        
+    def test_bulk_requires_valid_operation_and_target(self):
+        """Test invalid bulk requests are rejected"""
+        response = self.client.post(self.bulk_url, {'operation': 'explode', 'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.bulk_url, {'operation': 'trash'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("✅ Test Passed: Invalid bulk requests rejected")
+        
+    def test_bulk_rejects_bad_ids_filters_and_labels(self):
+        """Test malformed targets are a 400 and nothing is changed"""
+        foreign = Label.objects.create(user=self.other_user, name='Theirs')
+        for target in [
+            {'ids': ['1; DROP', self.emails[0].id]},
+            {'ids': self.emails[0].id},
+            {'filters': {'prority': 'low'}},
+            {'filters': {'priority': 'urgent'}},
+            {'filters': {'is_read': 'maybe'}},
+            {'filters': {'label': foreign.id}},
+            {'filters': {'older_than_days': -1}},
+            {'filters': 'priority=low'},
+        ]:
+            response = self.client.post(self.bulk_url, {'operation': 'trash', **target}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, target)
+        self.assertFalse(Email.objects.filter(is_trashed=True).exists())
+        print("✅ Test Passed: Bad ids, filters and labels rejected")
+        
+    def test_bulk_whole_mailbox_needs_all(self):
+        """Test empty filters only act on every email with "all": true"""
+        for target in [{'filters': {}}, {'all': False}]:
+            response = self.client.post(self.bulk_url, {'operation': 'star', **target}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/bulk-jobs/', {'operation': 'trash', 'filters': {}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BulkJob.objects.exists())
+        
+        response = self.client.post(self.bulk_url, {'operation': 'star', 'all': True}, format='json')
+        self.assertEqual(response.json()['affected'], 4)
+        self.assertFalse(Email.objects.get(id=self.other_email.id).is_starred)
+        print("✅ Test Passed: Whole-mailbox bulk actions need all: true")
+        
+    def test_bulk_filters_are_read_in_pages(self):
+        """Test a filter-based bulk action reads and writes matching ids page by page"""
+        from api import mailbox_service
+        id_pages = mailbox_service._id_pages
+        pages = []
+        
+        def small_pages(queryset, *args):
+            for ids in id_pages(queryset, 3):
+                pages.append(ids)
+                yield ids
+        
+        with mock.patch.object(mailbox_service, '_id_pages', small_pages):
+            response = self.client.post(self.bulk_url, {'operation': 'archive', 'all': True}, format='json')
+        self.assertEqual(response.json()['affected'], 4)
+        self.assertEqual(pages, [[email.id for email in self.emails[:3]], [self.emails[3].id]])
+        self.assertEqual(Email.objects.filter(user=self.user, is_archived=True).count(), 4)
+        print("✅ Test Passed: Bulk filters are read in pages")
+
+
+class BulkJobTestCase(APITestCase):
+    """Test query-scoped background bulk jobs"""
+    
+    def setUp(self):
+        """Set up a user with a mix of low and high priority emails"""
+        self.user = User.objects.create_user(
+            username='jobuser',
+            email='job@example.com',
+            password='TestPass123!'
+        )
+        for i in range(7):
+            Email.objects.create(
+                user=self.user, subject=f'Job {i}', body='Test',
+                sender='s@ex.com', recipient='r@ex.com',
+                priority='low' if i < 5 else 'high'
+            )
+        self.client.force_authenticate(user=self.user)
+        
+    def test_bulk_job_processes_matches_in_chunks(self):
+        """Test a job created through the API archives every match"""
+        response = self.client.post(
+            '/api/bulk-jobs/',
+            {'operation': 'archive', 'filters': {'priority': 'low'}},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        job = run_bulk_job(response.json()['id'], chunk_size=2, chunk_sleep=0)
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.total, 5)
+        self.assertEqual(job.processed, 5)
+        self.assertEqual(job.affected, 5)
+        self.assertEqual(Email.objects.filter(user=self.user, is_archived=True).count(), 5)
+        
+        response = self.client.get(f'/api/bulk-jobs/{job.id}/')
+        self.assertEqual(response.json()['progress'], 100)
+        print("✅ Test Passed: Bulk job processed all matches in chunks")
+        
+    def test_bulk_job_cancellation(self):
+        """Test a cancelled job stops before touching more emails"""
+        job = BulkJob.objects.create(user=self.user, operation='trash', filters={})
+        job.status = 'running'
+        job.save()
+        response = self.client.post(f'/api/bulk-jobs/{job.id}/cancel/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        job = run_bulk_job(job.id, chunk_size=2, chunk_sleep=0)
+        self.assertEqual(job.status, 'cancelled')
+        self.assertFalse(Email.objects.filter(user=self.user, is_trashed=True).exists())
+        print("✅ Test Passed: Bulk job cancellation")
+        
+    def test_bulk_job_claimed_by_one_worker(self):
+        """Test a live job is left alone and a stale one is taken over"""
+        from api.bulk_jobs import claim_bulk_job
+        job = BulkJob.objects.create(user=self.user, operation='archive', filters={'priority': 'low'})
+        self.assertTrue(claim_bulk_job(job.id, 'worker-a'))
+        self.assertFalse(claim_bulk_job(job.id, 'worker-b'))
+        
+        # run_bulk_jobs while worker-a is alive changes nothing
+        job = run_bulk_job(job.id, chunk_size=2, chunk_sleep=0)
+        self.assertEqual((job.status, job.worker, job.processed), ('running', 'worker-a', 0))
+        self.assertFalse(Email.objects.filter(user=self.user, is_archived=True).exists())
+        
+        # Once worker-a stops sending heartbeats the job is resumed and finished
+        BulkJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        job = run_bulk_job(job.id, chunk_size=2, chunk_sleep=0)
+        self.assertEqual((job.status, job.processed), ('completed', 5))
+        self.assertNotEqual(job.worker, 'worker-a')
+        self.assertEqual(Email.objects.filter(user=self.user, is_archived=True).count(), 5)
+        print("✅ Test Passed: Bulk job claimed by one worker")
+        
+    def test_bulk_job_stops_after_takeover(self):
+        """Test a worker whose job was taken over processes no further chunk"""
+        from api import bulk_jobs
+        job = BulkJob.objects.create(user=self.user, operation='archive', filters={'priority': 'low'})
+        apply = bulk_jobs.apply_bulk_operation
+        
+        def taken_over(*args):
+            # Another worker claims the job after this worker's first chunk
+            BulkJob.objects.filter(pk=job.pk).update(worker='worker-b')
+            return apply(*args)
+        
+        with mock.patch.object(bulk_jobs, 'apply_bulk_operation', side_effect=taken_over):
+            job = run_bulk_job(job.id, chunk_size=2, chunk_sleep=0)
+        self.assertEqual((job.status, job.worker, job.processed), ('running', 'worker-b', 2))
+        self.assertEqual(Email.objects.filter(user=self.user, is_archived=True).count(), 2)
+        print("✅ Test Passed: Bulk job stops after takeover")
+
+
+class ConditionalGetTestCase(APITestCase):
+    """Test ETag/Last-Modified handling on email list and detail"""
+    
+    def setUp(self):
+        """Set up a user with one email"""
+        self.user = User.objects.create_user(
+            username='etaguser',
+            email='etag@example.com',
+            password='TestPass123!'
+        )
+        self.email = Email.objects.create(
+            user=self.user, subject='ETag Test', body='Test',
+            sender='s@ex.com', recipient='r@ex.com'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def test_detail_etag_returns_304_until_email_changes(self):
+        """Test detail ETag follows Email.updated_at"""
+        url = f'/api/emails/{self.email.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self.client.post(f'/api/emails/{self.email.id}/star/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        print("✅ Test Passed: Detail ETag revalidation")
+        
+    def test_list_etag_changes_on_mailbox_write(self):
+        """Test list ETag follows the mailbox version"""
+        response = self.client.get('/api/emails/')
+        etag = response['ETag']
+        
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/emails/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        # A different filter is a different representation
+        response = self.client.get('/api/emails/?is_read=false', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.client.post(
+            '/api/emails/bulk/',
+            {'operation': 'mark_read', 'ids': [self.email.id]},
+            format='json'
+        )
+        response = self.client.get('/api/emails/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        print("✅ Test Passed: List ETag revalidation")
+
+
+class EmailListCacheTestCase(APITestCase):
+    """Test the read-through cache for email list pages"""
+    
+    def setUp(self):
+        """Set up a user with a recorded mailbox version"""
+        from api.list_cache import reset_stats
+        reset_stats()
+        self.user = User.objects.create_user(
+            username='cacheuser',
+            email='cache@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/emails/', {
+            'sender': 's@ex.com', 'recipient': 'cache@example.com',
+            'subject': 'Cached', 'body': 'Test'
+        }, format='json')
+        self.email_id = response.json()['id']
+        
+    def test_first_page_is_cached_until_a_write(self):
+        """Test repeat list loads hit the cache and writes invalidate it"""
+        from api.list_cache import get_stats
+        response = self.client.get('/api/emails/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        
+        with self.assertNumQueries(1):  # mailbox version only
+            response = self.client.get('/api/emails/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['subject'], 'Cached')
+        
+        # Different filters and later pages are separate entries
+        self.assertEqual(self.client.get('/api/emails/?is_read=true')['X-Cache'], 'MISS')
+        self.assertNotIn('X-Cache', self.client.get('/api/emails/?page=9'))
+        
+        self.client.post(f'/api/emails/{self.email_id}/star/')
+        response = self.client.get('/api/emails/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['results'][0]['is_starred'])
+        
+        self.assertEqual(get_stats(), {'hits': 1, 'misses': 3, 'hit_ratio': 0.25})
+        print("✅ Test Passed: List cache hit and invalidation")
+
+
+class ChangesFeedTestCase(APITestCase):
+    """Test the delta changes feed"""
+    
+    def setUp(self):
+        """Set up a user and authenticate"""
+        self.user = User.objects.create_user(
+            username='changesuser',
+            email='changes@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def create_email(self, subject):
+        response = self.client.post('/api/emails/', {
+            'sender': 's@ex.com', 'recipient': 'r@ex.com',
+            'subject': subject, 'body': 'Test'
+        }, format='json')
+        return response.json()['id']
+        
+    def test_changes_feed_returns_only_new_changes(self):
+        """Test creates, updates and deletes show up after the cursor"""
+        first = self.create_email('First')
+        second = self.create_email('Second')
+        
+        response = self.client.get('/api/emails/changes/?since=0')
+        data = response.json()
+        self.assertEqual([e['id'] for e in data['changed']], [first, second])
+        self.assertFalse(data['has_more'])
+        cursor = data['cursor']
+        
+        response = self.client.get(f'/api/emails/changes/?since={cursor}')
+        self.assertEqual(response.json()['changed'], [])
+        self.assertEqual(response.json()['cursor'], cursor)
+        
+        self.client.post(f'/api/emails/{first}/star/')
+        self.client.delete(f'/api/emails/{second}/permanent_delete/')
+        
+        data = self.client.get(f'/api/emails/changes/?since={cursor}').json()
+        self.assertEqual([e['id'] for e in data['changed']], [first])
+        self.assertTrue(data['changed'][0]['is_starred'])
+        self.assertEqual(data['deleted'], [second])
+        self.assertGreater(data['cursor'], cursor)
+        print("✅ Test Passed: Changes feed returns deltas and tombstones")
+        
+    def test_changes_feed_pages_with_limit(self):
+        """Test has_more and cursor paging through a large delta"""
+        ids = [self.create_email(f'Page {i}') for i in range(5)]
+        
+        data = self.client.get('/api/emails/changes/?since=0&limit=3').json()
+        self.assertTrue(data['has_more'])
+        seen = [e['id'] for e in data['changed']]
+        
+        data = self.client.get(f"/api/emails/changes/?since={data['cursor']}&limit=3").json()
+        self.assertFalse(data['has_more'])
+        seen += [e['id'] for e in data['changed']]
+        self.assertEqual(seen, ids)
+        print("✅ Test Passed: Changes feed paging")
+
+
+class MailboxEventsTestCase(APITestCase):
+    """Test real-time mailbox event fan-out"""
+    
+    def setUp(self):
+        """Set up a user with one email"""
+        self.user = User.objects.create_user(
+            username='eventsuser',
+            email='events@example.com',
+            password='TestPass123!'
+        )
+        self.email = Email.objects.create(
+            user=self.user, subject='Events', body='Test',
+            sender='s@ex.com', recipient='r@ex.com'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def test_broker_delivers_events_published_from_other_threads(self):
+        """Test publish from a request thread reaches an async subscriber"""
+        broker = InProcessBroker()
+        
+        async def listen():
+            subscription = broker.subscribe(self.user.id)
+            other = broker.subscribe(self.user.id + 1)
+            threading.Thread(
+                target=broker.publish, args=(self.user.id, {'type': 'email.created', 'data': {}})
+            ).start()
+            event = await subscription.get(timeout=2)
+            missed = await other.get(timeout=0.05)
+            subscription.close()
+            other.close()
+            return event, missed
+        
+        event, missed = asyncio.run(listen())
+        self.assertEqual(event['type'], 'email.created')
+        self.assertIsNone(missed)
+        self.assertFalse(broker.has_subscribers(self.user.id))
+        
+        # A broker missing part of the interface fails when built, not on first use
+        from api.events import BaseBroker
+        
+        class PublishOnlyBroker(BaseBroker):
+            def publish(self, user_id, event):
+                pass
+        
+        with self.assertRaises(TypeError):
+            PublishOnlyBroker()
+        print("✅ Test Passed: Broker fan-out across threads")
+        
+    def test_writes_publish_events_after_commit(self):
+        """Test flag changes publish an event with the new cursor"""
+        with mock.patch('api.mailbox_service.publish_mailbox_event') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/emails/{self.email.id}/star/')
+        
+        user_id, event_type, data = publish.call_args_list[0][0]
+        self.assertEqual((user_id, event_type), (self.user.id, 'email.updated'))
+        self.assertEqual(data['ids'], [self.email.id])
+        self.assertEqual(data['fields'], {'is_starred': True})
+        print("✅ Test Passed: Writes publish mailbox events")
+        
+    def test_sse_endpoint_requires_valid_token(self):
+        """Test the event stream authenticates with SimpleJWT access tokens"""
+        self.client.force_authenticate(user=None)
+        response = self.client.get('/api/events/?token=invalid')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        token = str(AccessToken.for_user(self.user))
+        response = self.client.get('/api/events/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        response.close()
+        print("✅ Test Passed: Event stream authentication")
+
+
+class ResponseRenderingTestCase(APITestCase):
+    """Test orjson rendering and response compression"""
+    
+    def setUp(self):
+        """Set up a user with enough mail to pass the compression threshold"""
+        self.user = User.objects.create_user(
+            username='renderuser',
+            email='render@example.com',
+            password='TestPass123!'
+        )
+        for i in range(10):
+            Email.objects.create(
+                user=self.user, subject=f'Render {i}', body='Quarterly report attached. ' * 40,
+                sender='s@ex.com', recipient='r@ex.com'
+            )
+        self.client.force_authenticate(user=self.user)
+        
+    def test_list_is_compressed_when_accepted(self):
+        """Test gzip compression of large JSON responses"""
+        import gzip
+        response = self.client.get('/api/emails/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data['count'], 10)
+        
+        response = self.client.get('/api/emails/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.json()['count'], 10)
+        print("✅ Test Passed: Large responses are compressed")
+        
+    def test_small_responses_are_not_compressed(self):
+        """Test responses under the threshold are sent as-is"""
+        response = self.client.get('/api/health/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.json()['status'], 'healthy')
+        print("✅ Test Passed: Small responses are not compressed")
+        
+    def test_compression_resists_breach(self):
+        """Test gzip output is randomly padded and token responses are never compressed"""
+        import gzip
+        from api.middleware import gzip_compress
+        body = b'{"results": "' + b'x' * 2000 + b'"}'
+        outputs = {gzip_compress(body, 6, 100) for _ in range(20)}
+        self.assertGreater(len({len(output) for output in outputs}), 1)
+        self.assertTrue(all(gzip.decompress(output) == body for output in outputs))
+        
+        with override_settings(RESPONSE_COMPRESSION_MIN_SIZE=0):
+            response = self.client.post('/api/auth/login/', {
+                'username': 'renderuser', 'password': 'TestPass123!'
+            }, format='json', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('access', response.json())
+        print("✅ Test Passed: Compression resists BREACH")
+
+
+class ThreadingTestCase(APITestCase):
+    """Test conversation threading and the thread list"""
+    
+    def setUp(self):
+        """Set up a user with a connected account and authenticate"""
+        self.user = User.objects.create_user(
+            username='threaduser',
+            email='thread@example.com',
+            password='TestPass123!'
+        )
+        self.account = EmailAccount.objects.create(
+            user=self.user, email_address='thread@example.com', provider='gmail'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def parsed(self, external_id, message_id, subject, thread_id='', in_reply_to='', hours_ago=0):
+        return {
+            'external_id': external_id, 'thread_id': thread_id,
+            'message_id': message_id, 'in_reply_to': in_reply_to, 'references': '',
+            'subject': subject, 'sender': f'{external_id}@ex.com', 'recipient': 'thread@example.com',
+            'body': 'Test', 'received_at': timezone.now() - timedelta(hours=hours_ago),
+            'is_read': False, 'is_starred': False,
+        }
+        
+    def test_ingest_groups_replies_into_threads(self):
+        """Test replies are threaded by provider id and In-Reply-To"""
+        ids = ingest_emails(self.user.id, self.account, [
+            self.parsed('m1', '<a@ex.com>', 'Launch plan', hours_ago=3),
+            self.parsed('m2', '<b@ex.com>', 'Re: Launch plan', in_reply_to='<a@ex.com>', hours_ago=2),
+            self.parsed('m3', '<c@ex.com>', 'Lunch?', thread_id='t-9', hours_ago=1),
+        ])
+        self.assertEqual(len(ids), 3)
+        
+        # Second sync: duplicate skipped, provider thread id reused
+        ids = ingest_emails(self.user.id, self.account, [
+            self.parsed('m3', '<c@ex.com>', 'Lunch?', thread_id='t-9'),
+            self.parsed('m4', '<d@ex.com>', 'Re: Lunch?', thread_id='t-9'),
+        ])
+        self.assertEqual(len(ids), 1)
+        
+        launch = Email.objects.get(external_id='m1').thread
+        lunch = Email.objects.get(external_id='m4').thread
+        self.assertEqual(Email.objects.get(external_id='m2').thread, launch)
+        self.assertEqual(Email.objects.get(external_id='m3').thread, lunch)
+        self.assertEqual(Thread.objects.filter(user=self.user).count(), 2)
+        
+        launch.refresh_from_db()
+        self.assertEqual(launch.subject, 'Launch plan')
+        self.assertEqual(launch.message_count, 2)
+        self.assertEqual(launch.unread_count, 2)
+        self.assertEqual(launch.latest_sender, 'm2@ex.com')
+        self.assertEqual(launch.participants, 'm1@ex.com, m2@ex.com')
+        print("✅ Test Passed: Replies are grouped into threads")
+        
+    def test_thread_heads_follow_email_changes(self):
+        """Test counts and latest message update on read, trash and delete"""
+        ingest_emails(self.user.id, self.account, [
+            self.parsed('m1', '<a@ex.com>', 'Budget', hours_ago=2),
+            self.parsed('m2', '<b@ex.com>', 'Re: Budget', in_reply_to='<a@ex.com>', hours_ago=1),
+        ])
+        first, reply = Email.objects.get(external_id='m1'), Email.objects.get(external_id='m2')
+        thread = first.thread
+        
+        self.client.post(f'/api/emails/{first.id}/mark_read/')
+        thread.refresh_from_db()
+        self.assertEqual(thread.unread_count, 1)
+        
+        self.client.post(f'/api/emails/{reply.id}/trash/')
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 1)
+        self.assertEqual(thread.latest_email_id, first.id)
+        
+        self.client.delete(f'/api/emails/{first.id}/permanent_delete/')
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 0)
+        self.assertIsNone(thread.latest_email_id)
+        print("✅ Test Passed: Thread heads follow email changes")
+        
+    def test_thread_list_and_detail(self):
+        """Test the thread list is cursor-paginated and the detail includes messages"""
+        ingest_emails(self.user.id, self.account, [
+            self.parsed('m1', '<a@ex.com>', 'Old topic', hours_ago=5),
+            self.parsed('m2', '<b@ex.com>', 'New topic', hours_ago=1),
+            self.parsed('m3', '<c@ex.com>', 'Re: Old topic', in_reply_to='<a@ex.com>', hours_ago=3),
+        ])
+        Email.objects.filter(external_id='m2').update(is_read=True)
+        
+        response = self.client.get('/api/threads/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual([t['subject'] for t in data['results']], ['New topic', 'Old topic'])
+        
+        old = data['results'][1]
+        response = self.client.get(f"/api/threads/{old['id']}/")
+        self.assertEqual([m['subject'] for m in response.json()['messages']], ['Old topic', 'Re: Old topic'])
+        self.assertTrue(all(m['thread'] == old['id'] for m in response.json()['messages']))
+        
+        # Reply through the API lands in the same thread
+        first = Email.objects.get(external_id='m1')
+        response = self.client.post('/api/emails/send/', {
+            'to': 'm1@ex.com', 'subject': 'Re: Old topic', 'body': 'Sounds good', 'in_reply_to': first.id
+        }, format='json')
+        self.assertEqual(response.json()['email']['thread'], old['id'])
+        print("✅ Test Passed: Thread list and detail work")
+
+
+class EmailLabelTestCase(APITestCase):
+    """Test label filtering, prefetching and bulk labeling"""
+    
+    def setUp(self):
+        """Set up a user with labels and emails"""
+        self.user = User.objects.create_user(
+            username='labeluser',
+            email='label@example.com',
+            password='TestPass123!'
+        )
+        self.work = Label.objects.create(user=self.user, name='Work')
+        self.travel = Label.objects.create(user=self.user, name='Travel')
+        self.emails = [
+            Email.objects.create(
+                user=self.user, subject=f'Email {i}', body='Test',
+                sender='s@ex.com', recipient='r@ex.com'
+            )
+            for i in range(6)
+        ]
+        for email in self.emails[:4]:
+            EmailLabel.objects.create(email=email, label=self.work)
+        EmailLabel.objects.create(email=self.emails[0], label=self.travel)
+        self.client.force_authenticate(user=self.user)
+        
+    def test_list_includes_labels_with_constant_queries(self):
+        """Test labels are prefetched instead of queried per email"""
+        with self.assertNumQueries(6):  # version, hot and cold counts, page, labels, bodies
+            response = self.client.get('/api/emails/')
+        results = response.json()['results']
+        self.assertEqual(len(results), 6)
+        labels = {r['id']: sorted(l['name'] for l in r['labels']) for r in results}
+        self.assertEqual(labels[self.emails[0].id], ['Travel', 'Work'])
+        self.assertEqual(labels[self.emails[5].id], [])
+        print("✅ Test Passed: Labels are prefetched in list responses")
+        
+    def test_filter_by_label(self):
+        """Test ?label= filters through EmailLabel"""
+        response = self.client.get(f'/api/emails/?label={self.work.id}')
+        self.assertEqual(response.json()['count'], 4)
+        response = self.client.get(f'/api/emails/?label={self.travel.id}&is_read=false')
+        self.assertEqual(response.json()['count'], 1)
+        print("✅ Test Passed: Emails filter by label")
+        
+    def test_bulk_apply_and_remove_label(self):
+        """Test bulk labeling skips already-labeled emails and records changes"""
+        cursor = self.client.get('/api/emails/changes/?since=0').json()['cursor']
+        ids = [email.id for email in self.emails]
+        
+        response = self.client.post('/api/emails/labels/apply/', {
+            'label': self.work.id, 'ids': ids
+        }, format='json')
+        self.assertEqual(response.json()['affected'], 2)
+        self.assertEqual(EmailLabel.objects.filter(label=self.work).count(), 6)
+        
+        changes = self.client.get(f'/api/emails/changes/?since={cursor}').json()
+        self.assertEqual(sorted(e['id'] for e in changes['changed']), ids[4:])
+        
+        response = self.client.post('/api/emails/labels/remove/', {
+            'label': self.work.id, 'filters': {'label': self.travel.id}
+        }, format='json')
+        self.assertEqual(response.json()['affected'], 1)
+        self.assertFalse(EmailLabel.objects.filter(label=self.work, email=self.emails[0]).exists())
+        
+        other = User.objects.create_user(username='other', password='TestPass123!')
+        foreign = Label.objects.create(user=other, name='Work')
+        response = self.client.post('/api/emails/labels/apply/', {
+            'label': foreign.id, 'ids': ids
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        print("✅ Test Passed: Bulk label apply and remove work")
+
+
+class EmailContentTestCase(APITestCase):
+    """Test compressed body storage in EmailContent"""
+    
+    def setUp(self):
+        """Set up a user with one long email"""
+        self.user = User.objects.create_user(
+            username='contentuser',
+            email='content@example.com',
+            password='TestPass123!'
+        )
+        self.body = 'Please review the attached quarterly figures before Friday.\n' * 50
+        self.email = Email.objects.create(
+            user=self.user, subject='Figures', body=self.body,
+            sender='s@ex.com', recipient='r@ex.com'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def test_body_is_stored_compressed(self):
+        """Test bodies round-trip through a compressed content row"""
+        content = EmailContent.objects.get(email=self.email)
+        self.assertIn(content.body_codec, ('zstd', 'zlib'))
+        self.assertLess(len(content.body_data), len(self.body) / 5)
+        
+        email = Email.objects.get(id=self.email.id)
+        self.assertEqual(email.body, self.body)
+        self.assertEqual(email.snippet, ' '.join(self.body.split())[:200])
+        print("✅ Test Passed: Bodies are stored compressed")
+        
+    def test_flag_updates_do_not_touch_content(self):
+        """Test flag writes leave EmailContent alone and body edits update it"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f'/api/emails/{self.email.id}/mark_read/')
+        writes = [q['sql'] for q in queries if not q['sql'].startswith('SELECT')]
+        self.assertFalse(any('api_emailcontent' in sql for sql in writes))
+        
+        response = self.client.patch(f'/api/emails/{self.email.id}/', {'body': 'Short reply'}, format='json')
+        self.assertEqual(response.json()['body'], 'Short reply')
+        self.assertEqual(response.json()['snippet'], 'Short reply')
+        self.assertEqual(Email.objects.get(id=self.email.id).body, 'Short reply')
+        print("✅ Test Passed: Flag updates skip the content table")
+
+
+class MailboxTieringTestCase(APITestCase):
+    """Test moving dormant threads to the cold tier and reading them back"""
+    
+    def setUp(self):
+        """Set up an old archived thread, an old thread with a live reply and an inbox email"""
+        self.user = User.objects.create_user(
+            username='tieruser',
+            email='tier@example.com',
+            password='TestPass123!'
+        )
+        self.account = EmailAccount.objects.create(
+            user=self.user, email_address='tier@example.com', provider='gmail'
+        )
+        ingest_emails(self.user.id, self.account, [
+            self.parsed('a1', 'Old project', 'old-1'),
+            self.parsed('a2', 'Re: Old project', 'old-1'),
+            self.parsed('b1', 'Old but active', 'old-2'),
+            self.parsed('b2', 'Re: Old but active', 'old-2'),
+            self.parsed('c1', 'Fresh', 'new-1'),
+        ])
+        old = timezone.now() - timedelta(days=400)
+        Email.objects.exclude(external_id='c1').update(created_at=old)
+        Email.objects.filter(external_id__in=['a1', 'a2', 'b1']).update(is_archived=True)
+        Email.objects.filter(external_id='a2').update(is_starred=True)
+        self.client.force_authenticate(user=self.user)
+        
+    def parsed(self, external_id, subject, thread_id):
+        return {
+            'external_id': external_id, 'thread_id': thread_id, 'message_id': f'<{external_id}@ex.com>',
+            'subject': subject, 'sender': 'boss@ex.com', 'recipient': 'tier@example.com',
+            'body': f'Body of {external_id}', 'received_at': None,
+            'is_read': True, 'is_starred': False,
+        }
+        
+    def tier(self):
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('tier_mailboxes', '--older-than-days', '180', '--sleep', '0', stdout=StringIO())
+        
+    def test_only_dormant_threads_move(self):
+        """Test whole dormant threads move and reads fall back to the cold tier"""
+        self.tier()
+        cold_ids = set(ColdEmail.objects.values_list('external_id', flat=True))
+        self.assertEqual(cold_ids, {'a1', 'a2'})
+        self.assertFalse(Email.objects.filter(external_id__in=['a1', 'a2']).exists())
+        
+        response = self.client.get('/api/emails/?is_archived=true')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(self.client.get('/api/emails/?is_archived=false&is_trashed=false').json()['count'], 2)
+        
+        a2 = ColdEmail.objects.get(external_id='a2')
+        response = self.client.get(f'/api/emails/{a2.id}/')
+        self.assertEqual(response.json()['body'], 'Body of a2')
+        
+        response = self.client.get(f'/api/threads/{a2.thread_id}/')
+        self.assertEqual(len(response.json()['messages']), 2)
+        self.assertEqual(response.json()['message_count'], 2)
+        
+        changes = self.client.get('/api/emails/changes/?since=0').json()
+        self.assertIn(a2.id, [email['id'] for email in changes['changed']])
+        print("✅ Test Passed: Dormant threads are tiered and read transparently")
+        
+    def test_refresh_keeps_cold_thread_heads(self):
+        """Test refreshing a cold thread's head counts its cold messages"""
+        from api.thread_service import refresh_thread_heads
+        self.tier()
+        a2 = ColdEmail.objects.get(external_id='a2')
+        before = Thread.objects.values('message_count', 'latest_email_id', 'participants').get(id=a2.thread_id)
+        
+        refresh_thread_heads([a2.thread_id])
+        thread = Thread.objects.get(id=a2.thread_id)
+        self.assertEqual(thread.message_count, 2)
+        self.assertEqual(thread.latest_email_id, a2.id)
+        self.assertEqual(
+            {'message_count': thread.message_count, 'latest_email_id': thread.latest_email_id,
+             'participants': thread.participants}, before
+        )
+        listed = [item['id'] for item in self.client.get('/api/threads/').json()['results']]
+        self.assertIn(a2.thread_id, listed)
+        print("✅ Test Passed: Cold threads keep their heads on refresh")
+        
+    def test_list_interleaves_tiers_newest_first(self):
+        """Test hot and cold mail are merged by created_at across pages"""
+        from api.tiering import TieredEmailList
+        self.tier()
+        now = timezone.now()
+        for model, external_id, days in [(Email, 'b1', 300), (ColdEmail, 'a1', 200),
+                                         (Email, 'b2', 100), (ColdEmail, 'a2', 50)]:
+            model.objects.filter(external_id=external_id).update(created_at=now - timedelta(days=days))
+        expected = ['c1', 'a2', 'b2', 'a1', 'b1']
+        
+        ids = {e: i for model in (Email, ColdEmail) for i, e in model.objects.values_list('id', 'external_id')}
+        response = self.client.get('/api/emails/')
+        self.assertEqual([email['id'] for email in response.json()['results']], [ids[e] for e in expected])
+        
+        emails = TieredEmailList(Email.objects.filter(user=self.user), ColdEmail.objects.filter(user=self.user))
+        pages = [emails[start:start + 2] for start in range(0, len(emails), 2)]
+        self.assertEqual([[email.external_id for email in page] for page in pages], [expected[:2], expected[2:4], expected[4:]])
+        self.assertEqual(emails[3].external_id, 'a1')
+        print("✅ Test Passed: Tiers interleave by date in email lists")
+        
+    def test_write_restores_thread_to_hot_tier(self):
+        """Test a write to a cold email moves its thread back unchanged"""
+        self.tier()
+        a1 = ColdEmail.objects.get(external_id='a1')
+        created_at = a1.created_at
+        
+        response = self.client.post(f'/api/emails/{a1.id}/restore/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ColdEmail.objects.exists())
+        
+        email = Email.objects.get(id=a1.id)
+        self.assertFalse(email.is_archived)
+        self.assertEqual(email.created_at, created_at)
+        self.assertEqual(email.body, 'Body of a1')
+        self.assertTrue(Email.objects.get(external_id='a2').is_starred)
+        print("✅ Test Passed: Writes restore cold threads")
+        
+    def test_ingest_skips_cold_duplicates(self):
+        """Test refetching a message already in the cold tier creates nothing"""
+        self.tier()
+        a1 = ColdEmail.objects.get(external_id='a1')
+        
+        ids = ingest_emails(self.user.id, self.account, [self.parsed('a1', 'Old project', 'old-1')])
+        self.assertEqual(ids, [])
+        self.assertFalse(Email.objects.filter(external_id='a1').exists())
+        self.assertTrue(ColdEmail.objects.filter(id=a1.id).exists())
+        print("✅ Test Passed: Ingest skips mail already in the cold tier")
+
+
+class PurgeTrashTestCase(APITestCase):
+    """Test the trash retention purge"""
+    
+    def setUp(self):
+        """Set up expired, recent and restored trash plus a label"""
+        self.user = User.objects.create_user(
+            username='purgeuser',
+            email='purge@example.com',
+            password='TestPass123!'
+        )
+        old = timezone.now() - timedelta(days=40)
+        self.expired = [
+            Email.objects.create(user=self.user, sender='a@ex.com', recipient='purge@example.com',
+                                 subject=f'Expired {i}', body='Old trash', is_trashed=True, trashed_at=old)
+            for i in range(3)
+        ]
+        self.recent = Email.objects.create(
+            user=self.user, sender='a@ex.com', recipient='purge@example.com', subject='Recent',
+            body='New trash', is_trashed=True, trashed_at=timezone.now()
+        )
+        self.inbox = Email.objects.create(
+            user=self.user, sender='a@ex.com', recipient='purge@example.com', subject='Inbox', body='Keep'
+        )
+        label = Label.objects.create(user=self.user, name='Old')
+        EmailLabel.objects.create(email=self.expired[0], label=label)
+        self.client.force_authenticate(user=self.user)
+        
+    def test_purge_deletes_only_expired_trash(self):
+        """Test expired trash is deleted in chunks with labels and tombstones"""
+        from django.core.management import call_command
+        from io import StringIO
+        expired_ids = {email.id for email in self.expired}
+        
+        call_command('purge_trash', '--chunk-size', '2', '--sleep', '0', stdout=StringIO())
+        
+        self.assertFalse(Email.objects.filter(id__in=expired_ids).exists())
+        self.assertFalse(EmailContent.objects.filter(email_id__in=expired_ids).exists())
+        self.assertFalse(EmailLabel.objects.exists())
+        self.assertEqual(set(Email.objects.values_list('id', flat=True)), {self.recent.id, self.inbox.id})
+        
+        from api.mailbox_service import get_mailbox_counters
+        self.assertEqual(get_mailbox_counters(self.user.id)['trash'], 1)
+        changes = self.client.get('/api/emails/changes/?since=0').json()
+        self.assertEqual(set(changes['deleted']), expired_ids)
+        print("✅ Test Passed: Expired trash purged")
+        
+    def test_purge_includes_cold_trash(self):
+        """Test expired trash in the cold tier is purged too"""
+        from api.tiering import move_threads_to_cold
+        from api.thread_service import assign_threads
+        email = self.expired[1]
+        assign_threads(self.user.id, [(email, '')])
+        email.save(update_fields=['thread'])
+        Email.objects.filter(id=email.id).update(created_at=timezone.now() - timedelta(days=400))
+        move_threads_to_cold([email.thread_id], timezone.now() - timedelta(days=180))
+        self.assertTrue(ColdEmail.objects.filter(id=email.id).exists())
+        
+        from api.retention import purge_trash, trash_cutoff
+        self.assertEqual(purge_trash(trash_cutoff(30)), 3)
+        self.assertFalse(ColdEmail.objects.exists())
+        print("✅ Test Passed: Cold trash purged")
+
+
+class AutoArchiveReadTestCase(APITestCase):
+    """Test the auto_archive_read preference executor"""
+    
+    def test_archives_read_inbox_mail_for_opted_in_users(self):
+        """Test only opted-in users' read inbox mail is archived, in one UPDATE per batch"""
+        from api.mailbox_service import auto_archive_read
+        opted_in = User.objects.create_user(username='optin', password='TestPass123!')
+        opted_out = User.objects.create_user(username='optout', password='TestPass123!')
+        UserPreference.objects.create(user=opted_in, auto_archive_read=True)
+        UserPreference.objects.create(user=opted_out, auto_archive_read=False)
+        emails = {}
+        for user in (opted_in, opted_out):
+            for name, flags in [('read', {'is_read': True}), ('unread', {}),
+                                ('trashed', {'is_read': True, 'is_trashed': True}),
+                                ('sent', {'is_read': True, 'is_sent': True})]:
+                emails[user.username, name] = Email.objects.create(
+                    user=user, sender='a@ex.com', recipient='me@ex.com', subject=name, body='Body', **flags
+                )
+        
+        with CaptureQueriesContext(connection) as queries:
+            result = auto_archive_read()
+        updates = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE "api_email"') and 'is_archived' in q['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(result, {'users': 1, 'archived': 1})
+        
+        archived = set(Email.objects.filter(is_archived=True).values_list('id', flat=True))
+        self.assertEqual(archived, {emails['optin', 'read'].id})
+        self.client.force_authenticate(user=opted_in)
+        changes = self.client.get('/api/emails/changes/?since=0').json()
+        self.assertIn(emails['optin', 'read'].id, [email['id'] for email in changes['changed']])
+        print("✅ Test Passed: Read inbox mail auto-archived")
+        
+    def test_mail_read_after_the_lock_waits_for_next_run(self):
+        """Test only the locked rows are archived, so stats and the feed stay in step"""
+        from api import mailbox_service
+        from api.mailbox_stats import rebuild_counters
+        from api.models import MailboxStats
+        user = User.objects.create_user(username='racer', password='TestPass123!')
+        UserPreference.objects.create(user=user, auto_archive_read=True)
+        late = Email.objects.create(user=user, sender='a@ex.com', recipient='me@ex.com', subject='late', body='Body')
+        read = Email.objects.create(
+            user=user, sender='a@ex.com', recipient='me@ex.com', subject='read', body='Body', is_read=True
+        )
+        rebuild_counters(user.id)
+        
+        chunks = mailbox_service._chunks
+        def read_meanwhile(items, *args):
+            # Marked read after the rows were selected, before the UPDATE
+            Email.objects.filter(id=late.id).update(is_read=True)
+            MailboxStats.objects.filter(user=user).update(unread=0)
+            return chunks(items, *args)
+        with mock.patch('api.mailbox_service._chunks', side_effect=read_meanwhile):
+            self.assertEqual(mailbox_service.auto_archive_read()['archived'], 1)
+        
+        self.assertEqual(list(Email.objects.filter(is_archived=True).values_list('id', flat=True)), [read.id])
+        counters = MailboxStats.objects.filter(user=user).values('total', 'unread', 'starred').first()
+        self.assertEqual(counters, {'total': 2, 'unread': 0, 'starred': 0})
+        self.assertEqual(mailbox_service.auto_archive_read()['archived'], 1)
+        print("✅ Test Passed: Auto-archive only touches locked rows")
+
+
+class FlagActionTestCase(APITestCase):
+    """Test flag actions write with one targeted UPDATE and return a delta"""
+    
+    def setUp(self):
+        """Set up a user with one threaded email"""
+        self.user = User.objects.create_user(
+            username='flaguser',
+            email='flag@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/emails/', {
+            'sender': 's@ex.com', 'recipient': 'flag@example.com',
+            'subject': 'Flags', 'body': 'A body that flag actions never rewrite'
+        }, format='json')
+        self.email_id = response.json()['id']
+        
+    def test_mark_read_is_one_update_with_compact_response(self):
+        """Test mark_read writes only its columns and skips repeat writes"""
+        url = f'/api/emails/{self.email_id}/mark_read/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], {'id': self.email_id, 'is_read': True})
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "api_email"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"is_read"', updates[0])
+        self.assertNotIn('"subject"', updates[0])
+        self.assertFalse(any('api_emailcontent' in q['sql'] for q in queries.captured_queries))
+        
+        # Already read: the locked read finds nothing to change, so nothing is written
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url)
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]), 0)
+        self.assertFalse(any('api_emailchange' in q['sql'] for q in queries.captured_queries))
+        print("✅ Test Passed: mark_read is a single targeted UPDATE")
+        
+    def test_star_toggle_and_full_response(self):
+        """Test star toggles, accepts an explicit value and can return the full email"""
+        url = f'/api/emails/{self.email_id}/star/'
+        self.assertEqual(self.client.post(url).json()['email']['is_starred'], True)
+        self.assertEqual(self.client.post(url).json()['email']['is_starred'], False)
+        self.client.post(url, {'is_starred': True}, format='json')
+        self.client.post(url, {'is_starred': True}, format='json')
+        self.assertTrue(Email.objects.get(id=self.email_id).is_starred)
+        
+        response = self.client.post(f'/api/emails/{self.email_id}/trash/?full=true')
+        self.assertEqual(response.json()['email']['body'], 'A body that flag actions never rewrite')
+        self.assertTrue(response.json()['email']['is_trashed'])
+        
+        self.assertEqual(self.client.post('/api/emails/999999/archive/').status_code, status.HTTP_404_NOT_FOUND)
+        print("✅ Test Passed: Star toggle and full response")
+
+
+class PriorityRuleTestCase(APITestCase):
+    """Test the compiled priority rule engine"""
+    
+    def setUp(self):
+        """Set up a user with sender, domain and keyword rules"""
+        self.user = User.objects.create_user(
+            username='ruleuser',
+            email='rules@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        for kind, pattern, priority in [
+            ('sender', 'Boss@Corp.com', 'high'),
+            ('domain', '@news.com', 'low'),
+            ('keyword', 'Invoice', 'high'),
+        ]:
+            response = self.client.post('/api/priority-rules/', {
+                'kind': kind, 'pattern': pattern, 'priority': priority
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+    def test_rules_resolve_sender_domain_then_keywords(self):
+        """Test rule precedence, subdomains and both matcher strategies"""
+        from api.priority_rules import AUTOMATON_MIN_KEYWORDS, PriorityEngine, engine_for_user
+        engine = engine_for_user(self.user.id)
+        self.assertEqual(engine.classify('boss@corp.com', 'Lunch?', 'No rush'), 'high')
+        self.assertEqual(engine.classify('digest@mail.news.com', 'URGENT sale', ''), 'low')
+        self.assertEqual(engine.classify('a@ex.com', 'Your INVOICE', ''), 'high')
+        self.assertEqual(engine.classify('a@ex.com', 'Hello', 'This is critical'), 'high')
+        self.assertEqual(engine.classify('a@ex.com', 'Hello', 'Nothing to see'), 'normal')
+        
+        # Enough keywords switch to the automaton (if installed); results must not change
+        rules = [('keyword', f'word{i}', 'low') for i in range(AUTOMATON_MIN_KEYWORDS)]
+        large = PriorityEngine(rules)
+        self.assertEqual(large.classify('a@ex.com', 'about word3', ''), 'low')
+        self.assertEqual(large.classify('a@ex.com', 'word3 is urgent', ''), 'high')
+        self.assertEqual(large.classify('a@ex.com', 'plain', ''), 'normal')
+        
+        # A batch gives the same answers as one email at a time, with either matcher
+        batch = [('boss@corp.com', 'word1', ''), ('a@mail.news.com', '', 'word2'),
+                 ('a@ex.com', 'WORD3 asap', ''), ('a@ex.com', 'plain', ''), (None, None, None)]
+        mixed = PriorityEngine(rules + [('sender', 'boss@corp.com', 'low'), ('domain', 'news.com', 'high')])
+        self.assertEqual(mixed.classify_many(batch, None), ['low', 'high', 'high', None, None])
+        mixed.automaton = None
+        self.assertEqual(mixed.classify_many(batch, None), ['low', 'high', 'high', None, None])
+        
+        response = self.client.post('/api/priority-rules/', {
+            'kind': 'keyword', 'pattern': 'invoice', 'priority': 'low'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("✅ Test Passed: Priority rules resolve in order")
+        
+    def test_priority_set_before_insert(self):
+        """Test created and ingested emails get rule priorities with no second write"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/emails/', {
+                'sender': 'boss@corp.com', 'recipient': 'rules@example.com',
+                'subject': 'Lunch', 'body': 'Nothing special'
+            }, format='json')
+        self.assertEqual(response.json()['priority'], 'high')
+        email_writes = [q['sql'] for q in queries.captured_queries
+                        if q['sql'].startswith(('INSERT INTO "api_email"', 'UPDATE "api_email"'))]
+        self.assertEqual(len(email_writes), 1)
+        
+        # A rule change is picked up by the next batch
+        PriorityRule.objects.create(user=self.user, kind='keyword', pattern='newsletter', priority='low')
+        ingest_emails(self.user.id, None, [
+            {'external_id': 'n1', 'subject': 'Weekly newsletter', 'sender': 'x@ex.com',
+             'recipient': 'rules@example.com', 'body': 'Hi', 'received_at': None,
+             'is_read': False, 'is_starred': False},
+            {'external_id': 'n2', 'subject': 'Re: invoice', 'sender': 'x@ex.com',
+             'recipient': 'rules@example.com', 'body': 'Hi', 'received_at': None,
+             'is_read': False, 'is_starred': False},
+        ])
+        self.assertEqual(Email.objects.get(external_id='n1').priority, 'low')
+        self.assertEqual(Email.objects.get(external_id='n2').priority, 'high')
+        print("✅ Test Passed: Priority applied before insert")
+
+
+class LocalPriorityClassifierTestCase(APITestCase):
+    """Test the per-user local priority classifier"""
+    
+    def setUp(self):
+        """Set up a user whose past emails teach outage alerts are high and digests low"""
+        self.user = User.objects.create_user(
+            username='nbuser',
+            email='nb@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        examples = [
+            ('alerts@ops.io', 'Pager: outage on db server', 'Production outage detected, pager escalation', 'high'),
+            ('digest@blog.io', 'Your weekly digest', 'Top stories this week, unsubscribe any time', 'low'),
+            ('pat@team.io', 'Lunch plans', 'Shall we get lunch on Friday', 'normal'),
+        ]
+        for i in range(25):
+            for sender, subject, body, priority in examples:
+                Email.objects.create(
+                    user=self.user, sender=sender, recipient='nb@example.com',
+                    subject=f'{subject} #{i}', body=body, priority=priority
+                )
+        
+    def test_train_predict_and_correct(self):
+        """Test training, local predictions at ingest and on the AI endpoint, and corrections"""
+        from django.core.management import call_command
+        from io import StringIO
+        from api.local_classifier import predict_priorities, train_user_model
+        call_command('train_priority_models', '--user', str(self.user.id), stdout=StringIO())
+        
+        predictions = predict_priorities(self.user.id, [
+            ('alerts@ops.io', 'New outage', 'pager escalation for the server'),
+            ('digest@blog.io', 'Monthly digest', 'stories you may have missed'),
+        ])
+        self.assertEqual([p[0] for p in predictions], ['high', 'low'])
+        self.assertTrue(all(p[1] > 0.9 for p in predictions))
+        
+        ingest_emails(self.user.id, None, [
+            {'external_id': 'x1', 'subject': 'Your weekly digest', 'sender': 'digest@blog.io',
+             'recipient': 'nb@example.com', 'body': 'Top stories', 'received_at': None,
+             'is_read': False, 'is_starred': False},
+        ])
+        self.assertEqual(Email.objects.get(external_id='x1').priority, 'low')
+        
+        response = self.client.post('/api/ai/detect-priority/', {
+            'sender': 'alerts@ops.io', 'subject': 'outage', 'body': 'pager'
+        }, format='json')
+        self.assertEqual(response.json()['source'], 'local')
+        self.assertEqual(response.json()['priority'], 'high')
+        
+        # Incremental runs pick up new emails, then manual changes to learned ones
+        self.assertEqual(train_user_model(self.user.id), 1)
+        email = Email.objects.filter(sender='digest@blog.io').first()
+        self.client.patch(f'/api/emails/{email.id}/', {'priority': 'normal'}, format='json')
+        self.assertEqual(train_user_model(self.user.id), 1)
+        self.assertEqual(train_user_model(self.user.id), 0)
+        print("✅ Test Passed: Local classifier trains, predicts and learns corrections")
+        
+    def test_compact_models_and_cache_budget(self):
+        """Test loaded models are sparse, old wider models fold exactly and the cache is byte-bounded"""
+        import io
+        import numpy as np
+        from api import local_classifier
+        from api.local_classifier import CLASSES, N_FEATURES, NaiveBayesModel, features, load_model
+        from api.models import PriorityClassifier
+        local_classifier.train_user_model(self.user.id)
+        weights = PriorityClassifier.objects.get(user=self.user).weights
+        model = NaiveBayesModel.loads(weights)
+        batch = [features('alerts@ops.io', 'New outage', 'pager'), features('new@x.io', 'Hello', 'unseen words')]
+        
+        # Same scores as the dense formula
+        compiled = model.compile()
+        totals = model.counts.sum(axis=1, keepdims=True) + local_classifier.ALPHA * N_FEATURES
+        dense = np.log((model.counts + local_classifier.ALPHA) / totals)
+        priors = np.log((model.class_counts + 1) / (model.class_counts + 1).sum())
+        for feats, best in zip(batch, compiled.predict(batch)[0]):
+            self.assertEqual(best, int(np.argmax(dense[:, feats].sum(axis=1) + priors)))
+        self.assertLess(compiled.nbytes, 16 * 1024)
+        
+        # A model stored with twice the feature space predicts the same after folding
+        wide = np.zeros((len(CLASSES), 2 * N_FEATURES), dtype=np.float32)
+        wide[:, N_FEATURES:] = model.counts
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, counts=wide, class_counts=model.class_counts)
+        folded = NaiveBayesModel.loads(buffer.getvalue())
+        self.assertTrue(np.array_equal(folded.counts, model.counts))
+        
+        with mock.patch.object(local_classifier, 'MODEL_CACHE_BYTES', 1):
+            local_classifier._models.clear()
+            local_classifier._models_bytes = 0
+            self.assertIsNotNone(load_model(self.user.id))
+            self.assertEqual(len(local_classifier._models), 1)
+            self.assertEqual(local_classifier._models_bytes, compiled.nbytes)
+        print("✅ Test Passed: Local models are compact and the cache is bounded")
+
+
+class MailboxStatsTestCase(APITestCase):
+    """Test the statistics rollups follow every email write"""
+    
+    def setUp(self):
+        """Set up a user with ingested mail over two days"""
+        self.user = User.objects.create_user(
+            username='statsuser',
+            email='stats@example.com',
+            password='TestPass123!'
+        )
+        self.client.force_authenticate(user=self.user)
+        now = timezone.now()
+        self.ids = ingest_emails(self.user.id, None, [
+            {'external_id': f's{i}', 'subject': 'URGENT' if i == 0 else f'Note {i}',
+             'sender': 'Boss@Corp.com' if i % 2 else 'news@list.io', 'recipient': 'stats@example.com',
+             'body': 'Body', 'received_at': now - timedelta(days=i % 2),
+             'is_read': i >= 3, 'is_starred': i == 1}
+            for i in range(5)
+        ])
+        
+    def counters(self):
+        from api.models import MailboxStats
+        from api.mailbox_stats import COUNTER_FIELDS
+        return MailboxStats.objects.filter(user=self.user).values(*COUNTER_FIELDS).first()
+        
+    def assertMatchesRecount(self):
+        from api.mailbox_stats import rebuild_counters
+        incremental = self.counters()
+        rebuild_counters(self.user.id)
+        self.assertEqual(incremental, self.counters())
+        
+    def test_ingest_counts_volume_senders_and_state(self):
+        """Test ingest fills the counters, daily volume and top senders"""
+        from api.models import DailyEmailStats, SenderStats
+        self.assertEqual(self.counters(), {
+            'total': 5, 'unread': 3, 'starred': 1,
+            'high_priority': 1, 'normal_priority': 4, 'low_priority': 0,
+        })
+        self.assertEqual(sorted(DailyEmailStats.objects.filter(user=self.user).values_list('received', flat=True)), [2, 3])
+        self.assertEqual(
+            dict(SenderStats.objects.filter(user=self.user).values_list('sender', 'received')),
+            {'boss@corp.com': 2, 'news@list.io': 3}
+        )
+        
+        self.client.post('/api/emails/send/', {
+            'to': 'friend@ex.com', 'subject': 'Hi', 'body': 'Hello'
+        }, format='json')
+        self.assertEqual(sum(DailyEmailStats.objects.filter(user=self.user).values_list('sent', flat=True)), 1)
+        self.assertEqual(SenderStats.objects.filter(user=self.user).count(), 2)
+        self.assertMatchesRecount()
+        print("✅ Test Passed: Ingest maintains the rollups")
+        
+    def test_flag_changes_adjust_counters_incrementally(self):
+        """Test flag actions, bulk operations, edits and deletes keep counters exact"""
+        first, second, third = self.ids[:3]
+        self.client.post(f'/api/emails/{first}/mark_read/')
+        self.client.post(f'/api/emails/{second}/trash/')
+        self.client.post(f'/api/emails/{third}/star/')
+        self.client.post('/api/emails/bulk/', {'operation': 'archive', 'ids': self.ids[2:4]}, format='json')
+        self.client.patch(f'/api/emails/{self.ids[4]}/', {'priority': 'low'}, format='json')
+        self.client.delete(f'/api/emails/{first}/')
+        self.assertEqual(self.counters(), {
+            'total': 3, 'unread': 0, 'starred': 1,
+            'high_priority': 0, 'normal_priority': 2, 'low_priority': 1,
+        })
+        self.assertMatchesRecount()
+        
+        # Restoring from trash brings the email back into the counts
+        self.client.post(f'/api/emails/{second}/restore/')
+        self.assertEqual(self.counters()['unread'], 1)
+        self.assertMatchesRecount()
+        
+        # A repeated action changes nothing, so the rollup is not written
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f'/api/emails/{second}/restore/')
+        self.assertFalse(any('api_mailboxstats' in q['sql'] for q in queries.captured_queries))
+        print("✅ Test Passed: Flag changes adjust the rollups")
+        
+    def test_bulk_skips_rows_changed_meanwhile(self):
+        """Test a bulk write only counts rows still unchanged once they are locked"""
+        from api import mailbox_service
+        first, second = self.ids[:2]
+        id_pages = mailbox_service._id_pages
+        
+        def change_meanwhile(change):
+            # Another request changes an email after the first page of ids was read
+            pending = [change]
+            def pages_with_change(queryset, *args):
+                for ids in id_pages(queryset, *args):
+                    if pending:
+                        pending.pop()()
+                    yield ids
+            return mock.patch.object(mailbox_service, '_id_pages', pages_with_change)
+        
+        with change_meanwhile(lambda: mailbox_service.set_email_flags(self.user.id, first, 'mark_read')):
+            response = self.client.post('/api/emails/bulk/', {'operation': 'mark_read', 'all': True}, format='json')
+        self.assertEqual(response.json()['affected'], 2)
+        self.assertEqual(self.counters()['unread'], 0)
+        self.assertMatchesRecount()
+        
+        with change_meanwhile(lambda: self.client.delete(f'/api/emails/{second}/')):
+            response = self.client.post('/api/emails/bulk/', {'operation': 'permanent_delete', 'all': True}, format='json')
+        self.assertEqual(response.json()['affected'], 4)
+        self.assertEqual(self.counters()['total'], 0)
+        self.assertMatchesRecount()
+        print("✅ Test Passed: Bulk writes skip rows changed meanwhile")
+        
+    def test_rebuild_command(self):
+        """Test the rebuild command recounts drifted rollups"""
+        from django.core.management import call_command
+        from io import StringIO
+        from api.models import MailboxStats, SenderStats
+        MailboxStats.objects.filter(user=self.user).update(unread=99)
+        SenderStats.objects.filter(user=self.user).delete()
+        call_command('rebuild_mailbox_stats', '--user', str(self.user.id), stdout=StringIO())
+        self.assertEqual(self.counters()['unread'], 3)
+        self.assertEqual(SenderStats.objects.filter(user=self.user).count(), 2)
+        print("✅ Test Passed: Rollups rebuild from the email rows")
+        
+    def test_demo_seed_keeps_rollups_current(self):
+        """Test reseeding demo mail leaves the rollups matching the seeded mail"""
+        from django.core.management import call_command
+        from io import StringIO
+        from api.models import DailyEmailStats, SenderStats
+        from api.mailbox_stats import rebuild_user_stats
+        
+        def rollups():
+            return (
+                self.counters(),
+                sorted(DailyEmailStats.objects.filter(user=self.user).values_list('day', 'received', 'sent')),
+                sorted(SenderStats.objects.filter(user=self.user).values_list('sender', 'received')),
+            )
+        
+        for _ in range(2):
+            call_command('populate_demo_emails', stdout=StringIO())
+        seeded = rollups()
+        self.assertEqual(seeded[0]['total'], Email.objects.filter(user=self.user).count())
+        rebuild_user_stats(self.user.id)
+        self.assertEqual(seeded, rollups())
+        print("✅ Test Passed: Demo seeding keeps the rollups current")
+
+
+def isolate_ai_scheduler(testcase, **overrides):
+    """Give a test its own Gemini scheduler state, without rate limits unless overridden"""
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    testcase.addCleanup(os.remove, path)
+    options = {'GEMINI_REQUESTS_PER_MINUTE': 0, 'GEMINI_USER_REQUESTS_PER_MINUTE': 0}
+    options.update(overrides)
+    scheduler_settings = override_settings(GEMINI_SCHEDULER_STATE=path, **options)
+    scheduler_settings.enable()
+    testcase.addCleanup(scheduler_settings.disable)
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_CACHE_TTL=3600)
+class AIResultCacheTestCase(TestCase):
+    """Test the content-hash cache in front of Gemini"""
+    
+    def setUp(self):
+        from api import ai_cache
+        from api.gemini_service import GeminiAIService
+        ai_cache.clear_memory()
+        ai_cache.reset_stats()
+        with mock.patch('api.gemini_service.genai'):
+            self.service = GeminiAIService()
+        self.generate = self.service.model.generate_content
+        isolate_ai_scheduler(self)
+        
+    def test_repeated_summary_served_from_cache(self):
+        """Test a repeated summary skips the model, from memory and then from the table"""
+        from api import ai_cache
+        self.generate.return_value.text = 'SUMMARY: Launch moved.\nKEY_POINTS:\n• Friday\nACTION_ITEMS:\nNone'
+        first = self.service.summarize_email('Launch', 'The launch moves to Friday.', 'pm@corp.com')
+        first['summary'] = 'changed by the caller'
+        
+        second = self.service.summarize_email('Launch', 'The launch moves to Friday.', 'pm@corp.com')
+        self.assertEqual(second['summary'], 'Launch moved.')
+        
+        # Another worker has an empty memory tier but shares the table
+        ai_cache.clear_memory()
+        third = self.service.summarize_email('Launch', 'The launch moves to Friday.', 'pm@corp.com')
+        self.assertEqual(third, second)
+        self.assertEqual(self.generate.call_count, 1)
+        
+        # A different email is a miss
+        self.service.summarize_email('Launch', 'The launch moves to Monday.', 'pm@corp.com')
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(ai_cache.get_stats()['summary'], {
+            'memory_hits': 1, 'db_hits': 1, 'misses': 2, 'hit_ratio': 0.5,
+        })
+        print("✅ Test Passed: Repeated summaries come from the cache")
+        
+    def test_failures_are_not_cached(self):
+        """Test a model error falls back without storing the fallback"""
+        from api.models import AIResultCache
+        self.generate.side_effect = RuntimeError('quota exceeded')
+        self.assertEqual(self.service.detect_email_priority('Outage', 'Server down', 'ops@corp.com'), 'normal')
+        self.assertFalse(AIResultCache.objects.exists())
+        
+        self.generate.side_effect = None
+        self.generate.return_value.text = 'high'
+        self.assertEqual(self.service.detect_email_priority('Outage', 'Server down', 'ops@corp.com'), 'high')
+        self.assertEqual(self.service.detect_email_priority('Outage', 'Server down', 'ops@corp.com'), 'high')
+        self.assertEqual(self.generate.call_count, 2)
+        print("✅ Test Passed: Failures are not cached")
+        
+    def test_expiry_and_size_eviction(self):
+        """Test expired results are recomputed and prune enforces the size cap"""
+        from django.core.management import call_command
+        from io import StringIO
+        from api import ai_cache
+        from api.models import AIResultCache
+        self.generate.return_value.text = 'SUBJECT: Re: Hello\nBODY:\nHi there'
+        for tone in ('professional', 'friendly', 'formal'):
+            self.service.generate_email_reply('Hello', 'Hi!', 'a@ex.com', reply_tone=tone)
+        self.assertEqual(AIResultCache.objects.count(), 3)
+        
+        AIResultCache.objects.filter(pk__in=AIResultCache.objects.order_by('last_used_at').values('pk')[:1]).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        call_command('prune_ai_cache', '--max-entries', '1', stdout=StringIO())
+        self.assertEqual(AIResultCache.objects.count(), 1)
+        
+        # An evicted result is computed again once it leaves memory too
+        ai_cache.clear_memory()
+        self.service.generate_email_reply('Hello', 'Hi!', 'a@ex.com', reply_tone='professional')
+        self.assertEqual(self.generate.call_count, 4)
+        print("✅ Test Passed: Expired and excess results are evicted")
+
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class BatchAnalyzeTestCase(APITestCase):
+    """Test concurrent batch priority detection"""
+    
+    def setUp(self):
+        from api import ai_cache
+        from api.gemini_service import GeminiAIService
+        ai_cache.clear_memory()
+        self.user = User.objects.create_user(username='batch', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('api.gemini_service.genai'):
+            self.service = GeminiAIService()
+        isolate_ai_scheduler(self)
+        
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        
+        def generate(prompt, **kwargs):
+            with self.lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            try:
+                time.sleep(0.1)
+                subjects = re.findall(r'^Subject: (.*)$', prompt, re.M)
+                if 'broken' in subjects:
+                    raise RuntimeError('deadline exceeded')
+                priorities = ['high' if subject.startswith('urgent') else 'low' for subject in subjects]
+                if 'generation_config' not in kwargs:
+                    return mock.Mock(text=priorities[0])
+                return mock.Mock(text=json.dumps([
+                    {'index': index, 'priority': priority} for index, priority in enumerate(priorities, 1)
+                ]))
+            finally:
+                with self.lock:
+                    self.active -= 1
+        self.service.model.generate_content.side_effect = generate
+        self.emails = [
+            {'id': 1, 'subject': 'urgent outage', 'body': 'Down', 'sender': 'ops@corp.com'},
+            {'id': 2, 'subject': 'broken', 'body': 'Fails', 'sender': 'x@corp.com'},
+            {'id': 3, 'subject': 'newsletter', 'body': 'Weekly', 'sender': 'news@list.io'},
+            {'id': 4, 'subject': 'urgent invoice', 'body': 'Pay', 'sender': 'ap@corp.com'},
+            {'id': 5, 'subject': 'newsletter', 'body': 'Weekly', 'sender': 'news@list.io'},
+        ]
+        
+    @override_settings(GEMINI_TRIAGE_MAX_EMAILS=2)
+    def test_batch_runs_concurrently_in_order(self):
+        """Test packed requests overlap, keep input order and survive a failing item"""
+        analyzed = self.service.batch_analyze_emails(self.emails)
+        
+        self.assertEqual([email['id'] for email in analyzed], [1, 2, 3, 4, 5])
+        self.assertEqual([email['ai_priority'] for email in analyzed], ['high', 'normal', 'low', 'high', 'low'])
+        self.assertGreater(self.max_active, 1)
+        # Two packed requests (the duplicate newsletter shares a slot); the
+        # failing one is split and each email asked on its own
+        self.assertEqual(self.service.model.generate_content.call_count, 4)
+        print("✅ Test Passed: Batch analysis runs concurrently")
+        
+    def test_packed_requests_cut_calls(self):
+        """Test short emails pack many per request and long ones fewer"""
+        from api.gemini_service import pack_emails
+        emails = [
+            {'id': i, 'subject': f'urgent {i}' if i % 2 else f'update {i}', 'body': 'Short note', 'sender': 'a@ex.com'}
+            for i in range(40)
+        ]
+        analyzed = self.service.batch_analyze_emails(emails)
+        self.assertEqual(self.service.model.generate_content.call_count, 2)
+        self.assertEqual([email['ai_priority'] for email in analyzed], ['low', 'high'] * 20)
+        
+        long_emails = [('Report', 'x' * 5000, 'a@ex.com')] * 40
+        self.assertTrue(all(len(chunk) < 20 for chunk in pack_emails(long_emails)))
+        print("✅ Test Passed: Packed triage cuts model calls")
+        
+    def test_packed_response_parsing_and_resplit(self):
+        """Test fenced or partial JSON is parsed and dropped emails are asked again"""
+        from api.gemini_service import parse_priority_array
+        self.assertEqual(
+            parse_priority_array('```json\n[{"index": 2, "priority": "HIGH"}, {"index": "1", "priority": "low"}]\n```', 3),
+            ['low', 'high', None]
+        )
+        self.assertEqual(parse_priority_array('Here you go: ["high", "urgent!", "low"]', 3), ['high', None, 'low'])
+        self.assertEqual(parse_priority_array('not json', 2), [None, None])
+        
+        # The model leaves out the third email; only that one is asked again
+        self.service.model.generate_content.side_effect = [
+            mock.Mock(text='[{"index": 1, "priority": "high"}, {"index": 2, "priority": "low"}]'),
+            mock.Mock(text='normal'),
+        ]
+        emails = [{'subject': f'Email {i}', 'body': 'Text', 'sender': 'a@ex.com'} for i in range(3)]
+        self.assertEqual(
+            [priority for _, priority in self.service.iter_email_priorities(emails)],
+            ['high', 'low', 'normal']
+        )
+        self.assertIn('Subject: Email 2', self.service.model.generate_content.call_args[0][0])
+        print("✅ Test Passed: Packed responses parse robustly")
+        
+    def test_streaming_endpoint(self):
+        """Test stream=true returns one NDJSON line per email in input order"""
+        with mock.patch('api.ai_views.get_gemini_service', return_value=self.service):
+            response = self.client.post('/api/ai/batch-analyze/', {
+                'emails': self.emails, 'engine': 'gemini', 'stream': True
+            }, format='json')
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        
+        self.assertEqual([line['id'] for line in lines], [1, 2, 3, 4, 5])
+        self.assertEqual(lines[0]['ai_priority'], 'high')
+        self.assertEqual(lines[1]['ai_priority'], 'normal')
+        self.assertTrue(all(line['source'] == 'gemini' for line in lines))
+        
+        # Under ASGI the lines come from an async iterator, so Django sends
+        # each one as it is ready instead of buffering the whole stream
+        from django.test import AsyncRequestFactory
+        from rest_framework.test import force_authenticate
+        from api.ai_views import batch_analyze_priorities
+        request = AsyncRequestFactory().post('/api/ai/batch-analyze/', {
+            'emails': self.emails, 'engine': 'gemini', 'stream': True
+        }, content_type='application/json')
+        force_authenticate(request, user=self.user)
+        
+        async def collect(response):
+            return [line async for line in response.streaming_content]
+        with mock.patch('api.ai_views.get_gemini_service', return_value=self.service), \
+                override_settings(AI_CACHE_TTL=0):
+            response = batch_analyze_priorities(request)
+            self.assertTrue(response.is_async)
+            lines = [json.loads(line) for line in asyncio.run(collect(response))]
+        self.assertEqual([line['id'] for line in lines], [1, 2, 3, 4, 5])
+        print("✅ Test Passed: Batch results stream as NDJSON")
+        
+    def test_ingest_triage_covers_unmatched_emails(self):
+        """Test triage sends only emails no rule matched, in one packed request"""
+        from api.priority_rules import apply_priority_rules
+        emails = [
+            Email(user=self.user, subject='urgent outage', body='Down', sender='ops@corp.com'),
+            Email(user=self.user, subject='newsletter', body='Weekly', sender='news@list.io'),
+            Email(user=self.user, subject='quarterly plan', body='Draft', sender='pm@corp.com'),
+        ]
+        with mock.patch('api.gemini_service.get_gemini_service', return_value=self.service):
+            apply_priority_rules(self.user.id, emails, triage=True)
+        self.assertEqual([email.priority for email in emails], ['high', 'low', 'low'])
+        self.assertEqual(self.service.model.generate_content.call_count, 1)
+        print("✅ Test Passed: Ingest triage packs unmatched emails")
+
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class AIStreamingTestCase(APITestCase):
+    """Test streamed summaries and replies"""
+    
+    SUMMARY = 'SUMMARY: Launch moved to Friday.\nKEY_POINTS:\n• New date\nACTION_ITEMS:\nNone'
+    
+    def setUp(self):
+        from api import ai_cache
+        from api.gemini_service import GeminiAIService
+        ai_cache.clear_memory()
+        self.user = User.objects.create_user(username='streamer', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('api.gemini_service.genai'):
+            self.service = GeminiAIService()
+        isolate_ai_scheduler(self)
+        
+    def test_parser_is_independent_of_chunking(self):
+        """Test every split of the text gives the same sections"""
+        from api.section_parser import SectionParser, parse_sections
+        expected = parse_sections(self.SUMMARY, ('SUMMARY', 'KEY_POINTS', 'ACTION_ITEMS'))
+        self.assertEqual(expected['summary'], 'Launch moved to Friday.')
+        self.assertEqual(expected['action_items'], 'None')
+        for size in range(1, 8):
+            parser = SectionParser(('SUMMARY', 'KEY_POINTS', 'ACTION_ITEMS'))
+            for start in range(0, len(self.SUMMARY), size):
+                parser.feed(self.SUMMARY[start:start + size])
+            parser.close()
+            self.assertEqual({k: v.strip() for k, v in parser.sections.items()}, expected)
+        
+        # Markers are only looked for after the current section
+        reply = parse_sections('SUBJECT: Re: Hi\nBODY:\nThe SUBJECT: line was fine.', ('SUBJECT', 'BODY'))
+        self.assertEqual(reply['body'], 'The SUBJECT: line was fine.')
+        print("✅ Test Passed: Section parser handles any chunking")
+        
+    def test_summary_stream_sends_sections_then_result(self):
+        """Test the SSE endpoint forwards sections and caches the final result"""
+        chunks = ['SUMMARY: Launch moved', ' to Friday.\nKEY_PO', 'INTS:\n• New date\nACTION_ITEMS:\nNone']
+        self.service.model.generate_content.return_value = [mock.Mock(text=chunk) for chunk in chunks]
+        with mock.patch('api.ai_views.get_gemini_service', return_value=self.service):
+            response = self.client.post('/api/ai/summarize/stream/', {
+                'subject': 'Launch', 'body': 'The launch moves to Friday.', 'sender': 'pm@corp.com'
+            }, format='json')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            frames = b''.join(response.streaming_content).decode().strip().split('\n\n')
+        
+        events = [
+            (frame.split('\n')[0][len('event: '):], json.loads(frame.split('\n')[1][len('data: '):]))
+            for frame in frames
+        ]
+        sections = [data['section'] for event, data in events if event == 'section']
+        self.assertEqual(sections[0], 'summary')
+        self.assertIn('key_points', sections)
+        self.assertEqual(''.join(data['text'] for event, data in events if data.get('section') == 'summary').strip(),
+                         'Launch moved to Friday.')
+        event, result = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertEqual(result['action_items'], 'No action required')
+        self.assertEqual(self.service.model.generate_content.call_args[1]['stream'], True)
+        
+        # The non-streaming endpoint reuses the streamed result
+        self.assertEqual(self.service.summarize_email('Launch', 'The launch moves to Friday.', 'pm@corp.com'), result)
+        self.assertEqual(self.service.model.generate_content.call_count, 1)
+        print("✅ Test Passed: Summaries stream as Server-Sent Events")
+        
+    def test_reply_stream_error_and_async_iteration(self):
+        """Test a failing stream ends with an error event and ASGI iteration works"""
+        from api.ai_views import _iterate_in_thread
+        self.service.model.generate_content.side_effect = RuntimeError('quota exceeded')
+        events = list(self.service.stream_reply('Hello', 'Hi!', 'a@ex.com'))
+        self.assertEqual(events, [('error', {'error': 'quota exceeded'})])
+        
+        async def collect():
+            return [item async for item in _iterate_in_thread(iter(['a', 'b']))]
+        self.assertEqual(asyncio.run(collect()), ['a', 'b'])
+        print("✅ Test Passed: Reply stream errors are reported")
+        
+    @override_settings(GEMINI_RETRY_BASE_DELAY=0.01)
+    def test_stream_outcome_reaches_scheduler(self):
+        """Test stream failures are retried before the first chunk and count for the breaker"""
+        from api import ai_scheduler
+        from google.api_core import exceptions as google_exceptions
+        
+        def failing(*chunks):
+            yield from (mock.Mock(text=chunk) for chunk in chunks)
+            raise google_exceptions.ServiceUnavailable('overloaded')
+        
+        # Fails before any text: retried, and the retry completes
+        self.service.model.generate_content.side_effect = [failing(), iter([mock.Mock(text='SUBJECT: Hi\nBODY:\nOk')])]
+        events = list(self.service.stream_reply('Hello', 'Hi!', 'a@ex.com'))
+        self.assertEqual(events[-1], ('done', {'subject': 'Hi', 'body': 'Ok'}))
+        self.assertEqual(ai_scheduler.breaker_state()['failures'], 0)
+        
+        # Fails after text was sent: not retried, recorded as a failure
+        self.service.model.generate_content.side_effect = [failing('SUBJECT: Hi\nBODY:\nPart')]
+        events = list(self.service.stream_reply('Hello again', 'Hi!', 'a@ex.com'))
+        self.assertEqual(events[-1], ('error', {'error': '503 overloaded'}))
+        self.assertEqual(self.service.model.generate_content.call_count, 3)
+        self.assertEqual(ai_scheduler.breaker_state()['failures'], 1)
+        print("✅ Test Passed: Stream outcomes reach the scheduler")
+        
+    def test_stream_reads_cold_email(self):
+        """Test email_id also finds an email moved to the cold tier"""
+        from api.thread_service import assign_threads
+        from api.tiering import move_threads_to_cold
+        email = Email.objects.create(
+            user=self.user, subject='Old launch', body='The launch moved.', sender='pm@corp.com',
+            recipient='me@corp.com', is_archived=True
+        )
+        assign_threads(self.user.id, [(email, '')])
+        email.save(update_fields=['thread'])
+        Email.objects.filter(id=email.id).update(created_at=timezone.now() - timedelta(days=400))
+        move_threads_to_cold([email.thread_id], timezone.now() - timedelta(days=180))
+        self.assertTrue(ColdEmail.objects.filter(id=email.id).exists())
+        
+        self.service.model.generate_content.return_value = [mock.Mock(text=self.SUMMARY)]
+        with mock.patch('api.ai_views.get_gemini_service', return_value=self.service):
+            response = self.client.post('/api/ai/summarize/stream/', {'email_id': email.id}, format='json')
+            b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('The launch moved.', self.service.model.generate_content.call_args[0][0])
+        print("✅ Test Passed: Streams read cold emails")
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_CACHE_TTL=0, GEMINI_RETRY_BASE_DELAY=0.01)
+class GeminiSchedulerTestCase(TestCase):
+    """Test retries, the circuit breaker and shared rate limits against the fake Gemini server"""
+    
+    def setUp(self):
+        from api.fake_gemini import FakeGeminiServer
+        from api.gemini_service import GeminiAIService
+        self.server = FakeGeminiServer().start()
+        self.addCleanup(self.server.stop)
+        isolate_ai_scheduler(self)
+        with override_settings(GEMINI_API_ENDPOINT=self.server.url):
+            self.service = GeminiAIService()
+        
+    def test_transient_errors_are_retried(self):
+        """Test 503 and 429 responses are retried until the request succeeds"""
+        self.server.queue(503, 429)
+        self.assertEqual(self.service.detect_email_priority('Server down', 'urgent: prod is down'), 'high')
+        self.assertEqual(len(self.server.prompts), 3)
+        
+        # Bad requests are not retried
+        self.server.queue(400)
+        self.assertEqual(self.service.detect_email_priority('Weekly digest', 'newsletter'), 'normal')
+        self.assertEqual(len(self.server.prompts), 4)
+        print("✅ Test Passed: Transient Gemini errors are retried")
+        
+    @override_settings(GEMINI_MAX_RETRIES=0, GEMINI_BREAKER_THRESHOLD=2, GEMINI_BREAKER_COOLDOWN=0.2)
+    def test_breaker_fails_fast_to_local_heuristic(self):
+        """Test the breaker opens after repeated failures, then probes and closes"""
+        from api import ai_scheduler
+        self.server.queue(500, 500)
+        self.service.detect_email_priority('Lunch', 'Pizza?')
+        self.service.detect_email_priority('Lunch', 'Pizza?')
+        self.assertGreater(ai_scheduler.breaker_state()['open_until'], 0)
+        
+        # Open: no request is sent and the keyword heuristic answers
+        self.assertEqual(self.service.detect_email_priority('URGENT: outage', 'Down'), 'high')
+        summary = self.service.summarize_email('Lunch', 'Pizza?')
+        self.assertIn('circuit breaker', summary['full_summary'])
+        self.assertEqual(len(self.server.prompts), 2)
+        
+        time.sleep(0.25)
+        self.assertEqual(self.service.detect_email_priority('Weekly digest', 'newsletter'), 'low')
+        self.assertEqual(ai_scheduler.breaker_state(), {'failures': 0, 'open_until': 0})
+        print("✅ Test Passed: Circuit breaker fails fast and recovers")
+        
+    def test_rate_limits_are_shared_and_per_user(self):
+        """Test the buckets persist in the shared state and limit each user separately"""
+        from api import ai_scheduler
+        with override_settings(GEMINI_REQUESTS_PER_MINUTE=600, GEMINI_USER_REQUESTS_PER_MINUTE=1):
+            ai_scheduler.acquire(user_id=1)
+            # A one-per-minute user would wait longer than MAX_TOKEN_WAIT
+            with self.assertRaises(ai_scheduler.AIUnavailable):
+                ai_scheduler.acquire(user_id=1)
+            ai_scheduler.acquire(user_id=2)
+        with open(settings.GEMINI_SCHEDULER_STATE) as handle:
+            buckets = json.load(handle)['buckets']
+        self.assertEqual(set(buckets), {'global', 'user:1', 'user:2'})
+        self.assertLess(buckets['user:1'][0], 1)
+        print("✅ Test Passed: Rate limits are shared and per user")
+        
+    def test_packed_and_streamed_requests_through_fake_server(self):
+        """Test the real client talks to the fake server for packed and streamed calls"""
+        emails = [
+            {'subject': 'urgent: invoice overdue', 'body': 'Pay today', 'sender': 'ap@corp.com'},
+            {'subject': 'Weekly digest', 'body': 'newsletter', 'sender': 'news@list.io'},
+            {'subject': 'Lunch', 'body': 'Pizza?', 'sender': 'amy@corp.com'},
+        ]
+        self.assertEqual(
+            [priority for _, priority in self.service.iter_email_priorities(emails, user_id=1)],
+            ['high', 'low', 'normal']
+        )
+        self.assertEqual(len(self.server.prompts), 1)
+        
+        events = list(self.service.stream_reply('Lunch', 'Pizza?', 'amy@corp.com', user_id=1))
+        self.assertIn(('section', 'body'), {(event, data.get('section')) for event, data in events})
+        self.assertEqual(events[-1], ('done', {'subject': 'Re: Lunch', 'body': 'Hello,\n\nThanks for your email.\n\nBest regards'}))
+        print("✅ Test Passed: Fake Gemini server drives the real client")
+
+
+@override_settings(GEMINI_API_KEY='test-key', AI_CACHE_TTL=0)
+class PromptReductionTestCase(TestCase):
+    """Test email bodies are reduced before they go into Gemini prompts"""
+    
+    THREAD = (
+        "Hi team,\r\n\r\nCan we   move the launch\tto Friday?\r\n\r\n"
+        "-- \r\nAmy Chen\r\nProduct Lead | +1 555 0100\r\n\r\n"
+        "CONFIDENTIALITY NOTICE: This e-mail is intended solely for the named recipient.\r\n\r\n"
+        "Sent from my iPhone\r\n\r\n"
+        "On Mon, Mar 3, 2025 at 10:00 AM Bob Stone <bob@corp.com>\r\nwrote:\r\n\r\n"
+        "> The launch is on Wednesday.\r\n> Old quoted text\r\n"
+    )
+    
+    def test_quotes_signature_and_disclaimer_removed(self):
+        """Test the reply chain, signature, footer and disclaimer are dropped"""
+        from api.prompt_reduction import reduce_body
+        self.assertEqual(reduce_body(self.THREAD, 0), "Hi team,\n\nCan we move the launch to Friday?")
+        
+        # Inline answers keep the new text, quoted lines go
+        inline = "> When is the launch?\nFriday.\n> Who presents?\nAmy.\n\nThanks,\nBob\nSent from my Pixel"
+        self.assertEqual(reduce_body(inline, 0), "Friday.\nAmy.\n\nThanks,\nBob")
+        
+        # A bare forward or quote keeps its content
+        self.assertEqual(reduce_body("> only quoted text", 0), "> only quoted text")
+        disclaimer = "This message is confidential and intended for the named recipient."
+        self.assertEqual(reduce_body(disclaimer, 0), disclaimer)
+        print("✅ Test Passed: Quotes, signatures and disclaimers are removed")
+        
+    def test_html_remnants_and_token_budget(self):
+        """Test HTML is reduced to text and long bodies are cut at a boundary"""
+        from api.prompt_reduction import TRUNCATION_MARK, estimate_tokens, reduce_body
+        html = (
+            "<html><head><style>p {color: red}</style></head><body>"
+            "<p>Invoice&nbsp;#42 is&nbsp;&nbsp;due.</p><p>Please pay &amp; confirm.</p></body></html>"
+        )
+        self.assertEqual(reduce_body(html, 0), "Invoice #42 is due.\nPlease pay & confirm.")
+        
+        long_body = ' '.join(f"Sentence number {i} is here." for i in range(200))
+        reduced = reduce_body(long_body, 50)
+        self.assertTrue(reduced.endswith('here.' + TRUNCATION_MARK))
+        self.assertLessEqual(estimate_tokens(reduced), 51)
+        self.assertEqual(reduce_body("Short body", 50), "Short body")
+        print("✅ Test Passed: HTML remnants and token budgets")
+        
+    def test_prompts_carry_reduced_bodies(self):
+        """Test every operation sends the reduced body within its budget"""
+        from api.fake_gemini import FakeGeminiServer
+        from api.gemini_service import GeminiAIService
+        server = FakeGeminiServer().start()
+        self.addCleanup(server.stop)
+        isolate_ai_scheduler(self)
+        with override_settings(GEMINI_API_ENDPOINT=server.url):
+            service = GeminiAIService()
+        
+        service.detect_email_priority('Launch', self.THREAD, 'amy@corp.com')
+        service.summarize_email('Launch', self.THREAD, 'amy@corp.com')
+        service.generate_email_reply('Launch', self.THREAD, 'amy@corp.com')
+        list(service.iter_email_priorities([
+            {'subject': 'Launch date', 'body': self.THREAD, 'sender': 'amy@corp.com'},
+            {'subject': 'Lunch', 'body': 'Pizza?', 'sender': 'bob@corp.com'},
+        ]))
+        self.assertEqual(len(server.prompts), 4)
+        for prompt in server.prompts:
+            self.assertIn('Can we move the launch to Friday?', prompt)
+            self.assertNotIn('Wednesday', prompt)
+            self.assertNotIn('CONFIDENTIALITY', prompt)
+            self.assertNotIn('Limit to first', prompt)
+        
+        with override_settings(AI_PRIORITY_BODY_TOKENS=5):
+            service.detect_email_priority('Budget', 'word ' * 500)
+        self.assertIn('Body: word word [...]\n', server.prompts[-1])
+        print("✅ Test Passed: Prompts carry reduced bodies")
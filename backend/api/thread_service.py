@@ -0,0 +1,149 @@
+"""
+Conversation threading
+Groups emails into threads at ingest and keeps each thread's denormalized
+head (latest message, participants, counts) up to date
+"""
+import re
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+from django.utils import timezone
+from .models import ColdEmail, Email, Thread
+
+
+# Participants kept on a thread head
+MAX_PARTICIPANTS = 10
+
+# Email columns refresh_thread_heads reads; changes to others leave heads as they are
+HEAD_FIELDS = {'is_read', 'is_trashed', 'sender', 'received_at', 'created_at', 'thread'}
+
+_SUBJECT_PREFIX = re.compile(r'^\s*((re|fw|fwd|aw|sv)(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+_MESSAGE_ID = re.compile(r'<[^<>\s]+>')
+
+
+def normalize_subject(subject: str) -> str:
+    """Strip reply/forward prefixes ("Re:", "Fwd:", ...) from a subject"""
+    return _SUBJECT_PREFIX.sub('', subject or '').strip()
+
+
+def referenced_message_ids(email: Email) -> List[str]:
+    """
+    Message-IDs an email replies to, nearest ancestor first
+
+    In-Reply-To comes first, then References from newest to oldest.
+    """
+    ids = _MESSAGE_ID.findall(email.in_reply_to or '')
+    ids += reversed(_MESSAGE_ID.findall(email.references or ''))
+    return ids
+
+
+def assign_threads(user_id: int, items: List[Tuple[Email, Optional[str]]]) -> None:
+    """
+    Set thread_id on a batch of emails, creating threads as needed
+
+    Matching order: provider thread ID, then In-Reply-To/References against
+    known Message-IDs (including earlier emails in the same batch), else a
+    new thread. Works on unsaved emails so ingest can bulk_create afterwards.
+
+    Args:
+        user_id: Owner of the emails
+        items: (email, provider thread ID or '') pairs
+    """
+    if not items:
+        return
+
+    provider_ids = {provider_id for _, provider_id in items if provider_id}
+    known_threads = dict(
+        Thread.objects.filter(user_id=user_id, provider_thread_id__in=provider_ids)
+        .values_list('provider_thread_id', 'id')
+    ) if provider_ids else {}
+
+    refs = {ref for email, _ in items for ref in referenced_message_ids(email)}
+    known_messages = {}
+    if refs:
+        for model in (ColdEmail, Email):
+            known_messages.update(
+                model.objects.filter(user_id=user_id, message_id__in=refs)
+                .exclude(thread=None)
+                .values_list('message_id', 'thread_id')
+            )
+
+    # Oldest first so replies later in the batch find their parents
+    items = sorted(items, key=lambda item: item[0].received_at or item[0].created_at or timezone.now())
+
+    for email, provider_id in items:
+        thread_id = known_threads.get(provider_id) if provider_id else None
+
+        if thread_id is None:
+            for ref in referenced_message_ids(email):
+                if ref in known_messages:
+                    thread_id = known_messages[ref]
+                    break
+
+        if thread_id is None:
+            thread_id = Thread.objects.create(
+                user_id=user_id,
+                provider_thread_id=provider_id or '',
+                subject=normalize_subject(email.subject),
+            ).id
+
+        if provider_id:
+            known_threads.setdefault(provider_id, thread_id)
+        if email.message_id:
+            known_messages[email.message_id] = thread_id
+        email.thread_id = thread_id
+
+
+def refresh_thread_heads(thread_ids: Iterable[int]) -> None:
+    """
+    Recompute denormalized head data for threads
+
+    Messages are read from both tiers, so a dormant thread whose mail is in
+    ColdEmail keeps its head: one SELECT per tier and one bulk UPDATE.
+    Messages in trash are not counted.
+    """
+    thread_ids = {thread_id for thread_id in thread_ids if thread_id}
+    if not thread_ids:
+        return
+
+    messages = []
+    for model in (Email, ColdEmail):
+        messages += model.objects.filter(thread_id__in=thread_ids, is_trashed=False).values_list(
+            'thread_id', 'id', 'sender', 'is_read', 'received_at', 'created_at'
+        )
+    # Participants in order of first message
+    messages.sort(key=lambda message: (message[5], message[1]))
+
+    now = timezone.now()
+    heads = {
+        thread_id: Thread(id=thread_id, message_count=0, unread_count=0, latest_email_id=None,
+                          latest_sender='', last_message_at=None, participants='', updated_at=now)
+        for thread_id in thread_ids
+    }
+    senders = defaultdict(list)
+    latest = {}
+    for thread_id, email_id, sender, is_read, received_at, created_at in messages:
+        head = heads[thread_id]
+        head.message_count += 1
+        if not is_read:
+            head.unread_count += 1
+        sent_at = received_at or created_at
+        if thread_id not in latest or (sent_at, email_id) > latest[thread_id]:
+            latest[thread_id] = (sent_at, email_id)
+            head.latest_email_id, head.latest_sender, head.last_message_at = email_id, sender, sent_at
+        if sender not in senders[thread_id] and len(senders[thread_id]) < MAX_PARTICIPANTS:
+            senders[thread_id].append(sender)
+    for thread_id, names in senders.items():
+        heads[thread_id].participants = ', '.join(names)
+
+    Thread.objects.bulk_update(list(heads.values()), [
+        'message_count', 'unread_count', 'latest_email', 'latest_sender',
+        'last_message_at', 'participants', 'updated_at',
+    ])
+
+
+def thread_ids_for(email_ids: Iterable[int]) -> List[int]:
+    """Threads containing the given emails"""
+    return list(
+        Email.objects.filter(id__in=list(email_ids)).exclude(thread=None)
+        .order_by().values_list('thread_id', flat=True).distinct()
+    )
@@ -0,0 +1,195 @@
+"""
+Hot/cold mailbox tiering
+Dormant threads move from Email to ColdEmail so the hot table and its
+indexes only hold live mail; reads fall back to the cold tier and any
+write moves the thread back first
+"""
+import heapq
+from datetime import timedelta
+from itertools import islice
+from typing import Iterable, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.utils import timezone
+from .models import ColdEmail, Email, EmailContent
+
+
+CONTENT_FIELDS = ['body_codec', 'body_data', 'raw_codec', 'raw_payload']
+
+# Threads moved or restored per transaction
+THREAD_BATCH_SIZE = 100
+
+
+def _moved_fields() -> List[str]:
+    return [field.attname for field in Email._meta.concrete_fields]
+
+
+def cold_cutoff(older_than_days: Optional[int] = None):
+    """Emails created before this are old enough for the cold tier"""
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'MAILBOX_COLD_AFTER_DAYS', 180)
+    return timezone.now() - timedelta(days=older_than_days)
+
+
+def _dormant_emails(cutoff) -> QuerySet:
+    """
+    Emails in threads where every message is old, archived or trashed,
+    and unlabeled; only whole threads move so thread heads stay exact
+    """
+    live = Email.objects.filter(thread=OuterRef('thread')).filter(
+        Q(is_archived=False, is_trashed=False)
+        | Q(created_at__gte=cutoff)
+        | Q(labels__isnull=False)
+    )
+    return Email.objects.filter(thread__isnull=False).exclude(Exists(live))
+
+
+def dormant_thread_ids(
+    cutoff,
+    user_id: Optional[int] = None,
+    after: int = 0,
+    limit: int = THREAD_BATCH_SIZE,
+) -> List[int]:
+    """Up to limit threads that can move to the cold tier, in id order after a cursor"""
+    emails = _dormant_emails(cutoff).filter(thread_id__gt=after)
+    if user_id is not None:
+        emails = emails.filter(user_id=user_id)
+    return list(
+        emails.order_by('thread_id').values_list('thread_id', flat=True).distinct()[:limit]
+    )
+
+
+def move_threads_to_cold(thread_ids: Iterable[int], cutoff) -> int:
+    """
+    Move every email of the given threads to ColdEmail
+
+    Dormancy is re-checked under row locks, so a thread written to since
+    it was selected stays hot. Moving changes no visible field, so nothing
+    is recorded in the changes feed.
+
+    Returns:
+        Number of emails moved
+    """
+    thread_ids = list(thread_ids)
+    with transaction.atomic():
+        list(Email.objects.select_for_update().filter(thread_id__in=thread_ids).values_list('id', flat=True))
+        thread_ids = list(
+            _dormant_emails(cutoff).filter(thread_id__in=thread_ids)
+            .order_by().values_list('thread_id', flat=True).distinct()
+        )
+        fields = _moved_fields()
+        rows = list(
+            Email.objects.filter(thread_id__in=thread_ids)
+            .values(*fields, *[f'content__{name}' for name in CONTENT_FIELDS])
+        )
+        if not rows:
+            return 0
+
+        cold = []
+        for row in rows:
+            content = {name: row.pop(f'content__{name}') for name in CONTENT_FIELDS}
+            if content['body_codec'] is None:
+                content = {'body_codec': 'none', 'body_data': b''}
+            cold.append(ColdEmail(**row, **content))
+        ColdEmail.objects.bulk_create(cold)
+        Email.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def rehydrate_threads(user_id: int, thread_ids: Iterable[int]) -> int:
+    """
+    Move a user's cold threads back to the hot table
+
+    Ids, timestamps and content are preserved, so clients see no change.
+
+    Returns:
+        Number of emails restored
+    """
+    thread_ids = [thread_id for thread_id in set(thread_ids) if thread_id]
+    restored = 0
+    for start in range(0, len(thread_ids), THREAD_BATCH_SIZE):
+        batch = thread_ids[start:start + THREAD_BATCH_SIZE]
+        with transaction.atomic():
+            cold = list(ColdEmail.objects.select_for_update().filter(user_id=user_id, thread_id__in=batch))
+            if not cold:
+                continue
+            fields = _moved_fields()
+            emails = Email.objects.bulk_create([
+                Email(**{name: getattr(row, name) for name in fields}) for row in cold
+            ])
+            # bulk_create stamps auto_now fields; put the original times back
+            for email, row in zip(emails, cold):
+                email.created_at, email.updated_at = row.created_at, row.updated_at
+            Email.objects.bulk_update(emails, ['created_at', 'updated_at'])
+            EmailContent.objects.bulk_create([
+                EmailContent(email_id=row.id, **{name: getattr(row, name) for name in CONTENT_FIELDS})
+                for row in cold
+            ])
+            ColdEmail.objects.filter(id__in=[row.id for row in cold]).delete()
+            restored += len(cold)
+    return restored
+
+
+def rehydrate_emails(user_id: int, email_ids: Iterable[int]) -> int:
+    """Move the cold threads containing any of these emails back to the hot table"""
+    thread_ids = (
+        ColdEmail.objects.filter(user_id=user_id, id__in=list(email_ids))
+        .order_by().values_list('thread_id', flat=True).distinct()
+    )
+    return rehydrate_threads(user_id, list(thread_ids))
+
+
+class TieredEmailList:
+    """
+    Hot and cold emails merged newest first, sliceable like a queryset
+
+    Lets the paginator page across both tiers with one COUNT per tier. A
+    page reads the (created_at, id) keys of each tier up to its end, merges
+    them, then loads only the rows that land on the page.
+    """
+    ordered = True
+    ORDERING = ('-created_at', '-id')
+
+    def __init__(self, hot: QuerySet, cold: QuerySet):
+        self.hot = hot.order_by(*self.ORDERING)
+        self.cold = cold.order_by(*self.ORDERING)
+        self._hot_count = None
+        self._cold_count = None
+
+    def count(self) -> int:
+        if self._hot_count is None:
+            self._hot_count = self.hot.count()
+            self._cold_count = self.cold.count()
+        return self._hot_count + self._cold_count
+
+    def __len__(self):
+        return self.count()
+
+    def _keys(self, queryset: QuerySet, stop: int, is_hot: bool) -> List:
+        keys = queryset.prefetch_related(None).values_list('created_at', 'id')[:stop]
+        return [(created_at, email_id, is_hot) for created_at, email_id in keys]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        self.count()
+        start = key.start or 0
+        stop = self.count() if key.stop is None else key.stop
+        if stop <= start:
+            return []
+        if not self._cold_count:
+            return list(self.hot[start:stop])
+        if not self._hot_count:
+            return [row.to_email() for row in self.cold[start:stop]]
+
+        merged = heapq.merge(
+            self._keys(self.hot, stop, True), self._keys(self.cold, stop, False), reverse=True
+        )
+        page = list(islice(merged, start, stop))
+        hot_ids = [email_id for _, email_id, is_hot in page if is_hot]
+        cold_ids = [email_id for _, email_id, is_hot in page if not is_hot]
+        emails = {email.id: email for email in self.hot.filter(id__in=hot_ids)} if hot_ids else {}
+        if cold_ids:
+            emails.update((row.id, row.to_email()) for row in self.cold.filter(id__in=cold_ids))
+        return [emails[email_id] for _, email_id, _ in page]
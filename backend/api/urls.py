@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     EmailViewSet, LabelViewSet, UserPreferenceViewSet, 
-    EmailAccountViewSet, health_check, register, get_current_user, update_profile_picture
+    EmailAccountViewSet, BulkJobViewSet, ThreadViewSet, PriorityRuleViewSet, health_check, register, get_current_user, update_profile_picture
 )
 from .oauth_views import (
     gmail_authorize, gmail_callback,
@@ -10,9 +10,10 @@ from .oauth_views import (
     sync_emails, disconnect_account
 )
 from .ai_views import (
-    detect_email_priority, summarize_email,
-    generate_reply, batch_analyze_priorities
+    detect_email_priority, summarize_email, summarize_email_stream,
+    generate_reply, generate_reply_stream, batch_analyze_priorities
 )
+from .event_views import mailbox_events
 from .social_auth_views import (
     gmail_social_authorize, gmail_social_callback
 )
@@ -22,6 +23,9 @@ router.register(r'emails', EmailViewSet, basename='email')
 router.register(r'labels', LabelViewSet, basename='label')
 router.register(r'preferences', UserPreferenceViewSet, basename='preference')
 router.register(r'accounts', EmailAccountViewSet, basename='account')
+router.register(r'bulk-jobs', BulkJobViewSet, basename='bulk-job')
+router.register(r'threads', ThreadViewSet, basename='thread')
+router.register(r'priority-rules', PriorityRuleViewSet, basename='priority-rule')
 
 urlpatterns = [
     path('health/', health_check, name='health_check'),
@@ -41,10 +45,15 @@ urlpatterns = [
     path('oauth/sync/<int:account_id>/', sync_emails, name='sync_emails'),
     path('oauth/disconnect/<int:account_id>/', disconnect_account, name='disconnect_account'),
     
+    # Real-time mailbox events (Server-Sent Events, serve via ASGI)
+    path('events/', mailbox_events, name='mailbox_events'),
+    
     # AI endpoints
     path('ai/detect-priority/', detect_email_priority, name='detect_priority'),
     path('ai/summarize/', summarize_email, name='summarize_email'),
+    path('ai/summarize/stream/', summarize_email_stream, name='summarize_email_stream'),
     path('ai/generate-reply/', generate_reply, name='generate_reply'),
+    path('ai/generate-reply/stream/', generate_reply_stream, name='generate_reply_stream'),
     path('ai/batch-analyze/', batch_analyze_priorities, name='batch_analyze'),
     
     path('', include(router.urls)),
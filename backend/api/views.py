@@ -1,13 +1,34 @@
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import api_view, action, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny, SAFE_METHODS
 from rest_framework.response import Response
+import hashlib
+from django.http import Http404
+from email.utils import make_msgid
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.contrib.auth.models import User
-from .models import Email, Label, UserPreference, EmailAccount
+from .models import Email, ColdEmail, Label, UserPreference, EmailAccount, BulkJob, Thread, PriorityRule
+from .mailbox_service import (
+    filter_emails, apply_bulk_operation,
+    record_email_changes, get_mailbox_version, get_email_changes,
+    apply_label, remove_label, touch_emails, prefetch_email_details,
+    cold_emails_matching, rehydrate_matching, set_email_flags, flag_values
+)
+from .tiering import TieredEmailList, rehydrate_emails, rehydrate_threads
+from . import list_cache
+from .thread_service import assign_threads
+from .priority_rules import apply_priority_rules
+from .local_classifier import record_correction
+from .mailbox_stats import email_state, record_created, record_state_change
+from .bulk_jobs import start_bulk_job
 from .serializers import (
     EmailSerializer, LabelSerializer, UserPreferenceSerializer,
-    EmailAccountSerializer, UserSerializer, UserRegistrationSerializer
+    EmailAccountSerializer, UserSerializer, UserRegistrationSerializer,
+    BulkJobSerializer, ThreadSerializer, ThreadDetailSerializer, PriorityRuleSerializer,
+    BulkActionSerializer, BulkSelectionSerializer
 )
 
 
@@ -85,6 +106,9 @@ class EmailViewSet(viewsets.ModelViewSet):
     """ViewSet for Email CRUD operations"""
     queryset = Email.objects.all()
     serializer_class = EmailSerializer
+    
+    # Most changes returned by one call to the changes feed
+    CHANGES_PAGE_SIZE = 500
 
     def get_queryset(self):
         """PRIVACY: Users can ONLY see their own emails"""
@@ -95,111 +119,333 @@ class EmailViewSet(viewsets.ModelViewSet):
         if not self.request.user.is_authenticated:
             return Email.objects.none()
             
-        queryset = Email.objects.filter(user=self.request.user)
+        queryset = prefetch_email_details(Email.objects.filter(user=self.request.user))
         
-        # Filter by read status
-        is_read = self.request.query_params.get('is_read', None)
-        if is_read is not None:
-            queryset = queryset.filter(is_read=is_read.lower() == 'true')
+        # Filter by read/archived/trashed/starred status, priority and label
+        return filter_emails(queryset, self.request.query_params)
+    
+    def get_object(self):
+        """
+        Look the email up in the hot table, falling back to the cold tier
         
-        # Filter by archived status
-        is_archived = self.request.query_params.get('is_archived', None)
-        if is_archived is not None:
-            queryset = queryset.filter(is_archived=is_archived.lower() == 'true')
+        Reads are served from the cold row; writes first move its whole
+        thread back to the hot table.
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            pk = str(self.kwargs.get('pk', ''))
+            cold = ColdEmail.objects.filter(user=self.request.user, id=pk).first() if pk.isdigit() else None
+            if cold is None:
+                raise
+            if self.request.method in SAFE_METHODS:
+                return cold.to_email()
+            rehydrate_threads(self.request.user.id, [cold.thread_id])
+            return super().get_object()
+    
+    def paginate_queryset(self, queryset):
+        """Page email lists across the hot and cold tiers"""
+        if self.action == 'list':
+            cold = cold_emails_matching(self.request.user.id, self.request.query_params)
+            queryset = TieredEmailList(queryset, cold)
+        return super().paginate_queryset(queryset)
+    
+    def _conditional_response(self, request, etag, last_modified):
+        """
+        Return a 304 if the client's If-None-Match/If-Modified-Since still match
         
-        # Filter by trashed status
-        is_trashed = self.request.query_params.get('is_trashed', None)
-        if is_trashed is not None:
-            queryset = queryset.filter(is_trashed=is_trashed.lower() == 'true')
+        Args:
+            etag: Quoted strong ETag for the current representation
+            last_modified: Datetime of the last change, or None
+        """
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=etag, last_modified=timestamp)
+    
+    def _set_validators(self, response, etag, last_modified):
+        """Attach ETag/Last-Modified and force clients to revalidate"""
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        """
+        List emails; unchanged mailboxes get a 304 without serializing
         
-        # Filter by priority
-        priority = self.request.query_params.get('priority', None)
-        if priority:
-            queryset = queryset.filter(priority=priority)
+        The first pages are served from the list cache until the next write.
+        """
+        # Time-relative filters can change without a write
+        if 'older_than_days' in request.query_params:
+            return super().list(request, *args, **kwargs)
         
-        # Filter by starred
-        is_starred = self.request.query_params.get('is_starred', None)
-        if is_starred is not None:
-            queryset = queryset.filter(is_starred=is_starred.lower() == 'true')
+        version, last_modified = get_mailbox_version(request.user.id)
+        query = hashlib.md5(
+            f"{request.get_full_path()}|{request.accepted_renderer.format}".encode()
+        ).hexdigest()[:16]
+        etag = f'"m{request.user.id}-{version}-{query}"'
         
-        return queryset
+        not_modified = self._conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return self._set_validators(not_modified, etag, last_modified)
+        
+        cache_key = list_cache.list_cache_key(request, version, last_modified)
+        if cache_key:
+            data = list_cache.get_page(cache_key)
+            if data is not None:
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return self._set_validators(response, etag, last_modified)
+        
+        response = super().list(request, *args, **kwargs)
+        if cache_key and response.status_code == status.HTTP_200_OK:
+            list_cache.set_page(cache_key, response.data)
+            response['X-Cache'] = 'MISS'
+        return self._set_validators(response, etag, last_modified)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Get an email; unchanged emails get a 304 after one indexed lookup"""
+        updated_at = self.get_queryset().filter(pk=kwargs.get('pk')).values_list(
+            'updated_at', flat=True
+        ).first()
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+        
+        etag = f'"e{kwargs.get("pk")}-{int(updated_at.timestamp() * 1000000)}"'
+        not_modified = self._conditional_response(request, etag, updated_at)
+        if not_modified is not None:
+            return self._set_validators(not_modified, etag, updated_at)
+        
+        response = super().retrieve(request, *args, **kwargs)
+        return self._set_validators(response, etag, updated_at)
     
     def perform_create(self, serializer):
-        """Auto-assign current user and detect priority on email creation"""
-        email = serializer.save(user=self.request.user)
-        if not email.priority or email.priority == 'normal':
-            email.priority = email.detect_priority()
-            email.save()
+        """Auto-assign current user, priority and thread before the email is inserted"""
+        draft = Email(user=self.request.user, **serializer.validated_data)
+        apply_priority_rules(self.request.user.id, [draft])
+        assign_threads(self.request.user.id, [(draft, '')])
+        email = serializer.save(user=self.request.user, priority=draft.priority, thread_id=draft.thread_id)
+        record_created(self.request.user.id, [email])
+        record_email_changes(self.request.user.id, [email.id], event='email.created')
+    
+    def perform_update(self, serializer):
+        """Save changes and record them; priority changes train the local classifier"""
+        old_priority = serializer.instance.priority
+        before = email_state(serializer.instance)
+        email = serializer.save()
+        record_correction(self.request.user.id, email.id, old_priority, email.priority)
+        record_state_change(self.request.user.id, [before], [email_state(email)])
+        record_email_changes(self.request.user.id, [email.id])
+    
+    def perform_destroy(self, instance):
+        """Delete the email and record a tombstone"""
+        email_id, thread_id, before = instance.id, instance.thread_id, email_state(instance)
+        instance.delete()
+        record_state_change(self.request.user.id, [before])
+        record_email_changes(self.request.user.id, [email_id], deleted=True, thread_ids=[thread_id])
+    
+    def _set_flags(self, request, pk, operation):
+        """
+        Run a flag operation as one conditional UPDATE on the email row
+        
+        Returns:
+            True if the email changed, False if it already had the values
+        """
+        if not str(pk).isdigit():
+            raise Http404
+        written = set_email_flags(request.user.id, int(pk), operation)
+        if written is None:
+            # Writes to cold mail move its thread back to the hot table first
+            if not rehydrate_emails(request.user.id, [int(pk)]):
+                raise Http404
+            written = set_email_flags(request.user.id, int(pk), operation)
+        return written
+    
+    def _flag_response(self, request, pk, operation, message):
+        """Changed columns only; ?full=true returns the whole email instead"""
+        if str(request.query_params.get('full', '')).lower() == 'true':
+            return Response({'message': message, 'email': EmailSerializer(self.get_object()).data})
+        return Response({'message': message, 'email': {'id': int(pk), **flag_values(operation)}})
+    
+    def _flag_action(self, request, pk, operation, message):
+        self._set_flags(request, pk, operation)
+        return self._flag_response(request, pk, operation, message)
     
     @action(detail=True, methods=['post'])
     def archive(self, request, pk=None):
         """Archive an email"""
-        email = self.get_object()
-        email.is_archived = True
-        email.is_trashed = False
-        email.save()
-        return Response({
-            'message': 'Email archived successfully',
-            'email': EmailSerializer(email).data
-        })
+        return self._flag_action(request, pk, 'archive', 'Email archived successfully')
     
     @action(detail=True, methods=['post'])
     def trash(self, request, pk=None):
         """Move email to trash"""
-        email = self.get_object()
-        email.is_trashed = True
-        email.is_archived = False
-        email.trashed_at = timezone.now()
-        email.save()
-        return Response({
-            'message': 'Email moved to trash',
-            'email': EmailSerializer(email).data
-        })
+        return self._flag_action(request, pk, 'trash', 'Email moved to trash')
     
     @action(detail=True, methods=['post'])
     def restore(self, request, pk=None):
         """Restore email from archive or trash"""
-        email = self.get_object()
-        email.is_archived = False
-        email.is_trashed = False
-        email.trashed_at = None
-        email.save()
-        return Response({
-            'message': 'Email restored successfully',
-            'email': EmailSerializer(email).data
-        })
+        return self._flag_action(request, pk, 'restore', 'Email restored successfully')
     
     @action(detail=True, methods=['delete'])
     def permanent_delete(self, request, pk=None):
         """Permanently delete email"""
         email = self.get_object()
+        email_id, thread_id, before = email.id, email.thread_id, email_state(email)
         email.delete()
+        record_state_change(request.user.id, [before])
+        record_email_changes(request.user.id, [email_id], deleted=True, thread_ids=[thread_id])
         return Response({
             'message': 'Email permanently deleted'
         }, status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=True, methods=['post'])
     def star(self, request, pk=None):
-        """Toggle star status"""
-        email = self.get_object()
-        email.is_starred = not email.is_starred
-        email.save()
-        return Response({
-            'message': f"Email {'starred' if email.is_starred else 'unstarred'}",
-            'email': EmailSerializer(email).data
-        })
+        """
+        Toggle star status
+        POST /api/emails/{id}/star/
+        
+        Body (optional): {"is_starred": true} sets the value instead of toggling
+        """
+        is_starred = request.data.get('is_starred') if hasattr(request.data, 'get') else None
+        if isinstance(is_starred, bool):
+            operation = 'star' if is_starred else 'unstar'
+            self._set_flags(request, pk, operation)
+        else:
+            # Star unless it already is, in which case unstar
+            operation = 'star'
+            if not self._set_flags(request, pk, 'star'):
+                operation = 'unstar'
+                self._set_flags(request, pk, 'unstar')
+        message = 'Email starred' if operation == 'star' else 'Email unstarred'
+        return self._flag_response(request, pk, operation, message)
     
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark email as read"""
-        email = self.get_object()
-        email.is_read = True
-        email.save()
+        return self._flag_action(request, pk, 'mark_read', 'Email marked as read')
+    
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Delta feed of emails changed since a cursor
+        GET /api/emails/changes/?since=<cursor>&limit=500
+        
+        Start with since=0 for a full sync, then pass back the returned
+        cursor. Keep calling while has_more is true.
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', self.CHANGES_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {'error': 'since and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if since < 0 or limit < 1:
+            return Response(
+                {'error': 'since must be >= 0 and limit >= 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        changes = get_email_changes(request.user.id, since, min(limit, self.CHANGES_PAGE_SIZE))
+        
         return Response({
-            'message': 'Email marked as read',
-            'email': EmailSerializer(email).data
+            'cursor': changes['cursor'],
+            'has_more': changes['has_more'],
+            'changed': EmailSerializer(changes['changed'], many=True).data,
+            'deleted': changes['deleted']
         })
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Apply one operation to many emails with a single UPDATE/DELETE
+        POST /api/emails/bulk/
+        Body: {
+            "operation": "trash",  // archive, trash, restore, star, unstar,
+                                   // mark_read, mark_unread, permanent_delete
+            "ids": [1, 2, 3],      // either ids...
+            "filters": {"priority": "low", "is_read": true},  // ...or list filters
+            "all": true            // required when filters are empty or omitted
+        }
+        """
+        serializer = BulkActionSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        operation = serializer.validated_data['operation']
+        queryset = self._select_emails(request, serializer.validated_data)
+        affected = apply_bulk_operation(request.user.id, queryset, operation)
+        
+        return Response({
+            'operation': operation,
+            'affected': affected,
+            'message': f'{affected} email(s) updated'
+        })
+    
+    @action(detail=False, methods=['post'], url_path='labels/apply')
+    def bulk_apply_label(self, request):
+        """
+        Add a label to many emails
+        POST /api/emails/labels/apply/
+        Body: {
+            "label": 3,
+            "ids": [1, 2, 3],      // either ids...
+            "filters": {"is_read": false}  // ...or list filters
+        }
+        """
+        return self._bulk_label(request, apply_label, 'labeled')
+    
+    @action(detail=False, methods=['post'], url_path='labels/remove')
+    def bulk_remove_label(self, request):
+        """
+        Remove a label from many emails
+        POST /api/emails/labels/remove/
+        Body: same as labels/apply
+        """
+        return self._bulk_label(request, remove_label, 'unlabeled')
+    
+    def _bulk_label(self, request, operation, verb):
+        label = Label.objects.filter(user=request.user, id=request.data.get('label')).first()
+        if label is None:
+            return Response(
+                {'error': 'Label not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        serializer = BulkSelectionSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = self._select_emails(request, serializer.validated_data)
+        affected = operation(request.user.id, queryset, label.id)
+        
+        return Response({
+            'label': label.id,
+            'affected': affected,
+            'message': f'{affected} email(s) {verb}'
+        })
+    
+    def _select_emails(self, request, selection):
+        """Emails targeted by a validated BulkSelectionSerializer"""
+        ids = selection.get('ids')
+        filters = selection.get('filters', {})
+        
+        queryset = Email.objects.filter(user=request.user)
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        queryset = filter_emails(queryset, filters)
+        
+        # Bring targeted cold mail back so the write reaches it
+        if ids is not None:
+            rehydrate_emails(request.user.id, ids)
+        else:
+            rehydrate_matching(request.user.id, filters)
+        
+        return queryset
+    
     @action(detail=False, methods=['post'])
     def send(self, request):
         """
@@ -211,7 +457,8 @@ class EmailViewSet(viewsets.ModelViewSet):
             "bcc": "bcc@email.com",  // optional
             "subject": "Email subject",
             "body": "Email body",
-            "priority": "normal"  // optional: high, normal, low
+            "priority": "normal",  // optional: high, normal, low
+            "in_reply_to": 42  // optional: id of the email being replied to
         }
         """
         try:
@@ -228,8 +475,19 @@ class EmailViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            parent = None
+            if request.data.get('in_reply_to'):
+                parent = Email.objects.filter(
+                    user=request.user, id=request.data['in_reply_to']
+                ).first()
+                if parent is None:
+                    return Response(
+                        {'error': 'Email being replied to not found'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+            
             # Create email record in database (as sent item)
-            email = Email.objects.create(
+            email = Email(
                 user=request.user,
                 sender=request.user.email or request.user.username,
                 recipient=to,
@@ -240,8 +498,18 @@ class EmailViewSet(viewsets.ModelViewSet):
                 priority=priority,
                 is_read=True,  # Sent emails are marked as read
                 is_sent=True,  # Mark as sent
-                received_at=timezone.now()
+                received_at=timezone.now(),
+                message_id=make_msgid()
             )
+            if parent is not None:
+                email.in_reply_to = parent.message_id
+                email.references = f"{parent.references} {parent.message_id}".strip()
+                email.thread_id = parent.thread_id
+            if email.thread_id is None:
+                assign_threads(request.user.id, [(email, '')])
+            email.save()
+            record_created(request.user.id, [email])
+            record_email_changes(request.user.id, [email.id], event='email.created')
             
             # TODO: Integrate with actual email sending service (Gmail API, Outlook API, etc.)
             # For now, we just store it in the database
@@ -258,6 +526,91 @@ class EmailViewSet(viewsets.ModelViewSet):
             )
 
 
+class ThreadPagination(CursorPagination):
+    """Keyset pages over the (user, -last_message_at, -id) index; no COUNT query"""
+    page_size = 20
+    ordering = ('-last_message_at', '-id')
+
+
+class ThreadViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for conversation threads, most recent activity first
+    GET /api/threads/?unread=true
+    GET /api/threads/{id}/  (includes messages)
+    """
+    queryset = Thread.objects.all()
+    serializer_class = ThreadSerializer
+    pagination_class = ThreadPagination
+    
+    def get_queryset(self):
+        """PRIVACY: Users can ONLY see their own threads"""
+        # Short-circuit for Swagger schema generation
+        if getattr(self, 'swagger_fake_view', False):
+            return Thread.objects.none()
+        
+        if not self.request.user.is_authenticated:
+            return Thread.objects.none()
+        queryset = Thread.objects.filter(user=self.request.user, message_count__gt=0)
+        if self.request.query_params.get('unread', '').lower() == 'true':
+            queryset = queryset.filter(unread_count__gt=0)
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return ThreadDetailSerializer
+        return ThreadSerializer
+
+
+class BulkJobViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+                     mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    ViewSet for background bulk jobs over every email matching a filter
+    POST /api/bulk-jobs/
+    Body: {
+        "operation": "trash",
+        "filters": {"priority": "low", "older_than_days": 30}
+    }
+    """
+    queryset = BulkJob.objects.all()
+    serializer_class = BulkJobSerializer
+    
+    def get_queryset(self):
+        """PRIVACY: Users can ONLY see their own jobs"""
+        # Short-circuit for Swagger schema generation
+        if getattr(self, 'swagger_fake_view', False):
+            return BulkJob.objects.none()
+        
+        if not self.request.user.is_authenticated:
+            return BulkJob.objects.none()
+        return BulkJob.objects.filter(user=self.request.user)
+    
+    def perform_create(self, serializer):
+        """Auto-assign current user and queue the job"""
+        job = serializer.save(user=self.request.user)
+        start_bulk_job(job)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Request cancellation; a running job stops before its next chunk"""
+        job = self.get_object()
+        if job.status in ('completed', 'cancelled', 'failed'):
+            return Response(
+                {'error': f'Job is already {job.status}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        BulkJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+        BulkJob.objects.filter(pk=job.pk, status='pending').update(
+            status='cancelled', finished_at=timezone.now()
+        )
+        job.refresh_from_db()
+        
+        return Response({
+            'message': 'Cancellation requested',
+            'job': BulkJobSerializer(job).data
+        })
+
+
 class LabelViewSet(viewsets.ModelViewSet):
     """ViewSet for Label CRUD operations"""
     queryset = Label.objects.all()
@@ -276,6 +629,42 @@ class LabelViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Auto-assign current user to label"""
         serializer.save(user=self.request.user)
+    
+    def perform_update(self, serializer):
+        """Save changes; labeled emails now serialize differently"""
+        label = serializer.save()
+        touch_emails(self.request.user.id, label.emails.values_list('id', flat=True))
+    
+    def perform_destroy(self, instance):
+        """Delete the label and record the change on emails that carried it"""
+        label_id = instance.id
+        email_ids = list(instance.emails.values_list('id', flat=True))
+        instance.delete()
+        touch_emails(self.request.user.id, email_ids, fields={'label_removed': label_id})
+
+
+class PriorityRuleViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for priority rules applied to new email
+    
+    Body: {"kind": "keyword" | "sender" | "domain", "pattern": "invoice", "priority": "high"}
+    """
+    queryset = PriorityRule.objects.all()
+    serializer_class = PriorityRuleSerializer
+    
+    def get_queryset(self):
+        """PRIVACY: Users can ONLY see their own rules"""
+        # Short-circuit for Swagger schema generation
+        if getattr(self, 'swagger_fake_view', False):
+            return PriorityRule.objects.none()
+        
+        if not self.request.user.is_authenticated:
+            return PriorityRule.objects.none()
+        return PriorityRule.objects.filter(user=self.request.user)
+    
+    def perform_create(self, serializer):
+        """Auto-assign current user to rule"""
+        serializer.save(user=self.request.user)
 
 
 class UserPreferenceViewSet(viewsets.ModelViewSet):
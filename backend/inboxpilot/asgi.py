@@ -2,6 +2,8 @@
 ASGI config for inboxpilot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django (including the SSE endpoint at /api/events/);
+WebSocket connections to /ws/events/ stream mailbox events.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inboxpilot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.events import websocket_events  # noqa: E402  (needs Django set up)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].rstrip('/') == '/ws/events':
+            await websocket_events(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await django_application(scope, receive, send)
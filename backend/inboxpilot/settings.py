@@ -5,6 +5,7 @@ Django settings for inboxpilot project.
 from pathlib import Path
 from decouple import config
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -66,6 +68,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'inboxpilot.wsgi.application'
+ASGI_APPLICATION = 'inboxpilot.asgi.application'
 
 # Database
 # Use SQLite for development (easier setup)
@@ -146,10 +149,120 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
 
+# Cache backend: locmem by default; set CACHE_BACKEND to
+# django.core.cache.backends.filebased.FileBasedCache (LOCATION is a
+# directory) or django.core.cache.backends.redis.RedisCache (LOCATION is a
+# redis:// URL) to share entries between workers
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='inboxpilot'),
+        'TIMEOUT': 300,
+    }
+}
+
+# Email list cache: first pages cached per (user, filters, mailbox version);
+# set EMAIL_LIST_CACHE_PAGES to 0 to disable
+EMAIL_LIST_CACHE_PAGES = config('EMAIL_LIST_CACHE_PAGES', default=3, cast=int)
+EMAIL_LIST_CACHE_TIMEOUT = config('EMAIL_LIST_CACHE_TIMEOUT', default=300, cast=int)
+
+# Response compression (brotli if installed and accepted, else gzip);
+# responses smaller than the threshold are sent as-is
+RESPONSE_COMPRESSION_MIN_SIZE = config('RESPONSE_COMPRESSION_MIN_SIZE', default=1024, cast=int)
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
+RESPONSE_COMPRESSION_GZIP_LEVEL = 6
+# Up to this many random bytes pad each gzip header (BREACH mitigation, as
+# in Django's GZipMiddleware)
+RESPONSE_COMPRESSION_MAX_RANDOM_BYTES = 100
+# Never compressed: these responses carry JWTs, OAuth codes and state, or
+# CSRF tokens, and compression would expose them to BREACH
+RESPONSE_COMPRESSION_EXCLUDED_PATHS = ['/api/auth/', '/api/social-auth/', '/api/oauth/', '/admin/']
+
+# Stored email bodies and raw payloads (zstd if zstandard is installed, else zlib)
+EMAIL_CONTENT_CODEC = config('EMAIL_CONTENT_CODEC', default='zstd')
+EMAIL_CONTENT_ZSTD_LEVEL = 3
+EMAIL_CONTENT_ZLIB_LEVEL = 6
+
+# Background bulk jobs: emails per UPDATE/DELETE chunk and pause between chunks
+BULK_JOB_CHUNK_SIZE = config('BULK_JOB_CHUNK_SIZE', default=500, cast=int)
+BULK_JOB_CHUNK_SLEEP = config('BULK_JOB_CHUNK_SLEEP', default=0.05, cast=float)
+# A running job whose worker has not finished a chunk for this long is
+# taken over by run_bulk_jobs
+BULK_JOB_STALE_AFTER_SECONDS = config('BULK_JOB_STALE_AFTER_SECONDS', default=300, cast=int)
+
+# Mailbox tiering: threads whose mail is all archived or trashed and older
+# than this move to the cold table (python manage.py tier_mailboxes)
+MAILBOX_COLD_AFTER_DAYS = config('MAILBOX_COLD_AFTER_DAYS', default=180, cast=int)
+
+# Local priority classifier: predictions are used once a user's model has
+# learned from this many emails, and only at or above this confidence
+# (python manage.py train_priority_models)
+LOCAL_PRIORITY_MIN_EMAILS = config('LOCAL_PRIORITY_MIN_EMAILS', default=50, cast=int)
+LOCAL_PRIORITY_MIN_CONFIDENCE = config('LOCAL_PRIORITY_MIN_CONFIDENCE', default=0.7, cast=float)
+
+# Gemini requests: rate limits shared by every worker process on the host
+# (0 disables), threads used to run batch requests concurrently, and
+# per-request timeout (seconds)
+GEMINI_REQUESTS_PER_MINUTE = config('GEMINI_REQUESTS_PER_MINUTE', default=60, cast=int)
+GEMINI_USER_REQUESTS_PER_MINUTE = config('GEMINI_USER_REQUESTS_PER_MINUTE', default=20, cast=int)
+GEMINI_BATCH_CONCURRENCY = config('GEMINI_BATCH_CONCURRENCY', default=8, cast=int)
+GEMINI_REQUEST_TIMEOUT = config('GEMINI_REQUEST_TIMEOUT', default=30, cast=int)
+
+# Transient Gemini errors are retried with exponential backoff; after
+# GEMINI_BREAKER_THRESHOLD failed requests in a row, requests fail fast to
+# local fallbacks for GEMINI_BREAKER_COOLDOWN seconds
+GEMINI_MAX_RETRIES = config('GEMINI_MAX_RETRIES', default=3, cast=int)
+GEMINI_RETRY_BASE_DELAY = config('GEMINI_RETRY_BASE_DELAY', default=1.0, cast=float)
+GEMINI_BREAKER_THRESHOLD = config('GEMINI_BREAKER_THRESHOLD', default=5, cast=int)
+GEMINI_BREAKER_COOLDOWN = config('GEMINI_BREAKER_COOLDOWN', default=60, cast=int)
+# Rate limit and breaker state, locked by each process that uses it
+GEMINI_SCHEDULER_STATE = config(
+    'GEMINI_SCHEDULER_STATE', default=os.path.join(tempfile.gettempdir(), 'inboxpilot-gemini-scheduler.json')
+)
+
+# Packed priority triage: batch requests carry up to this many emails
+# within an estimated prompt size; GEMINI_INGEST_TRIAGE also triages synced
+# mail that no rule or confident local prediction covers
+GEMINI_TRIAGE_MAX_EMAILS = config('GEMINI_TRIAGE_MAX_EMAILS', default=20, cast=int)
+GEMINI_TRIAGE_MAX_TOKENS = config('GEMINI_TRIAGE_MAX_TOKENS', default=4000, cast=int)
+GEMINI_INGEST_TRIAGE = config('GEMINI_INGEST_TRIAGE', default=False, cast=bool)
+
+# Email bodies sent to Gemini lose quoted replies, signatures and
+# disclaimers, then are cut to about this many tokens (0 for no limit)
+AI_PRIORITY_BODY_TOKENS = config('AI_PRIORITY_BODY_TOKENS', default=250, cast=int)
+AI_SUMMARY_BODY_TOKENS = config('AI_SUMMARY_BODY_TOKENS', default=2000, cast=int)
+AI_REPLY_BODY_TOKENS = config('AI_REPLY_BODY_TOKENS', default=1500, cast=int)
+
+# Gemini result cache: results are reused for identical prompts for
+# AI_CACHE_TTL seconds (0 disables), with this many kept per process in
+# memory and in the shared table (python manage.py prune_ai_cache)
+AI_CACHE_TTL = config('AI_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+AI_CACHE_MEMORY_ENTRIES = config('AI_CACHE_MEMORY_ENTRIES', default=512, cast=int)
+AI_CACHE_MAX_ENTRIES = config('AI_CACHE_MAX_ENTRIES', default=50000, cast=int)
+
+# Trash retention: emails trashed longer than this are permanently deleted
+# (python manage.py purge_trash)
+TRASH_RETENTION_DAYS = config('TRASH_RETENTION_DAYS', default=30, cast=int)
+
+# Real-time mailbox events: broker class, per-connection queue size and
+# keepalive interval (seconds) for idle SSE/WebSocket connections
+MAILBOX_EVENT_BROKER = config('MAILBOX_EVENT_BROKER', default='api.events.InProcessBroker')
+MAILBOX_EVENT_QUEUE_SIZE = config('MAILBOX_EVENT_QUEUE_SIZE', default=100, cast=int)
+MAILBOX_EVENT_KEEPALIVE = config('MAILBOX_EVENT_KEEPALIVE', default=25, cast=int)
+
 # JWT Settings
 from datetime import timedelta
 
@@ -180,3 +293,6 @@ FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:5173')
 
 # Gemini AI Settings
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
+# Point at another endpoint over REST, e.g. the fake server for local
+# testing (python manage.py run_fake_gemini)
+GEMINI_API_ENDPOINT = config('GEMINI_API_ENDPOINT', default='')
@@ -0,0 +1,232 @@
+"""
+Email analysis engine
+Sentiment, category and priority are scored for a whole batch at once from
+hashed bag-of-words weight matrices; keywords are the most frequent
+content terms, with subject terms counting extra
+"""
+import heapq
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# Hashed feature space shared by every model
+N_FEATURES = 2 ** 18
+
+# Only the start of long bodies is analyzed
+MAX_BODY_CHARS = 8000
+
+# Subject tokens count this many times over body tokens
+SUBJECT_WEIGHT = 3
+
+# Net sentiment per sqrt(token) beyond which an email is not neutral
+SENTIMENT_THRESHOLD = 0.12
+
+# Keywords returned per email
+MAX_KEYWORDS = 5
+
+SENTIMENT_LEXICON = {
+    'positive': {
+        'thanks': 1.0, 'thank': 1.0, 'great': 1.0, 'excellent': 1.5, 'appreciate': 1.2,
+        'happy': 1.0, 'glad': 1.0, 'congratulations': 1.5, 'congrats': 1.5, 'love': 1.2,
+        'awesome': 1.2, 'pleased': 1.0, 'wonderful': 1.2, 'success': 1.0, 'successful': 1.0,
+        'good': 0.6, 'welcome': 0.6, 'approved': 1.0, 'resolved': 0.8, 'perfect': 1.2,
+        'excited': 1.0, 'delighted': 1.2, 'fantastic': 1.2, 'helpful': 0.8, 'enjoy': 0.8,
+    },
+    'negative': {
+        'problem': 1.0, 'issue': 0.8, 'error': 1.0, 'failed': 1.2, 'failure': 1.2,
+        'unfortunately': 1.2, 'sorry': 0.8, 'complaint': 1.5, 'disappointed': 1.5, 'angry': 1.5,
+        'broken': 1.2, 'bad': 1.0, 'delay': 0.8, 'delayed': 0.8, 'overdue': 1.2,
+        'cancelled': 1.0, 'canceled': 1.0, 'refund': 0.6, 'rejected': 1.2, 'denied': 1.2,
+        'wrong': 1.0, 'worst': 1.5, 'frustrated': 1.5, 'unacceptable': 1.5, 'outage': 1.2,
+    },
+}
+
+CATEGORY_LEXICON = {
+    'work': [
+        'meeting', 'project', 'deadline', 'report', 'team', 'agenda', 'review', 'client',
+        'presentation', 'schedule', 'quarterly', 'manager', 'proposal', 'sprint', 'standup',
+    ],
+    'finance': [
+        'invoice', 'payment', 'bank', 'account', 'transaction', 'balance', 'tax', 'receipt',
+        'billing', 'salary', 'statement', 'credit', 'loan', 'budget', 'paid',
+    ],
+    'travel': [
+        'flight', 'hotel', 'booking', 'reservation', 'itinerary', 'airport', 'trip', 'boarding',
+        'check-in', 'airline', 'travel', 'visa', 'passport', 'departure', 'arrival',
+    ],
+    'shopping': [
+        'order', 'shipped', 'delivery', 'cart', 'purchase', 'discount', 'sale', 'coupon',
+        'tracking', 'package', 'shipping', 'deal', 'store', 'product', 'checkout',
+    ],
+    'social': [
+        'friend', 'party', 'birthday', 'invitation', 'invite', 'dinner', 'weekend', 'family',
+        'wedding', 'photos', 'celebrate', 'followed', 'liked', 'commented', 'connection',
+    ],
+    'newsletter': [
+        'newsletter', 'unsubscribe', 'subscribe', 'digest', 'weekly', 'edition', 'issue',
+        'subscription', 'preferences', 'webinar', 'announcement', 'update', 'news', 'blog', 'read',
+    ],
+    'support': [
+        'ticket', 'support', 'help', 'request', 'case', 'troubleshoot', 'bug', 'password',
+        'reset', 'login', 'access', 'assistance', 'resolved', 'escalated', 'customer',
+    ],
+}
+
+PRIORITY_LEXICON = {
+    'high': {
+        'urgent': 2.0, 'asap': 2.0, 'important': 1.5, 'critical': 2.0, 'emergency': 2.0,
+        'immediate': 1.5, 'immediately': 1.5, 'deadline': 1.0, 'overdue': 1.2, 'action': 0.5,
+        'required': 0.8, 'outage': 1.5, 'today': 0.4, 'eod': 1.0, 'escalated': 1.2,
+    },
+    'low': {
+        'unsubscribe': 2.0, 'newsletter': 1.5, 'digest': 1.2, 'fyi': 1.0, 'promotion': 1.2,
+        'sale': 0.8, 'discount': 0.8, 'coupon': 1.0, 'webinar': 0.8, 'noreply': 1.5,
+        'no-reply': 1.5, 'weekly': 0.5, 'offer': 0.6, 'deals': 0.8, 'marketing': 1.0,
+    },
+}
+
+# Net priority score at which an email leaves 'normal'
+PRIORITY_THRESHOLD = 1.0
+
+STOPWORDS = frozenset("""
+    a about above after again against all also am an and any are as at be because been before
+    being below between both but by can could did do does doing down during each few for from
+    further get got had has have having he her here hers him his how i if in into is it its
+    just let me more most my no nor not now of off on once only or other our ours out over own
+    please re same she should so some such than that the their them then there these they this
+    those through to too under until up us very was we were what when where which while who
+    whom why will with would you your yours hi hello dear regards best thanks thank fwd sent
+    wrote com www http https
+""".split())
+
+CATEGORIES = list(CATEGORY_LEXICON)
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'\-]{1,30}")
+
+
+@lru_cache(maxsize=200000)
+def _feature(token: str) -> int:
+    # crc32 rather than hash(): indexes must match in every worker process
+    return zlib.crc32(token.encode('utf-8')) % N_FEATURES
+
+
+def _build_weights() -> np.ndarray:
+    """
+    One row per hashed feature, one column per scored label
+
+    Columns: positive, negative, then each category, then high, low.
+    Row 0 is left at zero and used as padding so no email is empty.
+    """
+    columns = ['positive', 'negative'] + CATEGORIES + ['high', 'low']
+    index = {name: i for i, name in enumerate(columns)}
+    weights = np.zeros((N_FEATURES, len(columns)), dtype=np.float32)
+    for label, words in SENTIMENT_LEXICON.items():
+        for word, weight in words.items():
+            weights[_feature(word), index[label]] += weight
+    for label, words in CATEGORY_LEXICON.items():
+        for word in words:
+            weights[_feature(word), index[label]] += 1.0
+    for label, words in PRIORITY_LEXICON.items():
+        for word, weight in words.items():
+            weights[_feature(word), index[label]] += weight
+    weights[0] = 0
+    return weights
+
+
+_weights = None
+
+
+def get_weights() -> np.ndarray:
+    """The weight matrix, built once per process"""
+    global _weights
+    if _weights is None:
+        _weights = _build_weights()
+    return _weights
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def term_counts(subject_tokens: List[str], body_tokens: List[str]) -> Counter:
+    """Token counts with subject tokens weighted, in first-seen order"""
+    counts = Counter(subject_tokens * SUBJECT_WEIGHT)
+    counts.update(body_tokens)
+    return counts
+
+
+def extract_keywords(counts: Counter, limit: int = MAX_KEYWORDS) -> List[str]:
+    """Most frequent content terms; ties go to the term seen first"""
+    # nlargest is stable, like sorted()
+    terms = ((token, n) for token, n in counts.items() if token not in STOPWORDS and not token.isdigit())
+    return [token for token, _ in heapq.nlargest(limit, terms, key=itemgetter(1))]
+
+
+def analyze_batch(emails: Sequence[Tuple[str, str, str]]) -> List[Dict]:
+    """
+    Analyze (sender, subject, body) tuples
+
+    Every email is scored against every model in one gather-and-reduce
+    over the weight matrix, each distinct token weighted by its count, so
+    the per-email Python work is tokenizing and counting.
+
+    Returns:
+        One dict per email with sentiment, category, priority, keywords
+        and the sentiment score
+    """
+    if not emails:
+        return []
+    weights = get_weights()
+    features, multipliers, lengths, keywords, token_counts = [], [], [], [], []
+    for sender, subject, body in emails:
+        subject_tokens = tokenize(subject or '')
+        body_tokens = tokenize((body or '')[:MAX_BODY_CHARS])
+        sender_tokens = tokenize((sender or '').partition('@')[0])
+        counts = term_counts(subject_tokens, body_tokens)
+        feats = [0] + [_feature(token) for token in counts] + [_feature(token) for token in sender_tokens]
+        features.extend(feats)
+        multipliers.append(0)
+        multipliers.extend(counts.values())
+        multipliers.extend([1] * len(sender_tokens))
+        lengths.append(len(feats))
+        token_counts.append(max(len(subject_tokens) + len(body_tokens), 1))
+        keywords.append(extract_keywords(counts))
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rows = weights[np.asarray(features, dtype=np.int64)] * np.asarray(multipliers, dtype=np.float32)[:, None]
+    scores = np.add.reduceat(rows, offsets, axis=0)
+
+    sentiment = (scores[:, 0] - scores[:, 1]) / np.sqrt(np.asarray(token_counts, dtype=np.float32))
+    category_scores = scores[:, 2:2 + len(CATEGORIES)]
+    best_category = category_scores.argmax(axis=1)
+    has_category = category_scores.max(axis=1) > 0
+    priority_score = scores[:, -2] - scores[:, -1]
+
+    results = []
+    for i in range(len(emails)):
+        if sentiment[i] > SENTIMENT_THRESHOLD:
+            label = 'positive'
+        elif sentiment[i] < -SENTIMENT_THRESHOLD:
+            label = 'negative'
+        else:
+            label = 'neutral'
+        if priority_score[i] >= PRIORITY_THRESHOLD:
+            priority = 'high'
+        elif priority_score[i] <= -PRIORITY_THRESHOLD:
+            priority = 'low'
+        else:
+            priority = 'normal'
+        results.append({
+            'sentiment': label,
+            'sentiment_score': round(float(sentiment[i]), 4),
+            'category': CATEGORIES[best_category[i]] if has_category[i] else 'general',
+            'priority': priority,
+            'keywords': keywords[i],
+        })
+    return results
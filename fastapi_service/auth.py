@@ -0,0 +1,57 @@
+"""
+Authentication with the Django API's access tokens
+SimpleJWT signs HS256 tokens with the Django SECRET_KEY, so a token
+issued by /api/auth/login/ is verified here without a database round trip
+"""
+import os
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+
+# Prefix of Django's generated development keys, which are public
+INSECURE_KEY_PREFIX = "django-insecure-"
+
+JWT_ALGORITHM = "HS256"
+
+
+def load_secret_key() -> str:
+    """
+    The Django SECRET_KEY (SimpleJWT's SIGNING_KEY) from the environment
+
+    There is no fallback: with a known key anyone could sign a token for
+    any user_id, so the service refuses to start instead.
+    """
+    key = os.getenv("SECRET_KEY", "")
+    if not key or key.startswith(INSECURE_KEY_PREFIX):
+        raise RuntimeError(
+            "SECRET_KEY must be set to the Django API's secret key (not a django-insecure- default)"
+        )
+    return key
+
+
+JWT_SECRET_KEY = load_secret_key()
+
+bearer = HTTPBearer(auto_error=False)
+
+
+def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> int:
+    """User id from a valid, unexpired access token"""
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication credentials were not provided",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        claims = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        claims = None
+    # Refresh tokens are signed with the same key but must not grant access
+    if not claims or claims.get("token_type") != "access" or "user_id" not in claims:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Given token not valid for any token type",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return int(claims["user_id"])
@@ -0,0 +1,87 @@
+"""
+Throughput benchmark for the analysis engine
+
+    python bench_analysis.py --emails 5000 --batch 500
+
+Measures the engine in-process, then the HTTP endpoints through the app
+(process pool included): one /analyze-email call per email versus
+/analyze-batch calls of --batch emails.
+"""
+import argparse
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from analysis import CATEGORY_LEXICON, PRIORITY_LEXICON, SENTIMENT_LEXICON, analyze_batch, get_weights
+from main import app
+
+FILLER = (
+    'the a we will be on for this that with please let me know about your our next from have '
+    'time work see would like can to of and in is it you'
+).split()
+
+LEXICON = (
+    [word for words in SENTIMENT_LEXICON.values() for word in words]
+    + [word for words in CATEGORY_LEXICON.values() for word in words]
+    + [word for words in PRIORITY_LEXICON.values() for word in words]
+)
+
+
+def generate(count, seed=42):
+    """Emails of 40-400 words, about 1 in 8 of them lexicon words"""
+    rng = random.Random(seed)
+    emails = []
+    for i in range(count):
+        words = [
+            rng.choice(LEXICON) if rng.random() < 0.125 else rng.choice(FILLER)
+            for _ in range(rng.randint(40, 400))
+        ]
+        subject = ' '.join(rng.choice(LEXICON + FILLER) for _ in range(6)).title()
+        emails.append({
+            'email_id': i, 'sender': f'sender{i % 500}@example{i % 40}.com',
+            'subject': subject, 'body': ' '.join(words),
+        })
+    return emails
+
+
+def report(label, count, elapsed):
+    print(f"{label:<36}{elapsed * 1000:>10.0f} ms{count / elapsed:>14,.0f} emails/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--emails', type=int, default=5000, help='Synthetic emails to analyze')
+    parser.add_argument('--batch', type=int, default=500, help='Emails per /analyze-batch call')
+    parser.add_argument('--single', type=int, default=500, help='Emails sent one per /analyze-email call')
+    args = parser.parse_args()
+
+    emails = generate(args.emails)
+    rows = [(email['sender'], email['subject'], email['body']) for email in emails]
+    get_weights()
+
+    print(f"{len(emails):,} emails\n")
+    print(f"{'path':<36}{'elapsed':>13}{'throughput':>21}")
+
+    start = time.perf_counter()
+    analyze_batch(rows)
+    report('engine, one process', len(rows), time.perf_counter() - start)
+
+    with TestClient(app) as client:
+        client.post('/analyze-batch', json={'emails': emails[:10]})
+
+        single = emails[:args.single]
+        start = time.perf_counter()
+        for email in single:
+            client.post('/analyze-email', json=email).raise_for_status()
+        report(f'/analyze-email x {len(single)}', len(single), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(0, len(emails), args.batch):
+            response = client.post('/analyze-batch', json={'emails': emails[i:i + args.batch]})
+            response.raise_for_status()
+        report(f'/analyze-batch, {args.batch} per call', len(emails), time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
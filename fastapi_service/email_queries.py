@@ -0,0 +1,198 @@
+"""
+Read-only mailbox queries against the Django tables
+Every statement is a fixed SQL text with parameters, so asyncpg prepares
+it once per pooled connection and reuses the plan on every later call
+"""
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+# Columns of a list row, in EmailSerializer order minus the body
+LIST_FIELDS = (
+    "id", "thread_id", "sender", "recipient", "subject", "snippet", "priority",
+    "is_read", "is_starred", "is_archived", "is_trashed", "trashed_at", "created_at", "updated_at",
+)
+LIST_COLUMNS = ", ".join(LIST_FIELDS)
+
+# Folder conditions, matching the Django folder filters and badge counts
+FOLDERS = {
+    "inbox": "NOT is_archived AND NOT is_trashed AND NOT is_sent",
+    "unread": "NOT is_read AND NOT is_archived AND NOT is_trashed AND NOT is_sent",
+    "starred": "is_starred AND NOT is_trashed",
+    "sent": "is_sent AND NOT is_trashed",
+    "archived": "is_archived AND NOT is_trashed",
+    "trash": "is_trashed",
+}
+
+# Cold mail is always archived or trashed, so it never shows in these
+HOT_ONLY_FOLDERS = {"inbox", "unread"}
+
+
+def _list_sql(folder: str, after_cursor: bool) -> str:
+    condition = f"user_id = $1 AND {FOLDERS[folder]}"
+    if after_cursor:
+        condition += " AND (created_at, id) < ($3, $4)"
+    page = "ORDER BY created_at DESC, id DESC LIMIT $2"
+    hot = f"SELECT {LIST_COLUMNS}, false AS cold FROM api_email WHERE {condition} {page}"
+    if folder in HOT_ONLY_FOLDERS:
+        return hot
+    cold = f"SELECT {LIST_COLUMNS}, true AS cold FROM api_coldemail WHERE {condition} {page}"
+    return f"({hot}) UNION ALL ({cold}) {page}"
+
+
+# (folder, after a cursor) -> SQL, built once
+LIST_SQL = {
+    (folder, after_cursor): _list_sql(folder, after_cursor)
+    for folder in FOLDERS for after_cursor in (False, True)
+}
+
+LABELS_SQL = (
+    "SELECT el.email_id, l.id, l.name, l.color FROM api_emaillabel el "
+    "JOIN api_label l ON l.id = el.label_id WHERE el.email_id = ANY($1::bigint[]) ORDER BY l.name"
+)
+
+VERSION_SQL = "SELECT version, updated_at FROM api_mailboxstate WHERE user_id = $1"
+
+COUNTS_SQL = """
+SELECT h.inbox, h.unread, h.starred + c.starred AS starred,
+       h.archived + c.archived AS archived, h.trash + c.trash AS trash
+FROM (
+    SELECT count(*) FILTER (WHERE NOT is_archived AND NOT is_trashed AND NOT is_sent) AS inbox,
+           count(*) FILTER (WHERE NOT is_read AND NOT is_archived AND NOT is_trashed AND NOT is_sent) AS unread,
+           count(*) FILTER (WHERE is_starred AND NOT is_trashed) AS starred,
+           count(*) FILTER (WHERE is_archived) AS archived,
+           count(*) FILTER (WHERE is_trashed) AS trash
+    FROM api_email WHERE user_id = $1
+) h, (
+    SELECT count(*) FILTER (WHERE is_starred AND NOT is_trashed) AS starred,
+           count(*) FILTER (WHERE is_archived) AS archived,
+           count(*) FILTER (WHERE is_trashed) AS trash
+    FROM api_coldemail WHERE user_id = $1
+) c
+"""
+
+DETAIL_SQL = (
+    f"SELECT {', '.join('e.' + field for field in LIST_FIELDS)}, c.body_codec, c.body_data, false AS cold "
+    "FROM api_email e LEFT JOIN api_emailcontent c ON c.email_id = e.id "
+    "WHERE e.id = $1 AND e.user_id = $2"
+)
+
+COLD_DETAIL_SQL = (
+    f"SELECT {LIST_COLUMNS}, body_codec, body_data, true AS cold "
+    "FROM api_coldemail WHERE id = $1 AND user_id = $2"
+)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(row) -> str:
+    """Keyset cursor for the row after which the next page starts"""
+    return f"{(row['created_at'] - EPOCH) // timedelta(microseconds=1)}.{row['id']}"
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    micros, _, email_id = cursor.partition(".")
+    if not micros.isdigit() or not email_id.isdigit():
+        return None
+    return EPOCH + timedelta(microseconds=int(micros)), int(email_id)
+
+
+def decompress_body(codec: Optional[str], data: Optional[bytes]) -> str:
+    """Body text from an EmailContent or ColdEmail row (see content_codec)"""
+    if data is None:
+        return ""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed email content")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        data = zlib.decompress(data)
+    return bytes(data).decode("utf-8")
+
+
+def _serialize(row) -> Dict:
+    return {
+        "id": row["id"],
+        "thread": row["thread_id"],
+        "sender": row["sender"],
+        "recipient": row["recipient"],
+        "subject": row["subject"],
+        "snippet": row["snippet"],
+        "priority": row["priority"],
+        "is_read": row["is_read"],
+        "is_starred": row["is_starred"],
+        "is_archived": row["is_archived"],
+        "is_trashed": row["is_trashed"],
+        "trashed_at": row["trashed_at"],
+        "labels": [],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+async def _attach_labels(conn: asyncpg.Connection, emails: List[Dict], rows) -> None:
+    # Labeled mail is never moved to the cold tier
+    hot_ids = [row["id"] for row in rows if not row["cold"]]
+    if not hot_ids:
+        return
+    by_id = {email["id"]: email for email in emails}
+    for label in await conn.fetch(LABELS_SQL, hot_ids):
+        by_id[label["email_id"]]["labels"].append(
+            {"id": label["id"], "name": label["name"], "color": label["color"]}
+        )
+
+
+async def get_version(conn: asyncpg.Connection, user_id: int) -> Tuple[int, Optional[datetime]]:
+    """Mailbox version and when it last changed; (0, None) before the first write"""
+    row = await conn.fetchrow(VERSION_SQL, user_id)
+    return (row["version"], row["updated_at"]) if row else (0, None)
+
+
+async def list_emails(
+    conn: asyncpg.Connection, user_id: int, folder: str, limit: int, cursor: Optional[Tuple[datetime, int]]
+) -> Dict:
+    """
+    One page of a folder, newest first, with keyset pagination
+
+    Returns:
+        dict with 'results' and 'next_cursor' (None on the last page)
+    """
+    if cursor is None:
+        rows = await conn.fetch(LIST_SQL[folder, False], user_id, limit + 1)
+    else:
+        rows = await conn.fetch(LIST_SQL[folder, True], user_id, limit + 1, *cursor)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    emails = [_serialize(row) for row in rows]
+    await _attach_labels(conn, emails, rows)
+    return {
+        "results": emails,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+    }
+
+
+async def get_counts(conn: asyncpg.Connection, user_id: int) -> Dict[str, int]:
+    """Folder badge counts across both tiers, as get_mailbox_counters"""
+    return dict(await conn.fetchrow(COUNTS_SQL, user_id))
+
+
+async def get_email(conn: asyncpg.Connection, user_id: int, email_id: int) -> Optional[Dict]:
+    """One email with its body, from the hot tier or else the cold one"""
+    row = await conn.fetchrow(DETAIL_SQL, email_id, user_id)
+    if row is None:
+        row = await conn.fetchrow(COLD_DETAIL_SQL, email_id, user_id)
+    if row is None:
+        return None
+    email = _serialize(row)
+    email["body"] = decompress_body(row["body_codec"], row["body_data"])
+    await _attach_labels(conn, [email], [row])
+    return email
@@ -0,0 +1,97 @@
+"""
+Load test: inbox polling through Django versus this service
+
+    python load_test.py --username demo --password secret --concurrency 50 --duration 30
+
+Logs in through the Django API, then has --concurrency clients poll the
+inbox first page for --duration seconds against each target in turn:
+Django's EmailViewSet.list (/api/emails/?is_archived=false&is_trashed=false)
+and GET /emails?folder=inbox here. With --revalidate each client sends back
+the ETag it last saw, like a polling client between changes.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def poll(client, url, headers, deadline, revalidate, latencies, errors):
+    etag = None
+    while time.perf_counter() < deadline:
+        request_headers = dict(headers)
+        if revalidate and etag:
+            request_headers["If-None-Match"] = etag
+        start = time.perf_counter()
+        try:
+            response = await client.get(url, headers=request_headers)
+        except httpx.HTTPError:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if response.status_code not in (200, 304):
+            errors.append(response.status_code)
+        etag = response.headers.get("etag", etag)
+
+
+async def run(label, url, token, concurrency, duration, revalidate):
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        # One warm-up request per target (pools, caches, prepared statements)
+        await client.get(url, headers=headers)
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            poll(client, url, headers, deadline, revalidate, latencies, errors)
+            for _ in range(concurrency)
+        ])
+    if not latencies:
+        print(f"{label:<28}no successful requests")
+        return
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(
+        f"{label:<28}{len(latencies) / duration:>10,.0f}{statistics.median(latencies) * 1000:>10.1f} ms"
+        f"{p95 * 1000:>10.1f} ms{len(errors):>9}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--django-url", default="http://localhost:8000")
+    parser.add_argument("--fastapi-url", default="http://localhost:8001")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent polling clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per target")
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match with the last ETag")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        response = await client.post(
+            f"{args.django_url}/api/auth/login/",
+            json={"username": args.username, "password": args.password}
+        )
+        response.raise_for_status()
+        token = response.json()["access"]
+
+    mode = "revalidating" if args.revalidate else "full responses"
+    print(f"{args.concurrency} clients x {args.duration:.0f}s per target, {mode}\n")
+    print(f"{'target':<28}{'req/s':>10}{'p50':>13}{'p95':>13}{'errors':>9}")
+    await run(
+        "Django EmailViewSet.list",
+        f"{args.django_url}/api/emails/?is_archived=false&is_trashed=false",
+        token, args.concurrency, args.duration, args.revalidate
+    )
+    await run(
+        "FastAPI /emails (asyncpg)",
+        # Same page size as the Django API's PAGE_SIZE
+        f"{args.fastapi_url}/emails?folder=inbox&limit=20",
+        token, args.concurrency, args.duration, args.revalidate
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
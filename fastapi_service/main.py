@@ -1,13 +1,45 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+from analysis import analyze_batch, get_weights
+from auth import get_current_user_id
+from db import close_pool, get_pool
+import email_queries
+
+# Worker processes for analysis; the event loop only awaits their results
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+
+# Largest batch accepted by /analyze-batch
+MAX_BATCH_SIZE = int(os.getenv("ANALYSIS_MAX_BATCH", 1000))
+
+# Batches are split across workers, but never into chunks smaller than this
+MIN_CHUNK_SIZE = 50
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers build the weight matrix on start, not on their first request
+    app.state.analysis_pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, initializer=get_weights)
+    yield
+    app.state.analysis_pool.shutdown()
+    await close_pool()
+
 
 app = FastAPI(
     title="InboxPilot FastAPI Service",
     description="High-performance email processing service",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -22,8 +54,9 @@ app.add_middleware(
 
 # Pydantic models
 class EmailAnalysis(BaseModel):
-    email_id: int
+    email_id: Optional[int] = None
     sentiment: str
+    sentiment_score: float
     priority: str
     category: str
     keywords: List[str]
@@ -31,11 +64,45 @@ class EmailAnalysis(BaseModel):
 
 
 class EmailProcessRequest(BaseModel):
+    email_id: Optional[int] = None
     sender: EmailStr
     subject: str
     body: str
 
 
+class BatchAnalysisRequest(BaseModel):
+    emails: List[EmailProcessRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[EmailAnalysis]
+    count: int
+    elapsed_ms: float
+
+
+async def run_analysis(emails: List[EmailProcessRequest]) -> List[EmailAnalysis]:
+    """
+    Analyze emails in the process pool
+
+    Large batches are split so every worker gets a share; results come
+    back in request order.
+    """
+    loop = asyncio.get_running_loop()
+    pool = app.state.analysis_pool
+    rows = [(email.sender, email.subject, email.body) for email in emails]
+    size = max(MIN_CHUNK_SIZE, -(-len(rows) // ANALYSIS_WORKERS))
+    chunks = await asyncio.gather(*[
+        loop.run_in_executor(pool, analyze_batch, rows[start:start + size])
+        for start in range(0, len(rows), size)
+    ])
+    analyzed_at = datetime.now()
+    results = [result for chunk in chunks for result in chunk]
+    return [
+        EmailAnalysis(email_id=email.email_id, analyzed_at=analyzed_at, **result)
+        for email, result in zip(emails, results)
+    ]
+
+
 # Routes
 @app.get("/")
 async def root():
@@ -57,29 +124,144 @@ async def health_check():
 @app.post("/analyze-email", response_model=EmailAnalysis)
 async def analyze_email(email: EmailProcessRequest):
     """
-    Analyze email for sentiment, priority, and category
-    This is a mock implementation - replace with actual ML/AI logic
+    Analyze email for sentiment, priority, category and keywords
+    """
+    results = await run_analysis([email])
+    return results[0]
+
+
+@app.post("/analyze-batch", response_model=BatchAnalysisResponse)
+async def analyze_emails(request: BatchAnalysisRequest):
+    """
+    Analyze up to ANALYSIS_MAX_BATCH emails in one call
     """
-    # Mock analysis logic
-    analysis = EmailAnalysis(
-        email_id=1,
-        sentiment="neutral",
-        priority="medium",
-        category="general",
-        keywords=["email", "inbox"],
-        analyzed_at=datetime.now()
+    start = time.perf_counter()
+    results = await run_analysis(request.emails)
+    return BatchAnalysisResponse(
+        results=results,
+        count=len(results),
+        elapsed_ms=round((time.perf_counter() - start) * 1000, 2)
     )
-    return analysis
 
 
 @app.get("/statistics")
-async def get_statistics():
+async def get_statistics(
+    days: int = Query(30, ge=1, le=365),
+    top_senders: int = Query(10, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id)
+):
     """
-    Get email statistics
+    Get email statistics from the rollup tables the Django API maintains
     """
+    pool = await get_pool()
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    # Three small indexed reads, each on its own pooled connection
+    counters, daily, senders = await asyncio.gather(
+        pool.fetchrow(
+            "SELECT total, unread, starred, high_priority, normal_priority, low_priority, updated_at "
+            "FROM api_mailboxstats WHERE user_id = $1",
+            user_id
+        ),
+        pool.fetch(
+            "SELECT day, received, sent FROM api_dailyemailstats "
+            "WHERE user_id = $1 AND day >= $2 ORDER BY day",
+            user_id, since
+        ),
+        pool.fetch(
+            "SELECT sender, received FROM api_senderstats "
+            "WHERE user_id = $1 ORDER BY received DESC, sender LIMIT $2",
+            user_id, top_senders
+        ),
+    )
+
+    volume = {row["day"]: row for row in daily}
+    series = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = volume.get(day)
+        series.append({
+            "date": day.isoformat(),
+            "received": row["received"] if row else 0,
+            "sent": row["sent"] if row else 0
+        })
     return {
-        "total_emails": 0,
-        "unread_emails": 0,
-        "starred_emails": 0,
-        "spam_emails": 0
+        "total_emails": counters["total"] if counters else 0,
+        "unread_emails": counters["unread"] if counters else 0,
+        "starred_emails": counters["starred"] if counters else 0,
+        "priority": {
+            "high": counters["high_priority"] if counters else 0,
+            "normal": counters["normal_priority"] if counters else 0,
+            "low": counters["low_priority"] if counters else 0
+        },
+        "daily": series,
+        "top_senders": [{"sender": row["sender"], "count": row["received"]} for row in senders],
+        "updated_at": counters["updated_at"] if counters else None
     }
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    return etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+
+
+def _cached_response(etag: str, content=None) -> Response:
+    """JSON response with the same validators as the Django API; no content means 304"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if content is None:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
+
+@app.get("/emails")
+async def list_emails(
+    request: Request,
+    folder: str = Query("inbox", pattern=f"^({'|'.join(email_queries.FOLDERS)})$"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    List a folder, newest first; pass next_cursor back as cursor for the next page
+
+    Unchanged mailboxes get a 304 after one indexed lookup of the mailbox version.
+    """
+    position = email_queries.decode_cursor(cursor) if cursor else None
+    if cursor and position is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        version, _ = await email_queries.get_version(conn, user_id)
+        query = hashlib.md5(f"{folder}|{limit}|{cursor}".encode()).hexdigest()[:16]
+        etag = f'"fm{user_id}-{version}-{query}"'
+        if _etag_matches(request, etag):
+            return _cached_response(etag)
+        page = await email_queries.list_emails(conn, user_id, folder, limit, position)
+    return _cached_response(etag, page)
+
+
+@app.get("/emails/counts")
+async def email_counts(request: Request, user_id: int = Depends(get_current_user_id)):
+    """
+    Folder badge counts (inbox, unread, starred, archived, trash)
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        version, _ = await email_queries.get_version(conn, user_id)
+        etag = f'"fc{user_id}-{version}"'
+        if _etag_matches(request, etag):
+            return _cached_response(etag)
+        counts = await email_queries.get_counts(conn, user_id)
+    return _cached_response(etag, counts)
+
+
+@app.get("/emails/{email_id}")
+async def get_email(request: Request, email_id: int, user_id: int = Depends(get_current_user_id)):
+    """
+    Get one email with its body
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        email = await email_queries.get_email(conn, user_id, email_id)
+    if email is None:
+        raise HTTPException(status_code=404, detail="Not found.")
+    etag = f'"e{email_id}-{int(email["updated_at"].timestamp() * 1000000)}"'
+    return _cached_response(etag, None if _etag_matches(request, etag) else email)
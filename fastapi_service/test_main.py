@@ -0,0 +1,243 @@
+"""
+Test cases for the FastAPI email endpoints
+The asyncpg pool is replaced by an in-memory fake that answers the
+statements in email_queries, so no database is needed
+"""
+import os
+import unittest
+import zlib
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+os.environ.setdefault("SECRET_KEY", "test-secret-key-for-the-fastapi-service-tests")
+
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import auth
+import email_queries
+import main
+
+NOW = datetime(2025, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_row(email_id, minutes_ago, cold=False, **fields):
+    row = {
+        "id": email_id, "thread_id": None, "sender": f"sender{email_id}@example.com",
+        "recipient": "me@example.com", "subject": f"Subject {email_id}", "snippet": "",
+        "priority": "normal", "is_read": False, "is_starred": False, "is_archived": cold,
+        "is_trashed": False, "trashed_at": None, "created_at": NOW - timedelta(minutes=minutes_ago),
+        "updated_at": NOW, "cold": cold, "body_codec": "", "body_data": None,
+    }
+    row.update(fields)
+    return row
+
+
+class FakeConnection:
+    """Answers the email_queries statements from a list of rows"""
+
+    def __init__(self, rows, version=3):
+        self.rows = rows
+        self.version = version
+        self.statements = []
+
+    async def fetchrow(self, sql, *args):
+        self.statements.append(sql)
+        if sql == email_queries.VERSION_SQL:
+            return {"version": self.version, "updated_at": NOW} if self.version else None
+        if sql == email_queries.COUNTS_SQL:
+            return {"inbox": 2, "unread": 1, "starred": 0, "archived": 1, "trash": 0}
+        email_id, user_id = args
+        cold = sql == email_queries.COLD_DETAIL_SQL
+        return next((row for row in self.rows if row["id"] == email_id and row["cold"] == cold), None)
+
+    async def fetch(self, sql, *args):
+        self.statements.append(sql)
+        if sql == email_queries.LABELS_SQL:
+            return []
+        user_id, limit, *cursor = args
+        rows = sorted(self.rows, key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        if cursor:
+            rows = [row for row in rows if (row["created_at"], row["id"]) < tuple(cursor)]
+        return rows[:limit]
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def access_token(user_id=1, token_type="access", key=None, expires_in=300):
+    claims = {
+        "token_type": token_type,
+        "user_id": user_id,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=expires_in),
+    }
+    return jwt.encode(claims, key or auth.JWT_SECRET_KEY, algorithm=auth.JWT_ALGORITHM)
+
+
+class EndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeConnection([
+            make_row(1, 30),
+            make_row(2, 20),
+            make_row(3, 10),
+            make_row(4, 60, cold=True, body_codec="zlib", body_data=zlib.compress("Cold body".encode())),
+            make_row(5, 5, body_data="Hot body".encode()),
+        ])
+        patcher = mock.patch.object(main, "get_pool", mock.AsyncMock(return_value=FakePool(self.conn)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(main.app)
+        self.headers = {"Authorization": f"Bearer {access_token()}"}
+
+
+class AuthTestCase(EndpointTestCase):
+    """Test the Django access-token check"""
+
+    def test_missing_token_rejected(self):
+        """Test requests without a token get a 401"""
+        response = self.client.get("/emails")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.headers["WWW-Authenticate"], "Bearer")
+        print("✅ Test Passed: Missing token rejected")
+
+    def test_invalid_tokens_rejected(self):
+        """Test refresh, expired and foreign-key tokens get a 401"""
+        for token in (
+            access_token(token_type="refresh"),
+            access_token(expires_in=-60),
+            access_token(key="some-other-secret-key"),
+            "not-a-jwt",
+        ):
+            response = self.client.get("/emails", headers={"Authorization": f"Bearer {token}"})
+            self.assertEqual(response.status_code, 401)
+        print("✅ Test Passed: Refresh, expired and foreign tokens rejected")
+
+    def test_access_token_accepted(self):
+        """Test a valid access token reaches the endpoint"""
+        response = self.client.get("/emails", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        print("✅ Test Passed: Access token accepted")
+
+    def test_insecure_secret_key_refused(self):
+        """Test the service will not start with a missing or development key"""
+        for key in ("", "django-insecure-abc123"):
+            with mock.patch.dict(os.environ, {"SECRET_KEY": key}):
+                with self.assertRaises(RuntimeError):
+                    auth.load_secret_key()
+        print("✅ Test Passed: Insecure secret key refused")
+
+
+class EmailListTestCase(EndpointTestCase):
+    """Test /emails and /emails/counts"""
+
+    def test_keyset_pages(self):
+        """Test pages follow next_cursor, newest first, across both tiers"""
+        response = self.client.get("/emails?limit=2&folder=archived", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([email["id"] for email in page["results"]], [5, 3])
+        self.assertIsNotNone(page["next_cursor"])
+
+        seen = [email["id"] for email in page["results"]]
+        while page["next_cursor"]:
+            page = self.client.get(
+                f"/emails?limit=2&folder=archived&cursor={page['next_cursor']}", headers=self.headers
+            ).json()
+            seen += [email["id"] for email in page["results"]]
+        self.assertEqual(seen, [5, 3, 2, 1, 4])
+        print("✅ Test Passed: Keyset pages follow the cursor")
+
+    def test_etag_revalidation(self):
+        """Test an unchanged mailbox answers If-None-Match with a 304"""
+        response = self.client.get("/emails", headers=self.headers)
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Vary"], "Authorization")
+
+        self.conn.statements.clear()
+        response = self.client.get("/emails", headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.conn.statements, [email_queries.VERSION_SQL])
+
+        self.conn.version += 1
+        response = self.client.get("/emails", headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        print("✅ Test Passed: ETag revalidation")
+
+    def test_invalid_parameters(self):
+        """Test a malformed cursor is a 400 and an unknown folder a 422"""
+        response = self.client.get("/emails?cursor=abc", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/emails?folder=spam", headers=self.headers)
+        self.assertEqual(response.status_code, 422)
+        print("✅ Test Passed: Invalid parameters rejected")
+
+    def test_counts(self):
+        """Test folder badge counts"""
+        response = self.client.get("/emails/counts", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["inbox"], 2)
+        response = self.client.get(
+            "/emails/counts", headers={**self.headers, "If-None-Match": response.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+        print("✅ Test Passed: Folder counts")
+
+
+class EmailDetailTestCase(EndpointTestCase):
+    """Test /emails/{id}"""
+
+    def test_hot_email(self):
+        """Test a hot email is returned with its body"""
+        response = self.client.get("/emails/5", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["body"], "Hot body")
+        self.assertEqual(self.conn.statements, [email_queries.DETAIL_SQL, email_queries.LABELS_SQL])
+        print("✅ Test Passed: Hot email detail")
+
+    def test_cold_email_fallback(self):
+        """Test an email moved to the cold tier is found and decompressed"""
+        response = self.client.get("/emails/4", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["body"], "Cold body")
+        self.assertIn(email_queries.COLD_DETAIL_SQL, self.conn.statements)
+        print("✅ Test Passed: Cold email fallback")
+
+    def test_missing_email(self):
+        """Test an unknown id is a 404"""
+        response = self.client.get("/emails/99", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        print("✅ Test Passed: Missing email is a 404")
+
+
+class QueryTestCase(unittest.TestCase):
+    """Test the SQL helpers"""
+
+    def test_cursor_round_trip(self):
+        """Test cursors decode to the row they were made from"""
+        row = {"created_at": NOW + timedelta(microseconds=123), "id": 42}
+        self.assertEqual(email_queries.decode_cursor(email_queries.encode_cursor(row)), (row["created_at"], 42))
+        for cursor in ("", "abc", "12.x", "-1.2"):
+            self.assertIsNone(email_queries.decode_cursor(cursor))
+        print("✅ Test Passed: Cursor round trip")
+
+    def test_hot_only_folders(self):
+        """Test inbox and unread never read the cold table"""
+        for (folder, _), sql in email_queries.LIST_SQL.items():
+            self.assertEqual("api_coldemail" in sql, folder not in email_queries.HOT_ONLY_FOLDERS)
+            self.assertIn("ORDER BY created_at DESC, id DESC", sql)
+        print("✅ Test Passed: Hot-only folders skip the cold table")
+
+
+if __name__ == "__main__":
+    unittest.main()